@@ -82,7 +82,16 @@ translation_dict = {
             ('Operator', 'Align filter off') : 'Disattiva allinea filtro',
             ('Operator', 'Hide holes') : 'Nascondi fori',
             ('Operator', 'Prepare model') : 'Prepara modello',
-            ('Operator', 'Place holes') : 'Posiziona fori'
+            ('Operator', 'Place holes') : 'Posiziona fori',
+            ('*', 'Show the mask border while painting') : 'Mostra il bordo della maschera durante la pittura',
+            ('Operator', 'Border preview on') : 'Attiva anteprima bordo',
+            ('Operator', 'Border preview off') : 'Disattiva anteprima bordo',
+            ('Operator', 'Decimated scan') : 'Scansione decimata',
+            ('Operator', 'Automatic area') : 'Area automatica',
+            ('Operator', 'Cut along border') : 'Taglia lungo il bordo',
+            ('*', 'Cut the faces along the border of the active Vertex Group') : 'Taglia le facce lungo il bordo del Gruppo di Vertici attivo',
+            ('*', 'Define the mask area from the nose and the chin of the scan') : "Definisci l'area della maschera dal naso e dal mento della scansione",
+            ('*', 'Import a STL or OBJ scan, decimating it while reading') : 'Importa una scansione STL o OBJ riducendone la risoluzione durante la lettura'
         },
         'es' : {
             ('Operator', 'Adapt mask') : 'Adaptar máscara',
@@ -128,7 +137,16 @@ translation_dict = {
             ('Operator', 'Align filter off') : 'Desactivar alineación filtro',
             ('Operator', 'Hide holes') : 'Ocultar hoyos',
             ('Operator', 'Prepare model') : 'Preparar modelo',
-            ('Operator', 'Place holes') : 'Colocar hoyos'
+            ('Operator', 'Place holes') : 'Colocar hoyos',
+            ('*', 'Show the mask border while painting') : 'Mostrar el borde de la máscara mientras se pinta',
+            ('Operator', 'Border preview on') : 'Activar vista previa del borde',
+            ('Operator', 'Border preview off') : 'Desactivar vista previa del borde',
+            ('Operator', 'Decimated scan') : 'Escaneo diezmado',
+            ('Operator', 'Automatic area') : 'Área automática',
+            ('Operator', 'Cut along border') : 'Cortar a lo largo del borde',
+            ('*', 'Cut the faces along the border of the active Vertex Group') : 'Cortar las caras a lo largo del borde del Grupo de Vértices activo',
+            ('*', 'Define the mask area from the nose and the chin of the scan') : 'Definir el área de la máscara a partir de la nariz y el mentón del escaneo',
+            ('*', 'Import a STL or OBJ scan, decimating it while reading') : 'Importar un escaneo STL u OBJ reduciendo su resolución durante la lectura'
         }
     }
 
@@ -137,19 +155,28 @@ if "bpy" in locals():
     import importlib
     importlib.reload(myfacemask_tools)
     importlib.reload(utils)
+    importlib.reload(contour)
+    importlib.reload(mesh_io)
 
 else:
     from . import myfacemask_tools
     from . import utils
+    from . import contour
+    from . import mesh_io
 
 import bpy
 from bpy.props import PointerProperty, CollectionProperty, BoolProperty
 
 classes = (
+    myfacemask_tools.myfacemask_import_scan,
+    myfacemask_tools.myfacemask_import_stl,
+    myfacemask_tools.myfacemask_export_stl,
     myfacemask_tools.myfacemask_remesh,
     myfacemask_tools.myfacemask_adapt_mask,
     myfacemask_tools.myfacemask_weight_toggle,
+    myfacemask_tools.myfacemask_auto_area,
     myfacemask_tools.myfacemask_weight_add_subtract,
+    myfacemask_tools.myfacemask_border_preview,
     myfacemask_tools.myfacemask_mirror_border,
     myfacemask_tools.myfacemask_mirror_border_flip,
     myfacemask_tools.myfacemask_boolean,
@@ -160,6 +187,8 @@ classes = (
     myfacemask_tools.myfacemask_tag_mask_off,
     myfacemask_tools.myfacemask_generate_tag,
     myfacemask_tools.myfacemask_setup,
+    myfacemask_tools.myfacemask_cut_border,
+    myfacemask_tools.myfacemask_preferences,
     myfacemask_tools.MYFACEMASK_PT_weight
 )
 
@@ -168,10 +197,14 @@ def register():
     for cls in classes:
         bpy.utils.register_class(cls)
     bpy.types.Scene.myfacemask_id = bpy.props.StringProperty(name='ID', description='Identification code to manually emboss on the surface')
+    myfacemask_tools.load_preferences()
+    utils.mesh_arrays_register()
     bpy.app.translations.register(__name__, translation_dict)
 
 def unregister():
     from bpy.utils import unregister_class
+    myfacemask_tools.border_preview_stop()
+    utils.mesh_arrays_unregister()
     for cls in classes:
         bpy.utils.unregister_class(cls)
     bpy.app.translations.unregister(__name__)
@@ -0,0 +1,215 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# ------------------------------ Batch Masks --------------------------------- #
+#                                                                              #
+# Headless pipeline, from the scans to the STL masks:                          #
+#                                                                              #
+#   blender -b -P batch.py -- --input scans_dir --output masks_dir             #
+#                                                                              #
+# The area of every scan (.stl or .obj) is read from <scan>.area.npy, an      #
+# (n, 4) array of points with the weight of the mask area (x, y, z, weight),   #
+# or generated from the nose and the chin when the file is missing.            #
+# The IDs are read from <input>/ids.json ({"scan": "ID"}), otherwise the scan  #
+# name is used. The scans are processed by a pool of Blender processes, each   #
+# one writes <output>/<scan>.json and all the results are collected in         #
+# <output>/manifest.json with the timings of every stage and the failures.     #
+#                                                                              #
+# ############################################################################ #
+
+import os, sys, json, time, argparse, importlib, subprocess, traceback
+from concurrent.futures import ThreadPoolExecutor
+
+scan_extensions = ('.stl', '.obj')
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='blender -b -P batch.py --',
+        description="Generate MyFaceMask masks from a directory of scans")
+    parser.add_argument('--input', required=True, help="Directory of the scans")
+    parser.add_argument('--output', required=True, help="Directory of the masks")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+        help="Blender processes running at the same time")
+    parser.add_argument('--scan', default='', help=argparse.SUPPRESS)
+    parser.add_argument('--cell-size', type=float, default=0,
+        help="Decimate the scans while importing them (mm), 0 to import the full resolution")
+    parser.add_argument('--target-faces', type=int, default=100000,
+        help="Faces of the remeshed scans")
+    parser.add_argument('--timeout', type=float, default=600,
+        help="Maximum time for every scan (sec)")
+    return parser.parse_args(argv)
+
+def scan_id(input_dir, name):
+    try:
+        with open(os.path.join(input_dir, 'ids.json')) as f:
+            return str(json.load(f).get(name, name))
+    except (OSError, ValueError):
+        return name
+
+def process_scan(path, output_dir, cell_size=0, target_faces=100000):
+    '''
+    Run the whole pipeline on a scan in the current Blender process.
+    Returns the result with the time of every stage and the eventual error.
+    '''
+    import bpy
+    import numpy as np
+    from . import myfacemask_tools as tools
+    from . import utils, mesh_io
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    result = {'scan': path, 'name': name, 'id': scan_id(os.path.dirname(path), name),
+        'stages': {}, 'output': None, 'error': None}
+
+    def stage(label, function):
+        start_time = time.time()
+        result['stage'] = label
+        function()
+        result['stages'][label] = round(time.time() - start_time, 3)
+
+    def setup():
+        data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'MyFaceMask.blend')
+        bpy.ops.wm.open_mainfile(filepath=data_path)
+        scene = bpy.data.scenes['MyFaceMask']
+        for window in bpy.context.window_manager.windows: window.scene = scene
+        if bpy.context.scene != scene:
+            raise RuntimeError("Can't activate the MyFaceMask scene")
+        scene.unit_settings.length_unit = 'MILLIMETERS'
+        scene.unit_settings.scale_length = 0.001
+        scene.myfacemask_id = result['id']
+
+    def load():
+        if cell_size > 0:
+            vertices, triangles = mesh_io.read_decimated(path, cell_size)
+        else:
+            vertices, triangles = mesh_io.read_welded(path)
+        tools.new_scan_object(bpy.context, name, vertices, triangles)
+
+    def remesh():
+        bpy.ops.object.myfacemask_remesh(detail_mode='OCTREE', target='FACES', target_faces=target_faces)
+
+    def area():
+        area_path = os.path.splitext(path)[0] + '.area.npy'
+        if not os.path.exists(area_path):
+            if bpy.ops.object.myfacemask_auto_area() != {'FINISHED'}:
+                raise RuntimeError("The mask area can't be found, the scan is not aligned")
+            return
+        points = np.load(area_path)
+        ob = bpy.data.objects['Face']
+        vertices = np.array(utils.get_vertices_numpy(ob.data))
+        weight = utils.transfer_weights(points[:,:3], points[:,3], vertices)
+        utils.set_weight_numpy(ob, 'Area', weight)
+
+    def adapt():
+        ob = bpy.data.objects['Face']
+        bpy.context.view_layer.objects.active = ob
+        bpy.ops.object.mode_set(mode='WEIGHT_PAINT')
+        if bpy.ops.object.myfacemask_adapt_mask() != {'FINISHED'}:
+            raise RuntimeError("The mask border can't be extracted")
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+    def boolean():
+        if bpy.ops.object.myfacemask_boolean() != {'FINISHED'}:
+            raise RuntimeError("The mask can't be prepared for printing")
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+    def export():
+        filepath = os.path.join(output_dir, bpy.path.clean_name(result['id']) + '.stl')
+        tools.export_stl(bpy.data.objects['Mask'], filepath)
+        result['output'] = filepath
+
+    try:
+        for label, function in (('setup', setup), ('import', load), ('remesh', remesh),
+                ('area', area), ('adapt', adapt), ('boolean', boolean), ('export', export)):
+            stage(label, function)
+        result.pop('stage')
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    return result
+
+def run_worker(args, path):
+    '''
+    Process a scan in a new Blender process, returns its result
+    '''
+    import bpy
+    name = os.path.splitext(os.path.basename(path))[0]
+    result_path = os.path.join(args.output, name + '.json')
+    if os.path.exists(result_path): os.remove(result_path)
+    command = [bpy.app.binary_path, '-b', '--factory-startup', '-P', os.path.realpath(__file__), '--',
+        '--input', args.input, '--output', args.output, '--scan', path,
+        '--cell-size', str(args.cell_size), '--target-faces', str(args.target_faces)]
+    start_time = time.time()
+    process = None
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            timeout=args.timeout, universal_newlines=True)
+        with open(result_path) as f:
+            result = json.load(f)
+    except subprocess.TimeoutExpired:
+        result = {'scan': path, 'name': name, 'error': 'Timeout after {} sec'.format(args.timeout)}
+    except (OSError, ValueError) as e:
+        # the worker crashed before writing its result
+        if process is None:
+            result = {'scan': path, 'name': name, 'error': str(e)}
+        else:
+            result = {'scan': path, 'name': name, 'log': process.stdout.splitlines()[-20:],
+                'error': 'Blender exited with code {}'.format(process.returncode)}
+    result['time'] = round(time.time() - start_time, 3)
+    print("MyFaceMask batch: {} {} in {:.1f} sec".format(name, result.get('error') or 'done', result['time']))
+    return result
+
+def main(argv):
+    args = parse_args(argv)
+    args.input = os.path.realpath(args.input)
+    args.output = os.path.realpath(args.output)
+    os.makedirs(args.output, exist_ok=True)
+
+    # worker: a single scan in this process
+    if args.scan:
+        result = process_scan(args.scan, args.output, args.cell_size, args.target_faces)
+        name = os.path.splitext(os.path.basename(args.scan))[0]
+        with open(os.path.join(args.output, name + '.json'), 'w') as f:
+            json.dump(result, f, indent=2)
+        return
+
+    scans = sorted(os.path.join(args.input, f) for f in os.listdir(args.input)
+        if f.lower().endswith(scan_extensions))
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        results = list(pool.map(lambda path: run_worker(args, path), scans))
+    manifest = {
+        'input': args.input,
+        'output': args.output,
+        'workers': args.workers,
+        'time': round(time.time() - start_time, 3),
+        'done': sum(1 for r in results if not r.get('error')),
+        'failed': sum(1 for r in results if r.get('error')),
+        'scans': results
+        }
+    with open(os.path.join(args.output, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print("MyFaceMask batch: {} masks, {} failed, {:.1f} sec".format(manifest['done'], manifest['failed'], manifest['time']))
+
+if __name__ == "__main__":
+    # run by Blender as a script, import the add-on package from its folder
+    addon_dir = os.path.dirname(os.path.realpath(__file__))
+    sys.path.insert(0, os.path.dirname(addon_dir))
+    addon = importlib.import_module(os.path.basename(addon_dir))
+    addon.register()
+    batch = importlib.import_module(os.path.basename(addon_dir) + '.batch')
+    argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    batch.main(argv)
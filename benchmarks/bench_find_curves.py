@@ -0,0 +1,61 @@
+# Timings of the contour polylines assembly, outside Blender:
+#
+#   python benchmarks/bench_find_curves.py [segments ...]
+#
+# find_curves is timed with the NumPy walk and, when numba is installed, with
+# the compiled one. The dict implementation is skipped above dict_max segments.
+
+import os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import contour
+
+dict_max = 100000
+
+def random_segments(n_segments, curve_length=200, seed=0):
+    '''
+    Shuffled segments of open and closed polylines, with permuted vertices
+    '''
+    rng = np.random.default_rng(seed)
+    n_curves = max(n_segments//curve_length, 1)
+    lengths = np.full(n_curves, n_segments//n_curves)
+    lengths[:n_segments % n_curves] += 1
+    edges = []
+    n_verts = 0
+    for i, n in enumerate(lengths):
+        closed = i % 2 == 1
+        verts = np.arange(n_verts, n_verts + n + (0 if closed else 1))
+        n_verts += len(verts)
+        curve = np.append(verts, verts[0]) if closed else verts
+        edges.append(np.stack((curve[:-1], curve[1:]), axis=1))
+    edges = np.concatenate(edges)
+    edges = rng.permutation(n_verts)[edges]
+    return edges[rng.permutation(len(edges))], n_verts
+
+def timed(function, *args):
+    start_time = time.time()
+    function(*args)
+    return time.time() - start_time
+
+def main(argv):
+    sizes = [int(n) for n in argv] or [10000, 100000, 1000000]
+    nb = contour.nb
+    if nb is not None:
+        # compile before timing
+        edges, n_verts = random_segments(1000)
+        contour.find_curves(edges, n_verts)
+    print("{:>10} {:>12} {:>12} {:>12}".format('segments', 'numpy', 'numba', 'dict'))
+    for n_segments in sizes:
+        edges, n_verts = random_segments(n_segments)
+        contour.nb = None
+        numpy_time = "{:.3f}s".format(timed(contour.find_curves, edges, n_verts))
+        contour.nb = nb
+        numba_time = "{:.3f}s".format(timed(contour.find_curves, edges, n_verts)) if nb else '-'
+        if n_segments <= dict_max:
+            dict_time = "{:.3f}s".format(timed(contour.find_curves_dict, edges.tolist(), n_verts))
+        else: dict_time = '-'
+        print("{:>10} {:>12} {:>12} {:>12}".format(n_segments, numpy_time, numba_time, dict_time))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,65 @@
+# Timings of the Vertex Groups reading, run inside Blender:
+#
+#   blender -b --factory-startup -P benchmarks/bench_weights.py -- 1000000
+#
+# or with the bpy module installed: python benchmarks/bench_weights.py
+
+import os, sys, time, importlib
+import numpy as np
+import bpy, bmesh
+
+addon_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.dirname(addon_dir))
+utils = importlib.import_module(os.path.basename(addon_dir) + '.utils')
+
+def weight_loop(vertex_group, n_verts):
+    # reference per-vertex loop
+    weight = [0]*n_verts
+    for i in range(n_verts):
+        try: weight[i] = vertex_group.weight(i)
+        except: pass
+    return np.array(weight)
+
+def weight_object(n_verts, n_groups=3):
+    me = bpy.data.meshes.new('Bench')
+    me.vertices.add(n_verts)
+    rng = np.random.default_rng(0)
+    me.vertices.foreach_set('co', (rng.random(n_verts*3)*200).astype('float32'))
+    ob = bpy.data.objects.new('Bench', me)
+    bpy.context.scene.collection.objects.link(ob)
+    weights = np.zeros((n_groups, n_verts))
+    for g in range(n_groups):
+        vertex_group = ob.vertex_groups.new(name='Group_{}'.format(g))
+        index = np.flatnonzero(rng.random(n_verts) < 0.7)
+        weight = np.round(rng.random(len(index)), 3)
+        for value in np.unique(weight):
+            vertex_group.add(index[weight == value].tolist(), float(value), 'REPLACE')
+        weights[g, index] = weight
+    return ob, weights
+
+def main(argv):
+    sizes = [int(n) for n in argv] or [100000, 1000000]
+    print("{:>10} {:>12} {:>12} {:>12} {:>10}".format('vertices', 'loop', 'evaluated', 'bmesh', 'error'))
+    for n_verts in sizes:
+        ob, weights = weight_object(n_verts)
+        groups = list(range(len(weights)))
+        start_time = time.time()
+        loop = np.array([weight_loop(ob.vertex_groups[g], n_verts) for g in groups])
+        loop_time = time.time() - start_time
+        start_time = time.time()
+        evaluated = utils.get_weights_numpy(ob, groups)
+        evaluated_time = time.time() - start_time
+        bm = bmesh.new()
+        bm.from_mesh(ob.data)
+        start_time = time.time()
+        utils.get_weights_numpy(ob, groups, bm)
+        bmesh_time = time.time() - start_time
+        bm.free()
+        error = max(np.abs(evaluated - weights).max(), np.abs(loop - weights).max())
+        print("{:>10} {:>11.3f}s {:>11.3f}s {:>11.3f}s {:>10.1e}".format(n_verts, loop_time, evaluated_time, bmesh_time, error))
+        me = ob.data
+        bpy.data.objects.remove(ob)
+        bpy.data.meshes.remove(me)
+
+if __name__ == "__main__":
+    main(sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else sys.argv[1:])
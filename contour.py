@@ -0,0 +1,951 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# ---------------------------- Contour Curves -------------------------------- #
+#                                                                              #
+# Pure NumPy contouring core. It doesn't depend on bpy, so it can be imported  #
+# as a standalone module outside of Blender (worker processes, profilers).     #
+#                                                                              #
+# ############################################################################ #
+
+import numpy as np
+try: import scipy.sparse as sparse
+except: sparse = None
+try: import numexpr as ne
+except: ne = None
+try: from . import numba_functions as nb
+except:
+    # contour.py used outside the add-on
+    try: import numba_functions as nb
+    except: nb = None
+
+def find_curves_dict(edges, n_verts):
+    verts_dict = {key:[] for key in range(n_verts)}
+    for e in edges:
+        verts_dict[e[0]].append(e[1])
+        verts_dict[e[1]].append(e[0])
+    curves = []
+    while True:
+        if len(verts_dict) == 0: break
+        # next starting point
+        v = list(verts_dict.keys())[0]
+        # neighbors
+        v01 = verts_dict[v]
+        if len(v01) == 0:
+            verts_dict.pop(v)
+            continue
+        curve = []
+        if len(v01) > 1: curve.append(v01[1])    # add neighbors
+        curve.append(v)         # add starting point
+        curve.append(v01[0])    # add neighbors
+        verts_dict.pop(v)
+        # start building curve
+        while True:
+            #last_point = curve[-1]
+            #if last_point not in verts_dict: break
+
+            # try to change direction if needed
+            if curve[-1] in verts_dict: pass
+            elif curve[0] in verts_dict: curve.reverse()
+            else: break
+
+            # neighbors points
+            last_point = curve[-1]
+            v01 = verts_dict[last_point]
+
+            # curve end
+            if len(v01) == 1:
+                verts_dict.pop(last_point)
+                if curve[0] in verts_dict: continue
+                else: break
+
+            # chose next point
+            new_point = None
+            if v01[0] == curve[-2]: new_point = v01[1]
+            elif v01[1] == curve[-2]: new_point = v01[0]
+            #else: break
+
+            #if new_point != curve[1]:
+            curve.append(new_point)
+            verts_dict.pop(last_point)
+            if curve[0] == curve[-1]:
+                verts_dict.pop(new_point)
+                break
+        curves.append(curve)
+    return curves
+
+def ranges_indexes(starts, totals):
+    '''
+    Concatenation of the ranges [starts[i], starts[i]+totals[i])
+    '''
+    totals = np.asarray(totals, dtype='int')
+    offsets = np.repeat(np.asarray(starts, dtype='int') - np.cumsum(totals) + totals, totals)
+    return offsets + np.arange(totals.sum())
+
+def edges_adjacency(edges, n_verts):
+    '''
+    CSR adjacency of the vertices. The edges connected to the vertex i are
+    adj_edges[indptr[i]:indptr[i+1]], leading to the vertices adj_verts[...]
+    '''
+    edges = np.asarray(edges, dtype='int').reshape((-1,2))
+    n_edges = len(edges)
+    ends = edges.reshape(-1)
+    order = np.argsort(ends, kind='stable')
+    adj_edges = order // 2
+    adj_verts = edges[adj_edges, 1 - order % 2]
+    indptr = np.zeros(n_verts + 1, dtype='int')
+    np.cumsum(np.bincount(ends, minlength=n_verts), out=indptr[1:])
+    return indptr, adj_edges, adj_verts
+
+def connected_components(edges, n_verts):
+    '''
+    Label the connected components with an union-find, hooking roots by
+    minimum label and compressing paths with pointer jumping.
+    Every vertex is labelled with the smallest vertex index of its component.
+    '''
+    edges = np.asarray(edges, dtype='int').reshape((-1,2))
+    parent = np.arange(n_verts)
+    a, b = edges[:,0], edges[:,1]
+    while True:
+        pa, pb = parent[a], parent[b]
+        if (pa == pb).all(): break
+        np.minimum.at(parent, np.maximum(pa, pb), np.minimum(pa, pb))
+        while True:
+            grand_parent = parent[parent]
+            if (grand_parent == parent).all(): break
+            parent = grand_parent
+    return parent
+
+def find_curves(edges, n_verts):
+    '''
+    Assemble segments in ordered polylines, in linear time.
+    Returns a list of int arrays of vertices indexes. Closed curves repeat
+    the first vertex at the end.
+    '''
+    edges = np.asarray(edges, dtype='int').reshape((-1,2))
+    if len(edges) == 0: return []
+    n_verts = max(n_verts, int(edges.max()) + 1)
+    indptr, adj_edges, adj_verts = edges_adjacency(edges, n_verts)
+    degree = np.diff(indptr)
+    labels = connected_components(edges, n_verts)
+
+    # one starting point for each component, open ends have the priority
+    used = np.flatnonzero(degree)
+    priority = np.where(degree[used] % 2 == 1, 0, 1)
+    used = used[np.lexsort((used, priority, labels[used]))]
+    first = np.ones(len(used), dtype='bool')
+    first[1:] = labels[used][1:] != labels[used][:-1]
+    starts = used[first].tolist()
+    # eventual branching points are resolved starting again from them
+    starts += np.flatnonzero(degree > 2).tolist()
+
+    if nb is not None:
+        curves, curves_start = nb.numba_walk_curves(indptr, adj_edges, adj_verts,
+            np.array(starts, dtype='int'), len(edges))
+        return np.split(curves, curves_start[1:-1])
+    indptr = indptr.tolist()
+    adj_edges = adj_edges.tolist()
+    adj_verts = adj_verts.tolist()
+    cursor = list(indptr[:-1])
+    visited = [False]*len(edges)
+    curves = []
+    for start in starts:
+        while True:
+            curve = [start]
+            v = start
+            while True:
+                # next unvisited edge of the vertex
+                i = cursor[v]
+                end = indptr[v+1]
+                while i < end and visited[adj_edges[i]]: i += 1
+                cursor[v] = i
+                if i == end: break
+                visited[adj_edges[i]] = True
+                v = adj_verts[i]
+                curve.append(v)
+            if len(curve) == 1: break
+            curves.append(np.array(curve, dtype='int'))
+    return curves
+
+def iso_edges_index(w0, w1, iso_values):
+    '''
+    Index the edges crossed by every iso value, each edge is visited once.
+    An edge is crossed by all the iso values in the interval (w_min, w_max],
+    that is a contiguous range of the sorted iso values.
+    The edges crossed by iso_values[i] are edges[indptr[i]:indptr[i+1]].
+    '''
+    iso_values = np.sort(iso_values)
+    first = np.searchsorted(iso_values, np.minimum(w0, w1), side='right')
+    last = np.searchsorted(iso_values, np.maximum(w0, w1), side='right')
+    count = last - first
+    edges = np.flatnonzero(count)
+    count = count[edges]
+    # expand every edge on its range of levels
+    levels = np.repeat(first[edges] - np.cumsum(count) + count, count)
+    levels += np.arange(count.sum())
+    edges = np.repeat(edges, count)
+    order = np.argsort(levels, kind='stable')
+    indptr = np.zeros(len(iso_values)+1, dtype='int')
+    np.cumsum(np.bincount(levels, minlength=len(iso_values)), out=indptr[1:])
+    return indptr, edges[order]
+
+class ContourMesh:
+    '''
+    Topology of a polygonal mesh stored as flat arrays, computed once and
+    shared by all the contour levels.
+    vertices: (n_verts, 3) coordinates
+    edges: (n_edges, 2) vertices indexes
+    loop_start, loop_total: polygons as ranges of loops
+    loop_verts, loop_edges: vertex and edge index of every loop
+    normals: optional (n_verts, 3) normals, used by the pattern displace
+    '''
+    def __init__(self, vertices, edges, loop_start, loop_total, loop_verts, loop_edges, normals=None):
+        self.vertices = np.asarray(vertices, dtype='float')
+        self.normals = normals
+        self.edges = np.asarray(edges, dtype='int').reshape((-1,2))
+        self.loop_start = np.asarray(loop_start, dtype='int')
+        self.loop_total = np.asarray(loop_total, dtype='int')
+        self.loop_verts = np.asarray(loop_verts, dtype='int')
+        self.loop_edges = np.asarray(loop_edges, dtype='int')
+        self.loop_faces = np.repeat(np.arange(len(self.loop_start)), self.loop_total)
+        # loops of every edge, as CSR
+        n_edges = len(self.edges)
+        self.edges_loops = np.argsort(self.loop_edges, kind='stable')
+        self.edges_indptr = np.zeros(n_edges+1, dtype='int')
+        np.cumsum(np.bincount(self.loop_edges, minlength=n_edges), out=self.edges_indptr[1:])
+        # edges of every vertex, as CSR, computed when needed
+        self.verts_indptr = None
+        self.verts_edges = None
+        # neighbors averaging operator, computed when needed
+        self.degree = None
+        self.average = None
+
+    def same_topology(self, vertices, edges, loop_start, loop_verts):
+        '''
+        Check if the given arrays describe the same mesh
+        '''
+        return (np.array_equal(self.vertices, vertices) and
+            np.array_equal(self.edges, edges) and
+            np.array_equal(self.loop_start, loop_start) and
+            np.array_equal(self.loop_verts, loop_verts))
+
+    def faces_range(self, weight, faces=None):
+        '''
+        Minimum and maximum weight of every face, or of the given faces
+        '''
+        if faces is None:
+            loops_weight = weight[self.loop_verts]
+            starts = self.loop_start
+        else:
+            totals = self.loop_total[faces]
+            loops_weight = weight[self.loop_verts[ranges_indexes(self.loop_start[faces], totals)]]
+            starts = np.cumsum(totals) - totals
+        if len(starts) == 0: return np.zeros(0), np.zeros(0)
+        fw_min = np.minimum.reduceat(loops_weight, starts)
+        fw_max = np.maximum.reduceat(loops_weight, starts)
+        return fw_min, fw_max
+
+    def neighbors_mean(self, values):
+        '''
+        Mean of the values of the connected vertices. It uses a sparse matrix
+        when SciPy is available.
+        '''
+        n_verts = len(self.vertices)
+        a, b = self.edges[:,0], self.edges[:,1]
+        if self.average is None:
+            degree = np.bincount(self.edges.reshape(-1), minlength=n_verts)
+            self.degree = degree
+            if sparse:
+                rows = np.concatenate((a, b))
+                cols = np.concatenate((b, a))
+                data = 1 / degree[rows]
+                self.average = sparse.csr_matrix((data, (rows, cols)), shape=(n_verts, n_verts))
+            else:
+                self.average = False
+        if self.average is not False:
+            mean = self.average @ values
+        else:
+            mean = np.bincount(a, weights=values[b], minlength=n_verts)
+            mean += np.bincount(b, weights=values[a], minlength=n_verts)
+            mean /= np.maximum(self.degree, 1)
+        # isolated vertices keep their value
+        isolated = self.degree == 0
+        mean[isolated] = values[isolated]
+        return mean
+
+    def smooth(self, weight, iterations=5, factor=0.5, strength=1):
+        '''
+        Laplacian smoothing of the weight. A new array is returned.
+        factor: lambda of every iteration, w += factor * (mean - w)
+        strength: blend between the original and the smoothed weight
+        '''
+        weight = np.asarray(weight, dtype='float')
+        smooth = weight.copy()
+        for i in range(iterations):
+            smooth += factor * (self.neighbors_mean(smooth) - smooth)
+        return weight + (smooth - weight) * strength
+
+    def edges_around(self, verts):
+        '''
+        Edges connected to the given vertices
+        '''
+        if self.verts_indptr is None:
+            self.verts_indptr, self.verts_edges, _ = edges_adjacency(self.edges, len(self.vertices))
+        starts = self.verts_indptr[verts]
+        totals = self.verts_indptr[verts+1] - starts
+        return np.unique(self.verts_edges[ranges_indexes(starts, totals)])
+
+    def faces_around(self, edges_index):
+        '''
+        Faces adjacent to the given edges
+        '''
+        starts = self.edges_indptr[edges_index]
+        totals = self.edges_indptr[edges_index+1] - starts
+        loops = self.edges_loops[ranges_indexes(starts, totals)]
+        return np.unique(self.loop_faces[loops])
+
+    def crossed_faces(self, edges_index, fw_min, fw_max, iso_val):
+        # faces adjacent to the splitted edges
+        faces = self.faces_around(edges_index)
+        # faces crossed by the iso value
+        mask = np.logical_and(fw_min[faces] < iso_val, iso_val < fw_max[faces])
+        return faces[mask]
+
+    def segments(self, edges_index, faces, verts_count=0, return_faces=False):
+        '''
+        Join the new vertices of the splitted edges crossing the given faces.
+        The new vertex of edges_index[i] has index i + verts_count.
+        return_faces: return also the face of every segment
+        '''
+        if len(edges_index) == 0 or len(faces) == 0:
+            segments = np.zeros((0,2), dtype='int')
+            return (segments, np.zeros(0, dtype='int')) if return_faces else segments
+        order = np.argsort(edges_index, kind='stable')
+        sorted_edges = edges_index[order]
+        if nb is not None:
+            segments, segments_face = nb.numba_pair_segments(self.loop_start,
+                self.loop_total, self.loop_edges, faces, sorted_edges, order, verts_count)
+            return (segments, segments_face) if return_faces else segments
+        # loops of the given faces, in face order
+        faces_total = self.loop_total[faces]
+        loops = ranges_indexes(self.loop_start[faces], faces_total)
+        loops_face = np.repeat(np.arange(len(faces)), faces_total)
+        # new vertex index for every splitted edge
+        loops_edge = self.loop_edges[loops]
+        id = np.searchsorted(sorted_edges, loops_edge).clip(max=len(sorted_edges)-1)
+        mask = sorted_edges[id] == loops_edge
+        loops_vert = order[id] + verts_count
+        # a face is crossed an even number of times, skip the degenerate ones
+        faces_count = np.bincount(loops_face[mask], minlength=len(faces))
+        mask = np.logical_and(mask, faces_count[loops_face] % 2 == 0)
+        # consecutive crossings of the same face are joined
+        segments = loops_vert[mask].reshape((-1,2))
+        if return_faces:
+            return segments, faces[loops_face[mask][::2]]
+        return segments
+
+    def contour(self, weight, iso_values, pattern_weight=None, displace=0, limit_z=False):
+        '''
+        Extract the iso-contours of the weight. Returns, for every iso value,
+        the new vertices (n, 3) and the segments (m, 2) joining them.
+        displace: pattern displace strength, a value for every iso value or
+            a single value for all of them
+        '''
+        weight = np.asarray(weight, dtype='float')
+        iso_values = np.asarray(iso_values, dtype='float').reshape(-1)
+        displace = np.broadcast_to(displace, iso_values.shape)
+        fw_min, fw_max = self.faces_range(weight)
+        # index once the edges crossed by every iso value
+        levels = np.unique(iso_values)
+        edges_weight = weight[self.edges]
+        iso_indptr, iso_edges = iso_edges_index(edges_weight[:,0], edges_weight[:,1], levels)
+        contours = []
+        for iso_val, disp in zip(iso_values, displace):
+            level = np.searchsorted(levels, iso_val)
+            edges_index = iso_edges[iso_indptr[level]:iso_indptr[level+1]]
+            if len(edges_index) == 0:
+                contours.append((np.zeros((0,3)), np.zeros((0,2), dtype='int')))
+                continue
+            verts = contour_edges(self, edges_index, weight, iso_val, pattern_weight, disp, limit_z)
+            faces = self.crossed_faces(edges_index, fw_min, fw_max, iso_val)
+            contours.append((verts, self.segments(edges_index, faces)))
+        return contours
+
+class IncrementalContour:
+    '''
+    Contour of a single iso value that can be patched after local changes of
+    the weights. Only the edges connected to the changed vertices and their
+    faces are evaluated again.
+    The state is stored per splitted edge (sorted edges_index and verts) and
+    per segment (pairs of splitted edges and their face).
+    '''
+    def __init__(self, mesh, weight, iso_val, pattern_weight=None, displace=0, limit_z=False):
+        self.mesh = mesh
+        self.iso_val = iso_val
+        self.displace = displace
+        self.limit_z = limit_z
+        self.weight = np.array(weight, dtype='float')
+        self.pattern_weight = None if pattern_weight is None else np.array(pattern_weight, dtype='float')
+        w = self.weight[mesh.edges]
+        edges_index = np.flatnonzero(np.logical_xor(w[:,0] < iso_val, w[:,1] < iso_val))
+        fw_min, fw_max = mesh.faces_range(self.weight)
+        faces = mesh.crossed_faces(edges_index, fw_min, fw_max, iso_val)
+        self._set_edges(edges_index, self._interpolate(edges_index))
+        segments, self.segments_face = mesh.segments(self.edges_index, faces, return_faces=True)
+        self.segments_edges = self.edges_index[segments]
+
+    def _interpolate(self, edges_index):
+        return contour_edges(self.mesh, edges_index, self.weight, self.iso_val, self.pattern_weight, self.displace, self.limit_z)
+
+    def _set_edges(self, edges_index, verts):
+        order = np.argsort(edges_index, kind='stable')
+        self.edges_index = edges_index[order]
+        self.verts = verts[order]
+
+    @property
+    def segments(self):
+        return np.searchsorted(self.edges_index, self.segments_edges)
+
+    def update(self, weight, pattern_weight=None):
+        '''
+        Patch the contour with the new weights.
+        Returns the number of changed vertices.
+        '''
+        weight = np.asarray(weight, dtype='float')
+        changed = weight != self.weight
+        if pattern_weight is not None and self.pattern_weight is not None:
+            pattern_weight = np.asarray(pattern_weight, dtype='float')
+            changed = np.logical_or(changed, pattern_weight != self.pattern_weight)
+            self.pattern_weight = pattern_weight.copy()
+        changed = np.flatnonzero(changed)
+        if len(changed) == 0: return 0
+        self.weight = weight.copy()
+        mesh = self.mesh
+        iso_val = self.iso_val
+        # edges and faces around the changed vertices
+        edges = mesh.edges_around(changed)
+        faces = mesh.faces_around(edges)
+        # splitted edges
+        w = weight[mesh.edges[edges]]
+        new_edges = edges[np.logical_xor(w[:,0] < iso_val, w[:,1] < iso_val)]
+        keep = np.logical_not(np.isin(self.edges_index, edges))
+        edges_index = np.concatenate((self.edges_index[keep], new_edges))
+        verts = np.concatenate((self.verts[keep], self._interpolate(new_edges)))
+        self._set_edges(edges_index, verts)
+        # segments
+        keep = np.logical_not(np.isin(self.segments_face, faces))
+        fw_min, fw_max = mesh.faces_range(weight, faces)
+        faces = faces[np.logical_and(fw_min < iso_val, iso_val < fw_max)]
+        segments, segments_face = mesh.segments(self.edges_index, faces, return_faces=True)
+        self.segments_edges = np.concatenate((self.segments_edges[keep], self.edges_index[segments]))
+        self.segments_face = np.concatenate((self.segments_face[keep], segments_face))
+        return len(changed)
+
+def crossed_edges(mesh, weight, iso_val):
+    '''
+    Sorted indexes of the edges crossed by the iso value, the new vertices
+    of split_faces follow the same order
+    '''
+    w = weight[mesh.edges]
+    return np.flatnonzero(np.logical_xor(w[:,0] < iso_val, w[:,1] < iso_val))
+
+def nudge_iso_value(weight, iso_val, eps=1e-5):
+    '''
+    Move the iso value away from the weights of the vertices, to the middle
+    of the widest gap between the weights closer than eps. No vertex lies on
+    the iso-line, so the split edges never have zero length.
+    '''
+    weight = np.asarray(weight, dtype='float')
+    near = weight[np.abs(weight - iso_val) < eps]
+    if not np.any(near == iso_val): return iso_val
+    values = np.unique(np.concatenate((near, [iso_val - eps, iso_val + eps])))
+    gap = int(np.argmax(np.diff(values)))
+    return (values[gap] + values[gap+1])/2
+
+def split_faces(mesh, weight, iso_val, return_origin=False):
+    '''
+    Cut the mesh along the iso value. Every face crossed by the iso-line is
+    replaced by one polygon for each run of vertices between two crossings
+    and, for faces crossed more than twice, by a middle polygon joining all
+    the crossings.
+    Returns the new vertices (old ones followed by the new ones), the faces
+    as loop_start, loop_total, loop_verts, the weight of the new vertices and
+    the side of every face (False below, True above the iso value).
+    return_origin: return also the original face of every new face
+    '''
+    weight = np.asarray(weight, dtype='float')
+    edges_index = crossed_edges(mesh, weight, iso_val)
+    if len(edges_index) == 0:
+        # nothing to cut
+        fw_min, fw_max = mesh.faces_range(weight)
+        split = (mesh.vertices, mesh.loop_start, mesh.loop_total, mesh.loop_verts, weight, fw_min >= iso_val)
+        if return_origin: split += (np.arange(len(mesh.loop_start)),)
+        return split
+    new_verts = contour_edges(mesh, edges_index, weight, iso_val)
+    n_verts = len(mesh.vertices)
+    faces = mesh.faces_around(edges_index)
+    keep = np.ones(len(mesh.loop_start), dtype='bool')
+    keep[faces] = False
+    keep = np.flatnonzero(keep)
+
+    # ring of every crossed face: each vertex followed by the eventual new
+    # vertex of its edge
+    faces_total = mesh.loop_total[faces]
+    loops = ranges_indexes(mesh.loop_start[faces], faces_total)
+    loops_face = np.repeat(np.arange(len(faces)), faces_total)
+    id = np.searchsorted(edges_index, mesh.loop_edges[loops]).clip(max=len(edges_index)-1)
+    crossed = edges_index[id] == mesh.loop_edges[loops]
+    tokens = np.stack((mesh.loop_verts[loops], id + n_verts), axis=1).reshape(-1)
+    tokens_cross = np.stack((np.zeros(len(loops), dtype='bool'), crossed), axis=1).reshape(-1)
+    tokens_face = np.repeat(loops_face, 2)
+    mask = np.stack((np.ones(len(loops), dtype='bool'), crossed), axis=1).reshape(-1)
+    tokens, tokens_cross, tokens_face = tokens[mask], tokens_cross[mask], tokens_face[mask]
+
+    # rotate every ring to start with a crossing
+    ring_total = np.bincount(tokens_face, minlength=len(faces))
+    ring_start = np.cumsum(ring_total) - ring_total
+    position = np.arange(len(tokens)) - ring_start[tokens_face]
+    cross_ids = np.flatnonzero(tokens_cross)
+    first = position[cross_ids[np.unique(tokens_face[cross_ids], return_index=True)[1]]]
+    rotated = ring_start[tokens_face] + (position - first[tokens_face]) % ring_total[tokens_face]
+    order = np.empty(len(tokens), dtype='int')
+    order[rotated] = np.arange(len(tokens))
+    tokens, tokens_cross, tokens_face = tokens[order], tokens_cross[order], tokens_face[order]
+
+    # runs polygons: a crossing, the following vertices and the next crossing
+    runs = np.cumsum(tokens_cross) - 1
+    runs_first = np.flatnonzero(tokens_cross)
+    runs_face = tokens_face[runs_first]
+    next_first = np.roll(runs_first, -1)
+    last_run = np.append(runs_face[1:] != runs_face[:-1], True)
+    next_first[last_run] = ring_start[runs_face[last_run]]
+    runs_total = np.bincount(runs, minlength=len(runs_first)) + 1
+    runs_verts = np.empty(runs_total.sum(), dtype='int')
+    runs_start = np.cumsum(runs_total) - runs_total
+    inner = np.arange(len(tokens)) - runs_first[runs] + runs_start[runs]
+    runs_verts[inner] = tokens
+    runs_verts[runs_start + runs_total - 1] = tokens[next_first]
+    # a run is on the side of its first original vertex
+    runs_side = weight[tokens[runs_first + 1]] >= iso_val
+
+    # middle polygons of the faces crossed more than twice
+    cross_count = np.bincount(runs_face, minlength=len(faces))
+    middle = cross_count[runs_face] > 2
+    middle_faces = np.flatnonzero(cross_count > 2)
+    middle_total = cross_count[middle_faces]
+    middle_verts = tokens[runs_first[middle]]
+    mw_min, mw_max = mesh.faces_range(weight, faces[middle_faces])
+    middle_side = (mw_min + mw_max)/2 >= iso_val
+
+    # new mesh
+    keep_total = mesh.loop_total[keep]
+    keep_verts = mesh.loop_verts[ranges_indexes(mesh.loop_start[keep], keep_total)]
+    fw_min, fw_max = mesh.faces_range(weight, keep)
+    loop_total = np.concatenate((keep_total, runs_total, middle_total))
+    loop_start = np.cumsum(loop_total) - loop_total
+    loop_verts = np.concatenate((keep_verts, runs_verts, middle_verts))
+    vertices = np.concatenate((mesh.vertices, new_verts))
+    weight = np.concatenate((weight, np.full(len(new_verts), iso_val)))
+    faces_side = np.concatenate((fw_min >= iso_val, runs_side, middle_side))
+    split = (vertices, loop_start, loop_total, loop_verts, weight, faces_side)
+    if return_origin:
+        split += (np.concatenate((keep, faces[runs_face], faces[middle_faces])),)
+    return split
+
+def contour_kernel_numpy(v0, v1, w0, w1, iso_val, n0=None, n1=None, pattern0=None, pattern1=None, displace=0, limit_z=False):
+    '''
+    Reference kernel: position of the iso value between v0 and v1, eventually
+    displaced along the interpolated normals by the interpolated pattern.
+    '''
+    param = np.expand_dims((iso_val-w0)/(w1-w0), axis=1)
+    verts = v0 + (v1-v0)*param
+    if n0 is not None:
+        norm = n0 + (n1-n0)*param
+        disp = (pattern0 + (pattern1-pattern0)*param) * displace
+        if limit_z: disp *= 1-abs(norm[:,2:])
+        verts = verts + norm*disp
+    return verts
+
+def contour_kernel_numexpr(v0, v1, w0, w1, iso_val, n0=None, n1=None, pattern0=None, pattern1=None, displace=0, limit_z=False):
+    '''
+    Same as contour_kernel_numpy, evaluated by numexpr in a single multithreaded
+    pass without temporary arrays
+    '''
+    param = ne.evaluate('(iso_val-w0)/(w1-w0)')[:,None]
+    if n0 is None:
+        return ne.evaluate('v0 + (v1-v0)*param')
+    nz0 = n0[:,2:]
+    nz1 = n1[:,2:]
+    limit = float(limit_z)
+    disp = ne.evaluate('(pattern0 + (pattern1-pattern0)*param) * displace * (1 - limit*abs(nz0 + (nz1-nz0)*param))')
+    return ne.evaluate('v0 + (v1-v0)*param + (n0 + (n1-n0)*param)*disp')
+
+def contour_kernel_numba(v0, v1, w0, w1, iso_val, n0=None, n1=None, pattern0=None, pattern1=None, displace=0, limit_z=False):
+    '''
+    Same as contour_kernel_numpy, compiled by numba
+    '''
+    if n0 is None:
+        return nb.numba_contour_kernel(v0, v1, w0, w1, float(iso_val))
+    return nb.numba_contour_kernel_displace(v0, v1, w0, w1, float(iso_val), n0, n1,
+        pattern0.reshape(-1), pattern1.reshape(-1), float(displace), bool(limit_z))
+
+contour_kernels = {'NUMPY': contour_kernel_numpy}
+if ne is not None: contour_kernels['NUMEXPR'] = contour_kernel_numexpr
+if nb is not None: contour_kernels['NUMBA'] = contour_kernel_numba
+
+# 'AUTO' uses numba when available, otherwise numexpr for the arrays big
+# enough to benefit from its threads
+contour_backend = 'AUTO'
+numexpr_min_size = 20000
+
+def set_contour_backend(backend='AUTO', threads=0):
+    '''
+    Select the contour kernel: 'AUTO', 'NUMPY', 'NUMEXPR' or 'NUMBA'. An
+    unavailable backend falls back to 'AUTO'.
+    threads: numexpr and numba threads, 0 for all the cores
+    '''
+    global contour_backend
+    contour_backend = backend if backend in contour_kernels else 'AUTO'
+    if ne is not None:
+        ne.set_num_threads(threads if threads > 0 else ne.detect_number_of_cores())
+    if nb is not None:
+        import numba
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS) if threads > 0 else numba.config.NUMBA_NUM_THREADS)
+    return contour_backend
+
+def get_contour_kernel(size=0):
+    if contour_backend != 'AUTO':
+        return contour_kernels[contour_backend]
+    if 'NUMBA' in contour_kernels:
+        return contour_kernels['NUMBA']
+    if 'NUMEXPR' in contour_kernels and size >= numexpr_min_size:
+        return contour_kernels['NUMEXPR']
+    return contour_kernels['NUMPY']
+
+def contour_edges(mesh, edges_index, weight, iso_val, pattern_weight=None, displace=0, limit_z=False):
+    '''
+    Interpolate the position of the iso value along the given edges, eventually
+    displaced along the normals by the pattern weight.
+    '''
+    id0 = mesh.edges[edges_index,0]
+    id1 = mesh.edges[edges_index,1]
+    args = (mesh.vertices[id0], mesh.vertices[id1], weight[id0], weight[id1], iso_val)
+    if displace != 0 and pattern_weight is not None and mesh.normals is not None:
+        args += (mesh.normals[id0], mesh.normals[id1],
+            np.expand_dims(pattern_weight[id0], axis=1),
+            np.expand_dims(pattern_weight[id1], axis=1),
+            displace, limit_z)
+    return get_contour_kernel(len(edges_index))(*args)
+
+curves_stats_dtype = np.dtype([
+    ('n_points', 'int64'),
+    ('cyclic', 'bool'),
+    ('bbox_min', 'float64', 3),
+    ('bbox_max', 'float64', 3),
+    ('length', 'float64'),
+    ('area', 'float64'),
+    ('centroid', 'float64', 3)
+    ])
+
+def curves_stats(verts, curves):
+    '''
+    Statistics of every curve, computed in a single pass on the concatenated
+    curves. Returns a structured array (see curves_stats_dtype). The area
+    is the vector area enclosed by the closed curves, 0 for the open ones.
+    curves: list of vertices indexes, closed curves repeat the first index
+    '''
+    stats = np.zeros(len(curves), dtype=curves_stats_dtype)
+    if len(curves) == 0: return stats
+    totals = np.array([len(c) for c in curves])
+    starts = np.cumsum(totals) - totals
+    ends = starts + totals - 1
+    ids = np.concatenate(curves).astype('int')
+    cyclic = np.logical_and(ids[starts] == ids[ends], totals > 2)
+    pts = verts[ids]
+    # next point of every point, the last one goes back to the first
+    next_pts = np.roll(pts, -1, axis=0)
+    next_pts[ends] = pts[starts]
+    open_ends = ends[np.logical_not(cyclic)]
+    dist = np.linalg.norm(next_pts - pts, axis=1)
+    dist[open_ends] = 0
+    length = np.add.reduceat(dist, starts)
+    cross = np.cross(pts, next_pts)
+    cross[open_ends] = 0
+    area = np.linalg.norm(np.add.reduceat(cross, starts, axis=0), axis=1) / 2
+    area[np.logical_not(cyclic)] = 0
+    # centroid of the segments, weighted by their length
+    mid = (pts + next_pts) / 2 * np.expand_dims(dist, axis=1)
+    centroid = np.add.reduceat(mid, starts, axis=0)
+    mean = np.add.reduceat(pts, starts, axis=0) / np.expand_dims(totals, axis=1)
+    valid = length > 0
+    centroid[valid] /= np.expand_dims(length[valid], axis=1)
+    centroid[np.logical_not(valid)] = mean[np.logical_not(valid)]
+
+    stats['n_points'] = totals
+    stats['cyclic'] = cyclic
+    stats['bbox_min'] = np.minimum.reduceat(pts, starts, axis=0)
+    stats['bbox_max'] = np.maximum.reduceat(pts, starts, axis=0)
+    stats['length'] = length
+    stats['area'] = area
+    stats['centroid'] = centroid
+    return stats
+
+def rank_curves(stats, rule='SIZE_X', closed_first=False):
+    '''
+    Order of the curves from the best to the worst, according to:
+    'SIZE_X' extent along X, 'LENGTH' arc length, 'AREA' enclosed area,
+    'BBOX' diagonal of the bounding box.
+    closed_first: the closed curves come before the open ones
+    '''
+    size = stats['bbox_max'] - stats['bbox_min']
+    if rule == 'SIZE_X': key = size[:,0]
+    elif rule == 'LENGTH': key = stats['length']
+    elif rule == 'AREA': key = stats['area']
+    elif rule == 'BBOX': key = np.linalg.norm(size, axis=1)
+    else: raise ValueError("Unknown ranking rule: " + str(rule))
+    order = np.argsort(-key, kind='stable')
+    if closed_first:
+        order = order[np.argsort(np.logical_not(stats['cyclic'][order]), kind='stable')]
+    return order
+
+def faces_area(vertices, loop_start, loop_total, loop_verts, chunk_size=1000000):
+    '''
+    Area of every polygon, from the length of its vector area. The faces are
+    processed in chunks of about chunk_size loops, so the temporary arrays
+    don't grow with the mesh.
+    '''
+    loop_start = np.asarray(loop_start, dtype='int')
+    loop_total = np.asarray(loop_total, dtype='int')
+    loop_verts = np.asarray(loop_verts)
+    area = np.zeros(len(loop_start))
+    # first face of every chunk
+    bounds = np.searchsorted(np.cumsum(loop_total), np.arange(chunk_size, loop_total.sum(), chunk_size))
+    bounds = np.unique(np.concatenate(([0], bounds, [len(loop_start)])))
+    for f0, f1 in zip(bounds[:-1], bounds[1:]):
+        totals = loop_total[f0:f1]
+        starts = np.cumsum(totals) - totals
+        verts = np.asarray(vertices[loop_verts[ranges_indexes(loop_start[f0:f1], totals)]], dtype='float')
+        # next loop of every loop, the last one of each face goes back to the first
+        next_loop = np.arange(1, len(verts) + 1)
+        next_loop[starts + totals - 1] = starts
+        cross = np.cross(verts, verts[next_loop])
+        area[f0:f1] = np.linalg.norm(np.add.reduceat(cross, starts, axis=0), axis=1)/2
+    return area
+
+def fit_plane(points, cyclic=True, outliers=3, iterations=2):
+    '''
+    Robust plane fitting of a polyline. The normal is the smallest principal
+    axis of the points, oriented as the Newell normal of the polyline. The
+    points farther from the plane than outliers times the median distance are
+    rejected and the plane is fitted again.
+    Returns the centroid, the normal and two in-plane axes.
+    '''
+    pts = np.asarray(points, dtype='float')
+    mask = np.ones(len(pts), dtype='bool')
+    for i in range(iterations+1):
+        centroid = pts[mask].mean(axis=0)
+        # fewer than three points need the full basis
+        axis_u, axis_v, normal = np.linalg.svd(pts[mask] - centroid, full_matrices=mask.sum() < 3)[2]
+        if i == iterations: break
+        dist = abs((pts - centroid) @ normal)
+        new_mask = dist <= outliers * np.median(dist)
+        if new_mask.sum() < 3 or np.array_equal(new_mask, mask): break
+        mask = new_mask
+    # orientation of the polyline
+    pts = pts - centroid
+    cross = np.cross(pts, np.roll(pts, -1, axis=0))
+    if not cyclic: cross = cross[:-1]
+    if cross.sum(axis=0) @ normal < 0: normal = -normal
+    axis_v = np.cross(normal, axis_u)
+    return centroid, normal, axis_u, axis_v
+
+### FACE LANDMARKS ###
+# the scan is expected aligned in world space, looking towards -Y with Z up
+
+def face_front(vertices, normals=None):
+    '''
+    Front direction of a face scan: the normal of the plane fitted to the
+    vertices, oriented as the average vertex normal. When the normals don't
+    tell the side (closed shells, no normals) it points to the side that
+    protrudes the most from the plane, where the nose is.
+    '''
+    vertices = np.asarray(vertices, dtype='float')
+    centroid, front = fit_plane(vertices, cyclic=False)[:2]
+    side = 0
+    if normals is not None:
+        side = np.asarray(normals, dtype='float').mean(axis=0) @ front
+    if abs(side) < 0.1:
+        dist = (vertices - centroid) @ front
+        side = dist.max() + dist.min()
+    if side < 0: front = -front
+    return front
+
+def is_face_aligned(vertices, normals=None, max_angle=30):
+    '''
+    True if the front of the scan (see face_front) is within max_angle
+    degrees from -Y. The up direction is not verified.
+    '''
+    if len(vertices) < 3: return False
+    return -face_front(vertices, normals)[1] >= np.cos(np.radians(max_angle))
+
+def face_landmarks(vertices, symmetry_width=20, chin_range=(45, 110)):
+    '''
+    Nose tip and chin of an aligned face scan, looking towards -Y with Z up.
+    The nose tip is the most protruding point, the chin is the most
+    protruding point close to the symmetry plane in the given range of
+    distances (mm) below the nose. Returns the two vertices indexes.
+    '''
+    vertices = np.asarray(vertices)
+    nose = int(np.argmin(vertices[:,1]))
+    dx = np.abs(vertices[:,0] - vertices[nose,0])
+    dz = vertices[nose,2] - vertices[:,2]
+    candidates = np.flatnonzero((dx < symmetry_width) & (dz > chin_range[0]) & (dz < chin_range[1]))
+    if len(candidates) == 0: return nose, -1
+    chin = int(candidates[np.argmin(vertices[candidates,1])])
+    return nose, chin
+
+def mask_area_weight(vertices, edges, normals=None, top=0.6, bottom=0.15, width=0.95, depth=1.3, chin_distance=65):
+    '''
+    Weight of the area covered by the mask on an aligned face scan (see
+    face_landmarks and is_face_aligned). The area is an ellipse in the
+    frontal plane from above the nose tip to below the chin, the sizes are
+    relative to the nose-chin distance. Only the front facing vertices not too far behind the nose,
+    connected to it, are included.
+    Returns the weights (1 inside, 0 outside), nose and chin indexes.
+    '''
+    vertices = np.asarray(vertices, dtype='float')
+    nose, chin = face_landmarks(vertices)
+    x0, y0, z0 = vertices[nose]
+    z1 = vertices[chin,2] if chin > -1 else z0 - chin_distance
+    d = z0 - z1
+    upper = z0 + top*d
+    lower = z1 - bottom*d
+    cz = (upper + lower)/2
+    a = width*d
+    b = (upper - lower)/2
+    inside = ((vertices[:,0] - x0)/a)**2 + ((vertices[:,2] - cz)/b)**2 <= 1
+    inside &= vertices[:,1] < y0 + depth*d
+    if normals is not None:
+        inside &= np.asarray(normals)[:,1] < 0.3
+    # keep the part connected to the nose
+    edges = np.asarray(edges, dtype='int').reshape((-1,2))
+    edges = edges[inside[edges[:,0]] & inside[edges[:,1]]]
+    labels = connected_components(edges, len(vertices))
+    weight = (inside & (labels == labels[nose])).astype('float')
+    return weight, nose, chin
+
+def clean_polyline(pts, merge_distance):
+    '''
+    Remove the points closer than merge_distance along the polyline. A point
+    is kept every time the arc length crosses a multiple of merge_distance.
+    '''
+    if merge_distance <= 0 or len(pts) < 2: return pts
+    dist = np.linalg.norm(pts - np.roll(pts,1,axis=0), axis=1)
+    bins = np.floor(np.cumsum(dist) / merge_distance)
+    mask = np.diff(bins, prepend=0) > 0
+    return pts[mask]
+
+def resample_polyline(pts, step, cyclic=False):
+    '''
+    Uniform arc length resampling. The new points lie on the segments of the
+    original polyline, so a contour stays on the surface.
+    '''
+    if step <= 0 or len(pts) < 2: return pts
+    if cyclic: pts = np.concatenate((pts, pts[:1]))
+    seg = np.linalg.norm(np.diff(pts, axis=0), axis=1)
+    length = np.concatenate(([0], np.cumsum(seg)))
+    n_pts = max(int(round(length[-1] / step)), 3 if cyclic else 2)
+    if cyclic: t = np.arange(n_pts) * length[-1] / n_pts
+    else: t = np.linspace(0, length[-1], n_pts)
+    i = (np.searchsorted(length, t, side='right') - 1).clip(0, len(seg)-1)
+    param = (t - length[i]) / np.where(seg[i] > 0, seg[i], 1)
+    return pts[i] + (pts[i+1] - pts[i]) * np.expand_dims(param, axis=1)
+
+def simplify_polyline(pts, tolerance, cyclic=False):
+    '''
+    Douglas-Peucker simplification, only original points are kept. All the
+    spans are split at the same time, one level of recursion for iteration.
+    '''
+    if tolerance <= 0 or len(pts) < 3: return pts
+    if cyclic: pts = np.concatenate((pts, pts[:1]))
+    n_pts = len(pts)
+    keep = np.zeros(n_pts, dtype='bool')
+    keep[0] = keep[-1] = True
+    if cyclic:
+        # split the loop at the farthest point from the first one
+        far = np.argmax(np.linalg.norm(pts - pts[0], axis=1))
+        keep[far] = True
+        starts = np.array([0, far])
+        ends = np.array([far, n_pts-1])
+    else:
+        starts = np.array([0])
+        ends = np.array([n_pts-1])
+    while True:
+        totals = ends - starts - 1
+        mask = totals > 0
+        starts, ends, totals = starts[mask], ends[mask], totals[mask]
+        if len(starts) == 0: break
+        # distance of the inner points from the chord of their span
+        inner = ranges_indexes(starts+1, totals)
+        span = np.repeat(np.arange(len(starts)), totals)
+        a = pts[starts][span]
+        ab = pts[ends][span] - a
+        ap = pts[inner] - a
+        l2 = np.einsum('ij,ij->i', ab, ab)
+        param = (np.einsum('ij,ij->i', ap, ab) / np.where(l2 > 0, l2, 1)).clip(0, 1)
+        dist = np.linalg.norm(ap - ab * np.expand_dims(param, axis=1), axis=1)
+        # farthest point of every span
+        dist_max = np.maximum.reduceat(dist, np.cumsum(totals) - totals)
+        hit = np.flatnonzero(dist == dist_max[span])
+        split = inner[hit[np.unique(span[hit], return_index=True)[1]]]
+        mask = dist_max > tolerance
+        split = split[mask]
+        keep[split] = True
+        starts, ends = np.concatenate((starts[mask], split)), np.concatenate((split, ends[mask]))
+    pts = pts[keep]
+    return pts[:-1] if cyclic else pts
+
+def polylines(verts, segments, skip_open=False, merge_distance=0, step=0, tolerance=0):
+    '''
+    Ordered polylines from unordered segments, eventually cleaned, resampled
+    with the given step and simplified with the given tolerance.
+    Returns a list of (points, cyclic) tuples. Cyclic polylines don't repeat
+    the first point.
+    '''
+    curves = []
+    for c in find_curves(segments, len(verts)):
+        cyclic = bool(c[0] == c[-1]) and len(c) > 2
+        if skip_open and not cyclic: continue
+        pts = verts[c[:-1]] if cyclic else verts[c]
+        curves.append((process_polyline(pts, cyclic, merge_distance, step, tolerance), cyclic))
+    return curves
+
+def process_polyline(pts, cyclic=False, merge_distance=0, step=0, tolerance=0):
+    pts = clean_polyline(pts, merge_distance)
+    pts = resample_polyline(pts, step, cyclic)
+    return simplify_polyline(pts, tolerance, cyclic)
+
+def contour_polylines(vertices, edges, loop_start, loop_total, loop_verts, loop_edges, weight, iso_values, skip_open=False, merge_distance=0, step=0, tolerance=0, **kwargs):
+    '''
+    Ordered iso-contours of a weight field over a polygonal mesh, from plain
+    arrays. Returns a list of polylines for every iso value, see polylines().
+    Additional keyword arguments are passed to ContourMesh.contour().
+    '''
+    mesh = ContourMesh(vertices, edges, loop_start, loop_total, loop_verts, loop_edges, kwargs.pop('normals', None))
+    contours = mesh.contour(weight, iso_values, **kwargs)
+    return [polylines(verts, segments, skip_open, merge_distance, step, tolerance) for verts, segments in contours]
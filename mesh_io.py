@@ -0,0 +1,253 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# ------------------------------- Mesh I/O ----------------------------------- #
+#                                                                              #
+# Pure NumPy readers of the scan files. Like contour.py it doesn't depend on   #
+# bpy. The scans are read in chunks of triangles and can be decimated while    #
+# reading, so the full resolution mesh is never stored in memory.              #
+#                                                                              #
+# ############################################################################ #
+
+import os, re
+import numpy as np
+
+stl_dtype = np.dtype([
+    ('normal', '<f4', 3),
+    ('vertices', '<f4', (3,3)),
+    ('attribute', '<u2')
+    ])
+
+def is_binary_stl(path):
+    '''
+    A binary STL has an 80 bytes header, the triangles count and 50 bytes
+    for every triangle. ASCII files can start with "solid" as well, so the
+    size is checked.
+    '''
+    size = os.path.getsize(path)
+    if size < 84: return False
+    with open(path, 'rb') as f:
+        f.seek(80)
+        count = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+    return size == 84 + count*stl_dtype.itemsize
+
+def read_stl_binary(path):
+    '''
+    Memory mapped triangles of a binary STL, as a structured array
+    (see stl_dtype). The file is read only when the array is accessed.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(80)
+        count = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+    if count == 0: return np.zeros(0, dtype=stl_dtype)
+    return np.memmap(path, dtype=stl_dtype, mode='r', offset=84, shape=(count,))
+
+def read_stl_chunks(path, chunk_size=1000000):
+    '''
+    Triangles of a binary or ASCII STL as (n, 3, 3) arrays of chunk_size
+    triangles at most
+    '''
+    if is_binary_stl(path):
+        triangles = read_stl_binary(path)
+        for i in range(0, len(triangles), chunk_size):
+            yield np.array(triangles['vertices'][i:i+chunk_size], dtype='float')
+        return
+    with open(path, 'r', errors='ignore') as f:
+        rest = np.zeros(0)
+        while True:
+            lines = f.readlines(chunk_size*64)
+            if not lines: break
+            values = ' '.join(l.split(None,1)[1] for l in lines if l.lstrip().startswith('vertex'))
+            values = np.concatenate((rest, np.array(values.split(), dtype='float')))
+            # keep the incomplete triangles for the next chunk
+            n = len(values)//9*9
+            rest = values[n:]
+            if n: yield values[:n].reshape((-1,3,3))
+
+def weld_vertices(points, tolerance=0.001):
+    '''
+    Merge the points closer than the tolerance, rounding them on a grid.
+    Returns the unique points and the index of every point in them.
+    '''
+    cells = np.round(points/tolerance).astype('int64')
+    cells -= cells.min(axis=0, initial=0)
+    bits = [int(c).bit_length() for c in cells.max(axis=0, initial=0)]
+    if sum(bits) <= 63:
+        # single int64 keys are much faster to sort than rows
+        keys = (cells[:,0] << (bits[1]+bits[2])) | (cells[:,1] << bits[2]) | cells[:,2]
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    return points[first], inverse.reshape(-1)
+
+def read_stl_welded(path, tolerance=0.001):
+    '''
+    Indexed mesh of a STL, vertices and triangles. Binary files are memory
+    mapped, the duplicated vertices are welded and the degenerate triangles
+    removed.
+    '''
+    if is_binary_stl(path):
+        points = read_stl_binary(path)['vertices'].reshape((-1,3))
+    else:
+        points = np.concatenate([np.zeros((0,3,3))] + list(read_stl_chunks(path))).reshape((-1,3))
+    return weld_triangles(points, tolerance)
+
+def weld_triangles(points, tolerance=0.001):
+    '''
+    Indexed mesh of the triangles corners (n*3, 3), without the degenerate
+    triangles
+    '''
+    vertices, triangles = weld_vertices(points, tolerance)
+    triangles = triangles.reshape((-1,3))
+    valid = np.logical_and(triangles[:,0] != triangles[:,1], triangles[:,1] != triangles[:,2])
+    valid = np.logical_and(valid, triangles[:,2] != triangles[:,0])
+    return vertices.astype('float'), triangles[valid]
+
+def read_welded(path, tolerance=0.001):
+    '''
+    Indexed mesh of a STL or OBJ at full resolution
+    '''
+    if path.lower().endswith('.stl'): return read_stl_welded(path, tolerance)
+    points = np.concatenate([np.zeros((0,3,3))] + list(read_triangles_chunks(path)))
+    return weld_triangles(points.reshape((-1,3)), tolerance)
+
+def write_stl_binary(path, triangles, header=b'MyFaceMask'):
+    '''
+    Write the (n, 3, 3) triangles as a binary STL, with the facet normals
+    '''
+    triangles = np.asarray(triangles, dtype='float')
+    normals = np.cross(triangles[:,1] - triangles[:,0], triangles[:,2] - triangles[:,0])
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, length, out=normals, where=length > 0)
+    data = np.zeros(len(triangles), dtype=stl_dtype)
+    data['normal'] = normals
+    data['vertices'] = triangles
+    with open(path, 'wb') as f:
+        f.write(header[:80].ljust(80, b' '))
+        f.write(np.uint32(len(data)).astype('<u4').tobytes())
+        data.tofile(f)
+    return len(data)
+
+def read_obj_chunks(path, chunk_size=1000000):
+    '''
+    Triangles of an OBJ as (n, 3, 3) arrays. Polygons are triangulated as
+    fans. Faces can refer only to vertices defined before them, so only the
+    vertices coordinates are kept in memory.
+    '''
+    verts = [np.zeros((0,3))]
+    n_verts = 0
+    with open(path, 'r', errors='ignore') as f:
+        while True:
+            lines = f.readlines(chunk_size*32)
+            if not lines: break
+            v_lines = [l[2:] for l in lines if l.startswith('v ')]
+            if v_lines:
+                v = np.array(' '.join(' '.join(l.split()[:3]) for l in v_lines).split(), dtype='float')
+                verts.append(v.reshape((-1,3)))
+                n_verts += len(verts[-1])
+            f_lines = [l[2:] for l in lines if l.startswith('f ')]
+            if not f_lines: continue
+            if len(verts) > 1: verts = [np.concatenate(verts)]
+            # remove texture and normal indexes
+            text = re.sub(r'/\S*', '', ''.join(f_lines))
+            totals = np.fromiter(map(len, map(str.split, text.splitlines())), dtype='int')
+            indexes = np.array(text.split(), dtype='int')
+            # 1-based indexes, negative indexes are relative to the last vertex
+            indexes = np.where(indexes < 0, indexes + n_verts, indexes - 1)
+            starts = np.cumsum(totals) - totals
+            # fan triangulation
+            tris = totals - 2
+            first = np.repeat(starts, tris)
+            second = first + np.arange(tris.sum()) - np.repeat(np.cumsum(tris) - tris, tris) + 1
+            triangles = np.stack((indexes[first], indexes[second], indexes[second+1]), axis=1)
+            yield verts[-1][triangles]
+
+def read_triangles_chunks(path, chunk_size=1000000):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.stl': return read_stl_chunks(path, chunk_size)
+    if ext == '.obj': return read_obj_chunks(path, chunk_size)
+    raise ValueError("Unsupported file format: " + ext)
+
+def pack_cells(cells):
+    '''
+    Pack the (n, 3) integer cells in int64 keys, 21 bits per axis
+    '''
+    cells = cells + (1 << 20)
+    if cells.min(initial=0) < 0 or cells.max(initial=0) >= (1 << 21):
+        raise ValueError("The scan is too big for the clustering cell size")
+    return (cells[:,0] << 42) | (cells[:,1] << 21) | cells[:,2]
+
+class VertexClustering:
+    '''
+    Decimate a stream of triangles by merging all the vertices in the same
+    cell of a regular grid. Every cell becomes a vertex at the mean of its
+    points, the triangles collapsed by the clustering are removed.
+    '''
+    def __init__(self, cell_size=0.5):
+        self.cell_size = cell_size
+        self.keys = np.zeros(0, dtype='int64')      # sorted cells keys
+        self.sums = np.zeros((0,3))                 # sum of the points
+        self.counts = np.zeros(0)                   # points in every cell
+        self.triangles = [np.zeros((0,3), dtype='int64')]
+
+    def add(self, triangles):
+        '''
+        triangles: (n, 3, 3) coordinates
+        '''
+        points = triangles.reshape((-1,3))
+        keys = pack_cells(np.floor(points/self.cell_size).astype('int64'))
+        corners = keys.reshape((-1,3))
+        # remove the collapsed triangles
+        valid = np.logical_and(corners[:,0] != corners[:,1], corners[:,1] != corners[:,2])
+        valid = np.logical_and(valid, corners[:,2] != corners[:,0])
+        self.triangles.append(corners[valid])
+        # accumulate the points of every cell
+        keys, inverse = np.unique(np.concatenate((self.keys, keys)), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        old, new = inverse[:len(self.keys)], inverse[len(self.keys):]
+        sums = np.zeros((len(keys),3))
+        counts = np.zeros(len(keys))
+        sums[old] = self.sums
+        counts[old] = self.counts
+        for i in range(3): sums[:,i] += np.bincount(new, points[:,i], len(keys))
+        counts += np.bincount(new, minlength=len(keys))
+        self.keys, self.sums, self.counts = keys, sums, counts
+
+    def result(self):
+        '''
+        Vertices and triangles of the decimated mesh
+        '''
+        vertices = self.sums/self.counts[:,None]
+        triangles = np.searchsorted(self.keys, np.concatenate(self.triangles))
+        # remove the duplicated triangles, with any orientation
+        if len(triangles):
+            _, first = np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)
+            triangles = triangles[np.sort(first)]
+        # remove the vertices of the collapsed triangles only
+        used, triangles = np.unique(triangles, return_inverse=True)
+        return vertices[used], triangles.reshape((-1,3))
+
+def read_decimated(path, cell_size=0.5, chunk_size=1000000):
+    '''
+    Vertices and triangles of the scan, decimated with a vertex clustering
+    while reading the file
+    '''
+    clustering = VertexClustering(cell_size)
+    for triangles in read_triangles_chunks(path, chunk_size):
+        clustering.add(triangles)
+    return clustering.result()
@@ -38,17 +38,15 @@ import numpy as np
 import math, timeit, time
 from math import *#pi, sin
 from statistics import mean, stdev
-from mathutils import Vector
+from mathutils import Vector, Matrix
 from numpy import *
-#from .numba_functions import numba_reaction_diffusion
-try: import numexpr as ne
-except: pass
 
 # Reaction-Diffusion cache
 from pathlib import Path
-import random, string, tempfile
+import random, string, tempfile, hashlib
 
 from bpy.types import (
+        AddonPreferences,
         Operator,
         Panel,
         PropertyGroup,
@@ -65,6 +63,9 @@ from bpy.props import (
 )
 
 from .utils import *
+from .contour import *
+from .mesh_io import *
+from bpy_extras.io_utils import ImportHelper, ExportHelper
 
 
 def delete_all():
@@ -126,6 +127,129 @@ class myfacemask_setup(bpy.types.Operator):
         return {'FINISHED'}
 
 
+def new_scan_object(context, name, vertices, triangles):
+    '''
+    Mesh object from the triangles of a scan, selected and active
+    '''
+    if context.object and context.object.mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
+    n_faces = len(triangles)
+    me = bpy.data.meshes.new(name)
+    mesh_from_faces_csr(me, vertices, np.arange(n_faces)*3, np.full(n_faces, 3), triangles.reshape(-1))
+    ob = bpy.data.objects.new(name, me)
+    context.collection.objects.link(ob)
+    for o in context.view_layer.objects.selected: o.select_set(False)
+    ob.select_set(True)
+    context.view_layer.objects.active = ob
+    return ob
+
+class myfacemask_import_scan(Operator, ImportHelper):
+    bl_idname = "import_scene.myfacemask_scan"
+    bl_label = "Import Scan"
+    bl_description = ("Import a STL or OBJ scan, decimating it while reading")
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filename_ext = ".stl"
+    filter_glob : StringProperty(default="*.stl;*.obj", options={'HIDDEN'})
+    cell_size : FloatProperty(
+        name="Cell Size", default=0.5, min=0.01, soft_max=5,
+        description="Vertices closer than this size (mm) are merged")
+    chunk_size : IntProperty(
+        name="Chunk Size", default=1000000, min=10000,
+        description="Triangles read at once")
+
+    def execute(self, context):
+        start_time = time.time()
+        try:
+            vertices, triangles = read_decimated(self.filepath, self.cell_size, self.chunk_size)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        name = os.path.splitext(os.path.basename(self.filepath))[0]
+        new_scan_object(context, name, vertices, triangles)
+        message = "Imported {} vertices, {} faces in {:.2f} sec".format(len(vertices), len(triangles), time.time()-start_time)
+        self.report({'INFO'}, message)
+        print("MyFaceMask: " + message)
+        return {'FINISHED'}
+
+class myfacemask_import_stl(Operator, ImportHelper):
+    bl_idname = "import_mesh.myfacemask_stl"
+    bl_label = "Import STL"
+    bl_description = ("Import a STL scan at full resolution, welding the duplicated vertices")
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filename_ext = ".stl"
+    filter_glob : StringProperty(default="*.stl", options={'HIDDEN'})
+    tolerance : FloatProperty(
+        name="Weld Distance", default=0.001, min=0.000001, soft_max=0.1,
+        precision=4, description="Vertices closer than this distance (mm) are welded")
+
+    def execute(self, context):
+        start_time = time.time()
+        try:
+            vertices, triangles = read_stl_welded(self.filepath, self.tolerance)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        name = os.path.splitext(os.path.basename(self.filepath))[0]
+        new_scan_object(context, name, vertices, triangles)
+        message = "Imported {} vertices, {} faces in {:.2f} sec".format(len(vertices), len(triangles), time.time()-start_time)
+        self.report({'INFO'}, message)
+        print("MyFaceMask: " + message)
+        return {'FINISHED'}
+
+def export_stl(ob, filepath, depsgraph=None):
+    '''
+    Write the evaluated object, in world space, as a binary STL.
+    Doesn't need a UI context. Returns the number of triangles.
+    '''
+    if depsgraph is None: depsgraph = bpy.context.evaluated_depsgraph_get()
+    ob_eval = ob.evaluated_get(depsgraph)
+    me = ob_eval.to_mesh()
+    try:
+        # temporary mesh, not cached
+        arrays = MeshArrays(me)
+        matrix = np.array(ob.matrix_world)
+        verts = arrays.vertices @ matrix[:3,:3].T + matrix[:3,3]
+        return write_stl_binary(filepath, verts[arrays.triangles])
+    finally:
+        ob_eval.to_mesh_clear()
+
+class myfacemask_export_stl(Operator, ExportHelper):
+    bl_idname = "export_mesh.myfacemask_stl"
+    bl_label = "Export Mask"
+    bl_description = ("Export the Mask as binary STL")
+    bl_options = {'REGISTER'}
+
+    filename_ext = ".stl"
+    filter_glob : StringProperty(default="*.stl", options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return 'Mask' in bpy.data.objects
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            name = bpy.path.clean_name(context.scene.myfacemask_id or 'Mask')
+            self.filepath = os.path.join(bpy.path.abspath('//'), name + self.filename_ext)
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        start_time = time.time()
+        ob = bpy.data.objects['Mask']
+        if ob.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        try:
+            count = export_stl(ob, self.filepath, context.evaluated_depsgraph_get())
+        except OSError as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        message = "Exported {} triangles in {:.2f} sec".format(count, time.time()-start_time)
+        self.report({'INFO'}, message)
+        print("MyFaceMask: " + message)
+        return {'FINISHED'}
+
 class myfacemask_remesh(bpy.types.Operator):
     bl_idname = "object.myfacemask_remesh"
     bl_label = "Rebuild Mesh"
@@ -135,6 +259,25 @@ class myfacemask_remesh(bpy.types.Operator):
     detail : bpy.props.IntProperty(
         name="Detail", default=8, soft_min=3, soft_max=10,
         description="Octree Depth")
+    detail_mode : EnumProperty(
+        items=(
+            ('MANUAL', "Manual", "Use the given octree depth"),
+            ('OCTREE', "Automatic", "Octree depth from the scan size and the target resolution"),
+            ('VOXEL', "Voxel", "Voxel remesh with the size from the target resolution, for closed scans")),
+        default='MANUAL', name="Detail Mode",
+        description="How the remesh resolution is defined")
+    target : EnumProperty(
+        items=(
+            ('FACES', "Faces", "Target faces count"),
+            ('LENGTH', "Edge Length", "Target edge length in mm")),
+        default='FACES', name="Target",
+        description="Target resolution for the automatic modes")
+    target_faces : IntProperty(
+        name="Faces", default=100000, min=1000, soft_max=1000000,
+        description="Target faces count")
+    edge_length : FloatProperty(
+        name="Edge Length", default=1, min=0.05, soft_max=5,
+        description="Target edge length in mm")
 
     @classmethod
     def poll(cls, context):
@@ -144,16 +287,77 @@ class myfacemask_remesh(bpy.types.Operator):
             return not context.object.hide_viewport and ob.name not in exclude
         except: return False
 
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, 'detail_mode')
+        if self.detail_mode == 'MANUAL':
+            layout.prop(self, 'detail')
+        else:
+            layout.prop(self, 'target')
+            if self.target == 'FACES': layout.prop(self, 'target_faces')
+            else: layout.prop(self, 'edge_length')
+
     def execute(self, context):
-        #bpy.ops.view3d.view_selected()
-        bpy.ops.object.modifier_add(type='REMESH')
-        context.object.modifiers["Remesh"].mode = 'SMOOTH'
-        context.object.modifiers["Remesh"].octree_depth = self.detail
-        context.object.name = 'Face'
-        context.object.data.materials.append(bpy.data.materials['Face_Material'])
-        bpy.ops.object.modifier_apply(apply_as='DATA', modifier="Remesh")
+        start_time = time.time()
+        ob = context.object
+        me = ob.data
+        # the remesh works in local space, the edge length is in world units
+        scale = Vector(ob.matrix_world.to_scale())
+        scale = (abs(scale.x) + abs(scale.y) + abs(scale.z))/3 or 1
+        octree_scale = 0.9
+        predicted = None
+        if self.detail_mode == 'MANUAL':
+            depth = self.detail
+        else:
+            # the surface area is only needed to size the automatic modes
+            arrays = mesh_arrays(me)
+            area = faces_area(arrays.vertices, arrays.loop_start, arrays.loop_total, arrays.loop_verts).sum()
+            size = (arrays.vertices.max(axis=0) - arrays.vertices.min(axis=0)).max() if len(arrays.vertices) else 0
+            # the octree remesh of an open scan is a closed shell around it,
+            # with faces on both sides of the surface
+            if self.detail_mode == 'OCTREE' and (np.bincount(arrays.loop_edges) == 1).any():
+                area *= 2
+            # cell size of the remeshed surface
+            if self.target == 'FACES': cell = (area/self.target_faces)**0.5
+            else: cell = self.edge_length/scale
+            depth = int(round(log2(size/octree_scale/cell))) if cell > 0 and size > 0 else self.detail
+            depth = sorted((3, depth, 12))[1]
+            if self.detail_mode != 'VOXEL':
+                cell = size/octree_scale/2**depth
+            predicted = int(area/cell**2) if cell > 0 else 0
+
+        remesh = ob.modifiers.new(name='Remesh', type='REMESH')
+        if self.detail_mode == 'VOXEL':
+            try:
+                remesh.mode = 'VOXEL'
+                remesh.voxel_size = cell
+            except:
+                # Remesh modifier without voxel mode (Blender < 2.90)
+                ob.modifiers.remove(remesh)
+                remesh = None
+                me.remesh_voxel_size = cell
+                bpy.ops.object.voxel_remesh()
+        else:
+            remesh.mode = 'SMOOTH'
+            remesh.octree_depth = depth
+            remesh.scale = octree_scale
+        if remesh: bake_modifiers(ob, [remesh.name])
+        ob.name = 'Face'
+        ob.data.materials.append(bpy.data.materials['Face_Material'])
         #bpy.ops.object.shade_smooth()
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
+        # apply the transformations
+        ob.data.transform(ob.matrix_basis)
+        ob.matrix_basis.identity()
+        faces = len(ob.data.polygons)
+        if self.detail_mode == 'VOXEL':
+            message = "Remesh voxel size {:.3f}".format(cell*scale)
+        else:
+            message = "Remesh octree depth {}".format(depth)
+        if predicted is not None: message += ": predicted {} faces, got {}".format(predicted, faces)
+        else: message += ": {} faces".format(faces)
+        message += " in {:.2f} sec".format(time.time()-start_time)
+        self.report({'INFO'}, message)
+        print("MyFaceMask: " + message)
         return {'FINISHED'}
 
 class myfacemask_mirror_border(bpy.types.Operator):
@@ -206,6 +410,14 @@ class myfacemask_mirror_border_flip(bpy.types.Operator):
         return {'FINISHED'}
 
 
+# Filter placement, distance from the border plane and shift along it (mm)
+filter_distance = 60
+filter_shift = 15
+
+# Topology and border contour of the last adapted Face, reused when only the
+# weights changed
+contour_cache = {}
+
 class myfacemask_adapt_mask(Operator):
     bl_idname = "object.myfacemask_adapt_mask"
     bl_label = "Adapt Mask"
@@ -216,6 +428,24 @@ class myfacemask_adapt_mask(Operator):
         name="Use Modifiers", default=True,
         description="Apply all the modifiers")
 
+    smooth_iterations : IntProperty(
+        name="Iterations", default=5, min=0, soft_max=50,
+        description="Smoothing iterations of the weight")
+    smooth_factor : FloatProperty(
+        name="Factor", default=0.5, min=0, max=1,
+        description="Smoothing factor for every iteration")
+    smooth_strength : FloatProperty(
+        name="Strength", default=1, min=0, max=1,
+        description="Blend between the original and the smoothed weight")
+    use_cache : BoolProperty(
+        name="Incremental Update", default=True,
+        description="Recompute the border only around the changed weights")
+    iso_value : FloatProperty(
+        name="Border Value", default=0.5, min=0, max=1,
+        description="Weight value of the mask border")
+    multi_level : BoolProperty(
+        name="Contour Levels", default=False,
+        description="Extract additional nested contours in a separate curve")
     min_iso : FloatProperty(
         name="Min Value", default=0., soft_min=0, soft_max=1,
         description="Minimum weight value")
@@ -284,6 +514,30 @@ class myfacemask_adapt_mask(Operator):
     clean_distance : FloatProperty(
         name="Clean Distance", default=2, min=0, soft_max=10,
         description="Remove short segments")
+    border_rule : EnumProperty(
+        items=(
+            ('SIZE_X', "Width", "Widest curve along X"),
+            ('LENGTH', "Length", "Longest curve"),
+            ('AREA', "Area", "Curve enclosing the largest area"),
+            ('BBOX', "Size", "Curve with the largest bounding box")),
+        default='SIZE_X', name="Border",
+        description="Rule used to choose the mask border between the curves")
+    border_closed_first : BoolProperty(
+        name="Prefer Closed", default=False,
+        description="Choose a closed curve when there is one")
+    curve_cleanup : EnumProperty(
+        items=(
+            ('NONE', "None", "Keep all the points"),
+            ('RESAMPLE', "Resample", "Uniform arc length resampling"),
+            ('SIMPLIFY', "Simplify", "Douglas-Peucker simplification")),
+        default='SIMPLIFY', name="Curve Cleanup",
+        description="Reduce the points of the border curve")
+    resample_step : FloatProperty(
+        name="Step", default=2, min=0.1, soft_max=10,
+        description="Distance between the resampled points (mm)")
+    simplify_tolerance : FloatProperty(
+        name="Tolerance", default=0.2, min=0, soft_max=2,
+        description="Maximum distance from the original curve (mm)")
 
 
     @classmethod
@@ -302,9 +556,39 @@ class myfacemask_adapt_mask(Operator):
         col.prop(self, "use_modifiers")
         col.label(text="Contour Curves:")
         col.prop_search(self, 'vertex_group_contour', ob, "vertex_groups", text='')
+        col.prop(self, 'iso_value')
+        col.label(text='Smooth:')
+        row = col.row(align=True)
+        row.prop(self, 'smooth_iterations')
+        row.prop(self, 'smooth_factor')
+        col.prop(self, 'smooth_strength')
+        col.prop(self, 'use_cache')
+        row = col.row(align=True)
+        row.prop(self, 'border_rule', text='')
+        row.prop(self, 'border_closed_first')
+        col.separator()
+        col.prop(self, 'multi_level')
+        if self.multi_level:
+            col.prop(self, 'n_curves')
+            row = col.row(align=True)
+            row.prop(self, 'min_iso')
+            row.prop(self, 'max_iso')
+            col.prop_search(self, 'vertex_group_pattern', ob, "vertex_groups", text='')
+            row = col.row(align=True)
+            row.prop(self, 'in_steps')
+            row.prop(self, 'in_displace')
+            row = col.row(align=True)
+            row.prop(self, 'out_steps')
+            row.prop(self, 'out_displace')
+            col.prop(self, 'limit_z')
 
         col.label(text='Clean Curves:')
         col.prop(self,'clean_distance')
+        col.prop(self,'curve_cleanup', text='')
+        if self.curve_cleanup == 'RESAMPLE':
+            col.prop(self,'resample_step')
+        elif self.curve_cleanup == 'SIMPLIFY':
+            col.prop(self,'simplify_tolerance')
         #col.prop(self,'remove_open_curves')
 
     def execute(self, context):
@@ -314,7 +598,6 @@ class myfacemask_adapt_mask(Operator):
         except:
             self.report({'ERROR'}, "The object doesn't have Vertex Groups")
             return {'CANCELLED'}
-        bpy.ops.object.vertex_group_smooth(repeat=5)
 
         ob0 = context.object#bpy.data.objects[self.object_name]
 
@@ -322,104 +605,92 @@ class myfacemask_adapt_mask(Operator):
         ob = ob0#.evaluated_get(dg)
         me0 = ob.data
 
-        # generate new bmesh
-        bm = bmesh.new()
-        bm.from_mesh(me0)
-        n_verts = len(bm.verts)
+        n_verts = len(me0.vertices)
 
         # store weight values
-        try:
-            weight = get_weight_numpy(ob.vertex_groups.active, len(me0.vertices))
-        except:
-            bm.free()
+        vertex_groups = ob.vertex_groups
+        if vertex_groups.active is None:
             self.report({'ERROR'}, "Please select a Vertex Group for contouring")
             return {'CANCELLED'}
-
-        try:
-            pattern_weight = get_weight_numpy(ob.vertex_groups[self.vertex_group_pattern], len(me0.vertices))
-        except:
+        groups = [vertex_groups.active]
+        if self.vertex_group_pattern in vertex_groups:
+            groups.append(vertex_groups[self.vertex_group_pattern])
+        weights = get_weights_numpy(ob, groups)
+        weight = weights[0]
+
+        if self.vertex_group_pattern in vertex_groups:
+            pattern_weight = weights[1]
+        else:
             #self.report({'WARNING'}, "There is no Vertex Group assigned to the pattern displace")
-            pattern_weight = np.zeros(len(me0.vertices))
+            pattern_weight = np.zeros(n_verts)
 
-        variable_bevel = False
-        try:
-            bevel_weight = get_weight_numpy(ob.vertex_groups[self.vertex_group_bevel], len(me0.vertices))
-            variable_bevel = True
-        except:
-            bevel_weight = np.ones(len(me0.vertices))
+        print("Contour Curves, weights loaded: " + str(timeit.default_timer() - start_time) + " sec")
 
-        #filtered_edges = bm.edges
-        total_verts = np.zeros((0,3))
-        total_segments = []# np.array([])
+        # iso values, the first one defines the mask border
+        iso_values = [self.iso_value]
+        if self.multi_level:
+            min_iso, max_iso = sorted((self.min_iso, self.max_iso))
+            iso_values += [min_iso + (max_iso-min_iso)*(c+1)/(self.n_curves+1) for c in range(self.n_curves)]
+        # pattern displace steps are counted on the additional levels
+        n_steps = (self.in_steps + self.out_steps) or 1
+        steps = [0] + list(range(len(iso_values)-1))
+        displace = [self.in_displace if s % n_steps < self.in_steps else self.out_displace for s in steps]
 
-        # start iterate contours levels
+        # extract contours, the border is patched when the mesh didn't change
         vertices, normals = get_vertices_and_normals_numpy(me0)
-        filtered_edges = get_edges_id_numpy(me0)
-
-        faces_weight = [np.array([weight[v] for v in p.vertices]) for p in me0.polygons]
-        fw_min = np.array([np.min(fw) for fw in faces_weight])
-        fw_max = np.array([np.max(fw) for fw in faces_weight])
-
-        bm_faces = np.array(bm.faces)
-
-        #print("Contour Curves, data loaded: " + str(timeit.default_timer() - start_time) + " sec")
-        step_time = timeit.default_timer()
-        for c in range(1):
-            min_iso = min(0, 1)
-            max_iso = max(0, 1)
-            iso_val = 0.5
-
-            # remove passed faces
-            bool_mask = iso_val < fw_max
-            bm_faces = bm_faces[bool_mask]
-            fw_min = fw_min[bool_mask]
-            fw_max = fw_max[bool_mask]
-
-            # mask faces
-            bool_mask = fw_min < iso_val
-            faces_mask = bm_faces[bool_mask]
-
-            count = len(total_verts)
-
-            new_filtered_edges, edges_index, verts, bevel = contour_edges_pattern(self, c, len(total_verts), iso_val, vertices, normals, filtered_edges, weight, pattern_weight, bevel_weight)
-
-            if verts[0,0] == None: continue
-            else: filtered_edges = new_filtered_edges
-            edges_id = {}
-            for i, id in enumerate(edges_index): edges_id[id] = i + count
-
-            if len(verts) == 0: continue
-
-            # finding segments
-            segments = []
-            for f in faces_mask:
-                seg = []
-                for e in f.edges:
-                    try:
-                        seg.append(edges_id[e.index])
-                        if len(seg) == 2:
-                            segments.append(seg)
-                            seg = []
-                    except: pass
+        edges = get_edges_numpy(me0)
+        loop_start, loop_total, loop_verts = get_faces_csr_numpy(me0)
+        border_key = (self.iso_value, displace[0], self.limit_z)
+        cache = contour_cache.get(ob0.name)
+        use_cache = (self.use_cache and cache and cache['key'] == border_key and
+            cache['mesh'].same_topology(vertices, edges, loop_start, loop_verts))
+        if use_cache:
+            contour_mesh = cache['mesh']
+        else:
+            contour_mesh = ContourMesh(vertices, edges, loop_start, loop_total, loop_verts, get_loop_edges_numpy(me0), normals)
 
-            total_segments = total_segments + segments
-            total_verts = np.concatenate((total_verts, verts))
+        # smooth a copy of the weights, the vertex group is not changed
+        weight = contour_mesh.smooth(weight, self.smooth_iterations, self.smooth_factor, self.smooth_strength)
 
+        if use_cache:
+            border = cache['border']
+            n_changed = border.update(weight, pattern_weight)
+            print("Contour Curves, border updated on " + str(n_changed) + " vertices")
+        else:
+            border = IncrementalContour(contour_mesh, weight, self.iso_value, pattern_weight, displace[0], self.limit_z)
+            contour_cache.clear()
+            if self.use_cache:
+                contour_cache[ob0.name] = {'mesh': contour_mesh, 'border': border, 'key': border_key,
+                    'geometry': mesh_geometry_key(me0)}
+        contours = [(border.verts, border.segments)]
+        if len(iso_values) > 1:
+            contours += contour_mesh.contour(weight, iso_values[1:], pattern_weight, displace[1:], self.limit_z)
+
+        step = self.resample_step if self.curve_cleanup == 'RESAMPLE' else 0
+        tolerance = self.simplify_tolerance if self.curve_cleanup == 'SIMPLIFY' else 0
+
+        total_verts, total_segments = contours[0]
         if len(total_segments) > 0:
             step_time = timeit.default_timer()
             ordered_points = find_curves(total_segments, len(total_verts))
 
-            max_len = 0
-            longer_curve = [ordered_points[0]]
-            for crv in ordered_points:
-                pts = total_verts[np.array(crv,dtype='int')]
-                print(pts.shape)
-                size_x = pts.max(axis=0)[0] - pts.min(axis=0)[0]
-                if max_len < size_x:
-                    max_len = size_x
-                    longer_curve = [crv]
+            stats = curves_stats(total_verts, ordered_points)
+            order = rank_curves(stats, self.border_rule, self.border_closed_first)
+            longer_curve = ordered_points[order[0]]
+            print("Contour Curves, {} curves, border: {:.1f} mm long, {} points".format(
+                len(stats), stats['length'][order[0]], stats['n_points'][order[0]]))
             step_time = timeit.default_timer()
-            crv = curve_from_pydata(total_verts, longer_curve, 'ContourCurve', self.remove_open_curves, merge_distance=self.clean_distance)
+            border = []
+            cyclic = bool(longer_curve[0] == longer_curve[-1]) and len(longer_curve) > 2
+            if cyclic or not self.remove_open_curves:
+                pts = total_verts[longer_curve[:-1]] if cyclic else total_verts[longer_curve]
+                pts = process_polyline(pts, cyclic, self.clean_distance, step, tolerance)
+                border.append((pts, cyclic))
+            else:
+                self.report({'ERROR'}, "The mask border is not a closed curve")
+                return {'CANCELLED'}
+            # the border is built as a mesh, target of the Mask_Surface modifiers
+            crv = mesh_from_polylines(border, 'ContourCurve')
             context.view_layer.objects.active = crv
             crv.parent = ob0
 
@@ -427,38 +698,48 @@ class myfacemask_adapt_mask(Operator):
             ob0.select_set(False)
             crv.matrix_world = ob0.matrix_world
         else:
-            bm.free()
             self.report({'ERROR'}, "There are no values in the chosen range")
             return {'CANCELLED'}
-        bm.free()
+
+        # nested contours, they replace the ones of the previous run
+        levels = []
+        for verts, segments in contours[1:]:
+            levels += polylines(verts, segments, self.remove_open_curves, self.clean_distance, step, tolerance)
+        levels_crv = bpy.data.objects.get('ContourLevels')
+        if len(levels) > 0:
+            levels_crv = curve_from_polylines(levels, 'ContourLevels', set_active=False, ob_curve=levels_crv)
+            levels_crv.parent = ob0
+            levels_crv.matrix_world = ob0.matrix_world
+        elif levels_crv is not None and levels_crv.type == 'CURVE':
+            curve = levels_crv.data
+            bpy.data.objects.remove(levels_crv)
+            if curve.users == 0: bpy.data.curves.remove(curve)
 
         bpy.data.collections['MyFaceMask'].hide_viewport = False
 
-        bpy.ops.object.convert(target='MESH')
-        curve_object = context.object
+        curve_object = crv
         curve_object.hide_viewport = True
 
-        n_verts = len(curve_object.data.vertices)
-        matr = curve_object.matrix_world
-        verts = [matr @ v.co for v in curve_object.data.vertices]
-        mid_point = Vector((0,0,0))
-        for v in verts:
-            mid_point += v
-        mid_point/=n_verts
-        nor_vec = Vector((0,0,0))
-        for i in range(n_verts-1):
-            v0 = verts[i] - mid_point
-            v1 = verts[i+1] - mid_point
-            nor_vec += v0.cross(v1)
-        nor_vec.normalize()
+        # border plane in world coordinates
+        matr = np.array(ob0.matrix_world)
+        verts = np.concatenate([pts for pts, bool_cyclic in border])
+        verts = verts @ matr[:3,:3].T + matr[:3,3]
+        mid_point, nor_vec, axis_u, axis_v = fit_plane(verts, cyclic)
+        mid_point = Vector(mid_point)
+        nor_vec = Vector(nor_vec)
         if nor_vec.y > 0:
             nor_vec *= -1
 
         filter = bpy.data.objects['Filter']
-        filter.location = mid_point + nor_vec*60
-        filter.rotation_euler[0] = atan2(cos(nor_vec.y), sin(nor_vec.z))+pi
-        matr = filter.matrix_local
-        filter.location -= nor_vec.normalized().cross(Vector((1,0,0)))*15
+        filter.location = mid_point + nor_vec*filter_distance
+        # filter frame: the local Z looks at the face, the local X follows the
+        # in-plane axis of the border closer to the face width
+        axis_x = Vector(axis_u if abs(axis_u[0]) >= abs(axis_v[0]) else axis_v)
+        if axis_x.x < 0: axis_x *= -1
+        axis_z = -nor_vec
+        axis_y = axis_z.cross(axis_x)
+        filter.rotation_euler = Matrix((axis_x, axis_y, axis_z)).transposed().to_euler('XYZ')
+        filter.location -= nor_vec.cross(Vector((1,0,0)))*filter_shift
         filter.location.x = 0
 
 
@@ -518,14 +799,7 @@ class myfacemask_edit_mask(Operator):
         face.lock_scale[2] = True
 
         mods = mask.modifiers.keys()
-        if 'Mirror' in mods:
-            bpy.ops.object.modifier_apply(apply_as='DATA', modifier="Mirror")
-        if 'Bevel' in mods:
-            bpy.ops.object.modifier_apply(apply_as='DATA', modifier="Bevel")
-        if 'Subdivision' in mods:
-            bpy.ops.object.modifier_apply(apply_as='DATA', modifier="Subdivision")
-        if 'curve_project_01' in mods:
-            bpy.ops.object.modifier_apply(apply_as='DATA', modifier="curve_project_01")
+        bake_modifiers(mask, [m for m in ('Mirror', 'Bevel', 'Subdivision', 'curve_project_01') if m in mods])
 
         mask.modifiers["Hook_Border"].object = bpy.data.objects['ContourCurve']
         #bpy.ops.object.modifier_apply(apply_as='DATA', modifier="curve_project_02")
@@ -620,6 +894,53 @@ class myfacemask_weight_toggle(Operator):
         return {'CANCELLED'}
 
 
+class myfacemask_auto_area(Operator):
+    bl_idname = "object.myfacemask_auto_area"
+    bl_label = "Automatic area"
+    bl_options = {'REGISTER', 'UNDO'}
+    bl_description = ('Define the mask area from the nose and the chin of the scan')
+
+    top : FloatProperty(
+        name="Top", default=0.6, min=0, soft_max=2,
+        description="Area above the nose tip, relative to the nose-chin distance")
+    bottom : FloatProperty(
+        name="Bottom", default=0.15, min=0, soft_max=1,
+        description="Area below the chin, relative to the nose-chin distance")
+    width : FloatProperty(
+        name="Width", default=0.95, min=0.1, soft_max=2,
+        description="Half width of the area, relative to the nose-chin distance")
+    depth : FloatProperty(
+        name="Depth", default=1.3, min=0.1, soft_max=3,
+        description="Maximum depth behind the nose tip, relative to the nose-chin distance")
+
+    @classmethod
+    def poll(cls, context):
+        try: return context.object.name == 'Face' and context.object.type == 'MESH'
+        except: return False
+
+    def execute(self, context):
+        start_time = time.time()
+        ob = context.object
+        arrays = mesh_arrays(ob.data)
+        # the face is aligned in world space
+        matrix = np.array(ob.matrix_world)
+        vertices = arrays.vertices @ matrix[:3,:3].T + matrix[:3,3]
+        normals = arrays.normals @ np.array(ob.matrix_world.to_3x3().inverted().transposed()).T
+        if not is_face_aligned(vertices, normals):
+            self.report({'ERROR'}, "The scan is not aligned, it should look towards -Y with Z up")
+            return {'CANCELLED'}
+        weight, nose, chin = mask_area_weight(vertices, arrays.edges, normals,
+            self.top, self.bottom, self.width, self.depth)
+        if chin < 0:
+            self.report({'WARNING'}, "Chin not found, using an average distance from the nose")
+        set_weight_numpy(ob, 'Area', weight)
+        ob.data.update()
+        message = "Mask area: {} vertices in {:.3f} sec".format(int(weight.sum()), time.time()-start_time)
+        self.report({'INFO'}, message)
+        print("MyFaceMask: " + message)
+        return {'FINISHED'}
+
+
 class myfacemask_weight_add_subtract(Operator):
     bl_idname = "object.myfacemask_weight_add_subtract"
     bl_label = "Change Brush"
@@ -635,6 +956,204 @@ class myfacemask_weight_add_subtract(Operator):
         return {'FINISHED'}
 
 
+# Live preview of the mask border while painting. After the strokes stop for a
+# short while the weights are read from the evaluated object, the cached
+# border contour is patched and drawn as a lines overlay.
+border_preview = {
+    'object': None,         # name of the painted object
+    'dirty': False,         # weights changed since the last update
+    'last_change': 0,       # time of the last depsgraph update
+    'batch': None,          # gpu batch of the border
+    'shader': None,
+    'draw_handle': None
+    }
+preview_debounce = 0.3      # seconds without updates before reading weights
+preview_time_limit = 0.5    # the preview is stopped if an update is slower
+preview_max_verts = 1000000 # denser meshes are not previewed
+
+def border_preview_depsgraph(scene, depsgraph=None):
+    # skip the updates of the weights readers
+    if is_internal_update(): return
+    ob = bpy.data.objects.get(border_preview['object'] or '')
+    if ob is None or ob.mode != 'WEIGHT_PAINT': return
+    # only the changes of the painted object
+    if depsgraph is not None:
+        updated = [update.id.original for update in depsgraph.updates]
+        if ob not in updated and ob.data not in updated: return
+    border_preview['dirty'] = True
+    border_preview['last_change'] = time.time()
+
+def border_preview_timer():
+    state = border_preview
+    if state['object'] not in bpy.data.objects:
+        border_preview_stop()
+        return None
+    ob = bpy.data.objects[state['object']]
+    if ob.mode != 'WEIGHT_PAINT':
+        border_preview_stop()
+        return None
+    if not state['dirty']: return 0.1
+    wait = state['last_change'] + preview_debounce - time.time()
+    if wait > 0: return wait
+    state['dirty'] = False
+    # read the weights and update the border, the first contour is built by
+    # border_preview_start
+    start_time = time.time()
+    weight = get_weights_numpy(ob, [ob.vertex_groups.active])[0]
+    border = border_preview_contour(ob, weight)
+    if time.time() - start_time > preview_time_limit:
+        print("MyFaceMask: border preview is too slow for this mesh, stopped")
+        border_preview_stop()
+        return None
+    border_preview_batch(ob, border)
+    return 0.1
+
+def adapt_mask_settings():
+    '''
+    Properties of the last Adapt Mask, with the defaults if it was never run
+    '''
+    return bpy.context.window_manager.operator_properties_last('object.myfacemask_adapt_mask')
+
+def border_preview_contour(ob, weight):
+    # reuse the border contour of adapt_mask, with its border value and smoothing
+    settings = adapt_mask_settings()
+    me = ob.data
+    border_key = (settings.iso_value, 0, False)
+    geometry = mesh_geometry_key(me)
+    cache = contour_cache.get(ob.name)
+    if cache and cache['key'] == border_key and cache.get('geometry') == geometry:
+        contour_mesh = cache['mesh']
+        weight = contour_mesh.smooth(weight, settings.smooth_iterations, settings.smooth_factor, settings.smooth_strength)
+        border = cache['border']
+        border.update(weight)
+    else:
+        vertices, normals = get_vertices_and_normals_numpy(me)
+        loop_start, loop_total, loop_verts = get_faces_csr_numpy(me)
+        contour_mesh = ContourMesh(vertices, get_edges_numpy(me), loop_start, loop_total, loop_verts, get_loop_edges_numpy(me), normals)
+        weight = contour_mesh.smooth(weight, settings.smooth_iterations, settings.smooth_factor, settings.smooth_strength)
+        border = IncrementalContour(contour_mesh, weight, settings.iso_value)
+        contour_cache.clear()
+        contour_cache[ob.name] = {'mesh': contour_mesh, 'border': border, 'key': border_key, 'geometry': geometry}
+    return border
+
+def border_preview_batch(ob, border):
+    from gpu_extras.batch import batch_for_shader
+    state = border_preview
+    coords = border.verts[border.segments.reshape(-1)]
+    coords = np.array(ob.matrix_world) @ np.concatenate((coords, np.ones((len(coords),1))), axis=1).T
+    state['batch'] = batch_for_shader(state['shader'], 'LINES', {"pos": coords[:3].T.tolist()})
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D': area.tag_redraw()
+
+def border_preview_draw():
+    state = border_preview
+    if state['batch'] is None: return
+    state['shader'].bind()
+    state['shader'].uniform_float("color", (0, 1, 1, 1))
+    state['batch'].draw(state['shader'])
+
+def border_preview_start(ob):
+    import gpu
+    try: shader = gpu.shader.from_builtin('3D_UNIFORM_COLOR')
+    except: shader = gpu.shader.from_builtin('UNIFORM_COLOR')
+    border_preview_stop()
+    border_preview['object'] = ob.name
+    border_preview['shader'] = shader
+    border_preview['dirty'] = False
+    border_preview['last_change'] = 0
+    # build the contour topology once, out of the timer
+    weight = get_weights_numpy(ob, [ob.vertex_groups.active])[0]
+    border_preview_batch(ob, border_preview_contour(ob, weight))
+    border_preview['draw_handle'] = bpy.types.SpaceView3D.draw_handler_add(
+        border_preview_draw, (), 'WINDOW', 'POST_VIEW')
+    bpy.app.handlers.depsgraph_update_post.append(border_preview_depsgraph)
+    bpy.app.timers.register(border_preview_timer, first_interval=0.1)
+
+def border_preview_stop():
+    state = border_preview
+    if border_preview_depsgraph in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(border_preview_depsgraph)
+    if bpy.app.timers.is_registered(border_preview_timer):
+        bpy.app.timers.unregister(border_preview_timer)
+    if state['draw_handle'] is not None:
+        bpy.types.SpaceView3D.draw_handler_remove(state['draw_handle'], 'WINDOW')
+    state['object'] = None
+    state['batch'] = None
+    state['draw_handle'] = None
+
+class myfacemask_border_preview(Operator):
+    bl_idname = "object.myfacemask_border_preview"
+    bl_label = "Border Preview"
+    bl_options = {'REGISTER'}
+    bl_description = ("Show the mask border while painting")
+
+    @classmethod
+    def poll(cls, context):
+        ob = context.object
+        try: return ob.mode == 'WEIGHT_PAINT' and ob.vertex_groups.active != None
+        except: return False
+
+    def execute(self, context):
+        ob = context.object
+        if border_preview['object'] == ob.name:
+            border_preview_stop()
+            return {'FINISHED'}
+        if len(ob.data.vertices) > preview_max_verts:
+            self.report({'WARNING'}, "The mesh is too dense for the border preview, please remesh it")
+            return {'CANCELLED'}
+        start_time = time.time()
+        border_preview_start(ob)
+        print("MyFaceMask: border preview started in {:.2f} sec".format(time.time() - start_time))
+        return {'FINISHED'}
+
+
+def update_contour_backend(self, context):
+    set_contour_backend(self.contour_backend, self.contour_threads)
+
+def update_tag_cache(self, context):
+    tag_cache['limit'] = self.tag_cache_size*2**20
+    tag_cache_prune()
+
+class myfacemask_preferences(AddonPreferences):
+    bl_idname = __package__
+
+    contour_backend : EnumProperty(
+        items=(
+            ('AUTO', "Automatic", "Use numba when installed, then numexpr for dense meshes, otherwise NumPy"),
+            ('NUMPY', "NumPy", "Reference NumPy kernel"),
+            ('NUMEXPR', "numexpr", "Multithreaded numexpr kernel, if numexpr is installed"),
+            ('NUMBA', "Numba", "Compiled numba kernel, if numba is installed")),
+        default='AUTO', name="Contour Backend",
+        description="Kernel used to interpolate the contour vertices",
+        update=update_contour_backend)
+    contour_threads : IntProperty(
+        name="Threads", default=0, min=0, soft_max=64,
+        description="Threads used by numexpr and numba (0 for all the cores)",
+        update=update_contour_backend)
+    tag_cache_size : IntProperty(
+        name="Tag Cache (MB)", default=64, min=0, soft_max=1024,
+        description="Disk space used by the rendered ID tags",
+        update=update_tag_cache)
+
+    def draw(self, context):
+        layout = self.layout
+        row = layout.row()
+        row.prop(self, 'contour_backend')
+        col = row.column()
+        col.enabled = len(contour_kernels) > 1
+        col.prop(self, 'contour_threads')
+        if self.contour_backend not in contour_kernels and self.contour_backend != 'AUTO':
+            layout.label(text="The selected backend is not installed, using the automatic one", icon='INFO')
+        layout.prop(self, 'tag_cache_size')
+
+def load_preferences():
+    try:
+        prefs = bpy.context.preferences.addons[__package__].preferences
+        set_contour_backend(prefs.contour_backend, prefs.contour_threads)
+        tag_cache['limit'] = prefs.tag_cache_size*2**20
+    except: pass
+
 class MYFACEMASK_PT_weight(Panel):
     bl_label = "MyFaceMask"
     bl_category = "MyFaceMask"
@@ -670,12 +1189,14 @@ class MYFACEMASK_PT_weight(Panel):
             col.label(text="Import scan:", icon="OUTLINER_OB_ARMATURE")
             row = col.row(align=True)
             row.operator("import_scene.obj", text="OBJ", icon='IMPORT')
-            row.operator("import_mesh.stl", text="STL", icon='IMPORT')
+            row.operator("import_mesh.myfacemask_stl", text="STL", icon='IMPORT')
+            col.operator("import_scene.myfacemask_scan", text="Decimated scan", icon='IMPORT')
             col.separator()
             col.operator("object.myfacemask_remesh", icon="MOD_REMESH", text="Remesh")
             col.separator()
             col.label(text="Adapt mask:")
             col.operator("object.myfacemask_weight_toggle", icon="BRUSH_DATA", text="Define area")
+            col.operator("object.myfacemask_auto_area", icon="MOD_VERTEX_WEIGHT", text="Automatic area")
 
             if mode == 'WEIGHT_PAINT':
                 weight = context.scene.tool_settings.unified_paint_settings.weight
@@ -685,9 +1206,14 @@ class MYFACEMASK_PT_weight(Panel):
                     col.operator("object.myfacemask_weight_add_subtract", icon="SELECT_SUBTRACT", text='Subtract')
                 #col.prop(context.scene.tool_settings.unified_paint_settings, 'weight')
                 col.prop(context.scene.tool_settings.unified_paint_settings, 'size')
+                if border_preview['object'] == name:
+                    col.operator("object.myfacemask_border_preview", icon="HIDE_OFF", text='Border preview off')
+                else:
+                    col.operator("object.myfacemask_border_preview", icon="HIDE_OFF", text='Border preview on')
                 col.separator()
 
             col.operator("object.myfacemask_adapt_mask", icon="USER", text='Adapt mask')
+            col.operator("object.myfacemask_cut_border", icon="MOD_EDGESPLIT", text='Cut along border')
             col.separator()
             try:
                 curve = bpy.data.objects['ContourCurve']
@@ -753,10 +1279,84 @@ class MYFACEMASK_PT_weight(Panel):
                 col.operator('scene.myfacemask_generate_tag', icon='LINE_DATA')
                 col.separator()
                 col.label(text="Export:")
-                col.operator("export_mesh.stl", text="STL", icon='EXPORT')
+                col.operator("export_mesh.myfacemask_stl", text="STL", icon='EXPORT')
             else:
                 col.operator('object.myfacemask_tag_mask_off', icon='OBJECT_DATA', text='Done')
 
+# rendered tags, stored by the hash of the text and of the render settings
+tag_cache = {
+    'directory': Path(tempfile.gettempdir()) / 'myfacemask_tags',
+    'limit': 64*2**20
+    }
+
+def tag_cache_key(text_scene, code):
+    '''
+    Hash of everything affecting the rendered tag
+    '''
+    text = text_scene.objects['Text']
+    render = text_scene.render
+    image = render.image_settings
+    settings = [code, text.data.font.filepath if text.data.font else '',
+        text.data.size, text.data.extrude, text.data.offset, text.data.space_character,
+        text.data.align_x, text.data.align_y, [list(r) for r in text.matrix_world],
+        render.engine, render.resolution_x, render.resolution_y,
+        render.resolution_percentage, render.film_transparent,
+        image.file_format, image.color_mode, image.color_depth]
+    camera = text_scene.camera
+    if camera:
+        settings += [camera.data.type, camera.data.ortho_scale, camera.data.lens,
+            [list(r) for r in camera.matrix_world]]
+    return hashlib.sha1(repr(settings).encode()).hexdigest()
+
+def tag_cache_prune(limit=None, keep=None):
+    '''
+    Remove the least recently used tags until the cache fits the limit
+    '''
+    if limit is None: limit = tag_cache['limit']
+    try:
+        files = [(f.stat().st_mtime, f.stat().st_size, f) for f in tag_cache['directory'].glob('*.png')]
+    except OSError: return
+    size = sum([f[1] for f in files])
+    for mtime, file_size, f in sorted(files, key=lambda f: f[0]):
+        if size <= limit: break
+        if f == keep: continue
+        try:
+            f.unlink()
+            size -= file_size
+        except OSError: pass
+
+def render_tag(text_scene, code):
+    '''
+    Path of the rendered tag, rendered only if it isn't in the cache
+    '''
+    image_path = tag_cache['directory'] / (tag_cache_key(text_scene, code) + '.png')
+    if image_path.exists():
+        # mark as recently used
+        os.utime(str(image_path))
+        return image_path, False
+    tag_cache['directory'].mkdir(parents=True, exist_ok=True)
+    text_scene.objects['Text'].data.body = code
+    text_scene.render.filepath = str(image_path)
+    bpy.ops.render.render(scene=text_scene.name, write_still=1)
+    tag_cache_prune(keep=image_path)
+    return image_path, True
+
+def tag_texture(image_path, rendered):
+    '''
+    Reuse the TAG texture and the image of the tag, if already loaded
+    '''
+    tex = bpy.data.textures.get('TAG')
+    if tex is None or tex.type != 'IMAGE':
+        tex = bpy.data.textures.new('TAG','IMAGE')
+    img = bpy.data.images.load(filepath=str(image_path), check_existing=True)
+    if rendered: img.reload()
+    old_img = tex.image
+    tex.image = img
+    # remove the tags not used anymore
+    if old_img and old_img != img and old_img.users == 0:
+        bpy.data.images.remove(old_img)
+    return tex
+
 class myfacemask_generate_tag(Operator):
     bl_idname = "scene.myfacemask_generate_tag"
     bl_label = "Insert tag"
@@ -773,11 +1373,8 @@ class myfacemask_generate_tag(Operator):
         text_scene = bpy.data.scenes['Text']
         code = context.scene.myfacemask_id
         if code == '': code = 'WASP'
-        text_scene.objects['Text'].data.body = code
-        #image_path = bpy.context.preferences.filepaths.temporary_directory + "\\tag.png"
-        image_path = str(Path(tempfile.gettempdir()) / 'tag.png')
-        text_scene.render.filepath = image_path
-        bpy.ops.render.render(scene='Text', write_still=1)
+        image_path, rendered = render_tag(text_scene, code)
+        print("MyFaceMask: Tag {} {}".format(code, 'rendered' if rendered else 'from cache'))
 
         for o in context.scene.objects: o.select_set(False)
         mask = bpy.data.objects['Mask']
@@ -802,9 +1399,7 @@ class myfacemask_generate_tag(Operator):
         me.update()
 
         # generate brush texture
-        tex = bpy.data.textures.new('TAG','IMAGE')
-        img = bpy.data.images.load(filepath=image_path)
-        tex.image = img
+        tex = tag_texture(image_path, rendered)
         brush = bpy.data.brushes["SculptDraw"]
         context.tool_settings.sculpt.brush.sculpt_tool = 'DRAW'
         context.tool_settings.sculpt.brush = brush
@@ -819,6 +1414,41 @@ class myfacemask_generate_tag(Operator):
         context.scene.tool_settings.sculpt.detail_size = 1
         return {'FINISHED'}
 
+def is_solidified(edges, n_verts):
+    '''
+    Check the layout of a solidified mesh: the second half of the vertices is
+    a copy of the first half, with the same edges
+    '''
+    if n_verts % 2: return False
+    n_half = n_verts//2
+    edges = np.sort(np.asarray(edges, dtype='int64'), axis=1)
+    low = edges[edges[:,1] < n_half]
+    high = edges[edges[:,0] >= n_half] - n_half
+    if len(low) != len(high): return False
+    return np.array_equal(np.sort(low[:,0]*n_half + low[:,1]), np.sort(high[:,0]*n_half + high[:,1]))
+
+def shell_thickness_correction(me, thickness):
+    '''
+    Place every vertex of the outer shell at the given horizontal distance
+    from its inner vertex. Returns False if the mesh isn't solidified.
+    '''
+    n_verts = len(me.vertices)
+    # the modifiers have just been applied, don't use the cached arrays
+    if not is_solidified(MeshArrays(me).edges, n_verts): return False
+    co = np.empty(n_verts*3, dtype='float32')
+    me.vertices.foreach_get('co', co)
+    co = co.reshape((2, n_verts//2, 3))
+    direction = co[1] - co[0]
+    direction[:,2] = 0
+    length = np.linalg.norm(direction, axis=1, keepdims=True)
+    np.divide(direction, length, out=direction, where=length > 0)
+    direction[length[:,0] == 0] = 0
+    co[1] = co[0] + direction*thickness
+    me.vertices.foreach_set('co', co.reshape(-1))
+    me.update()
+    mesh_arrays_invalidate(me)
+    return True
+
 class myfacemask_boolean(Operator):
     bl_idname = "object.myfacemask_boolean"
     bl_label = "Prepare model"
@@ -834,49 +1464,37 @@ class myfacemask_boolean(Operator):
 
     def execute(self, context):
         scene = context.scene
-        for o in scene.objects: o.select_set(False)
+        if context.object and context.object.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
 
         surf = bpy.data.objects['Mask_Surface']
-        surf.select_set(True)
-        bpy.context.view_layer.objects.active = surf
         thickness = surf.modifiers['Thickness'].thickness
-        for m in surf.modifiers:
-            try:
-                bpy.ops.object.modifier_apply(apply_as='DATA', modifier=m.name)
-            except: pass
-        surf.data.update()
-        me = surf.data
-        n_verts = len(me.vertices)
-        n_half = int(n_verts/2)
-        for i in range(n_half):
-            v0 = me.vertices[i]
-            v1 = me.vertices[i+n_half]
-            v2 = v1.co-v0.co
-            v2 = Vector((v2.x,v2.y,0))
-            v1.co = v2.normalized()*thickness + v0.co
+        depsgraph = context.evaluated_depsgraph_get()
+        bake_modifiers(surf, [m.name for m in surf.modifiers if m.show_viewport], depsgraph)
+        if not shell_thickness_correction(surf.data, thickness):
+            self.report({'WARNING'}, "Unexpected Mask_Surface topology, thickness not corrected")
 
+        # the mask is a copy of the filter with all its modifiers applied
         filter = bpy.data.objects['Filter']
-        filter.select_set(True)
-        bpy.context.view_layer.objects.active = filter
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.duplicate_move()
-
-        ob = context.object
+        ob = filter.copy()
+        ob.data = filter.data.copy()
+        for c in filter.users_collection: c.objects.link(ob)
         ob.name = 'Mask'
         for m in ob.modifiers: m.show_viewport = True
-        for m in ob.modifiers:
-            try:
-                bpy.ops.object.modifier_apply(apply_as='DATA', modifier=m.name)
-            except:
-                ob.modifiers.remove(m)
-        bpy.ops.object.location_clear(clear_delta=False)
-        bpy.ops.object.rotation_clear(clear_delta=False)
-        bpy.ops.view3d.view_selected()
+        bake_modifiers(ob, None, depsgraph)
+        ob.modifiers.clear()
+        ob.location = (0,0,0)
+        ob.rotation_euler = (0,0,0)
+        for o in scene.objects: o.select_set(False)
+        context.view_layer.objects.active = ob
+        # the viewport is missing in background mode
+        view3d = context.space_data and context.space_data.type == 'VIEW_3D'
+        if view3d: bpy.ops.view3d.view_selected()
         for o in scene.objects: o.hide_viewport = True
         ob.hide_viewport = False
         ob.select_set(True)
         bpy.ops.object.mode_set(mode='EDIT')
-        bpy.context.space_data.overlay.show_statvis = True
+        if view3d: context.space_data.overlay.show_statvis = True
         bpy.context.scene.tool_settings.statvis.type = 'OVERHANG'
         bpy.ops.mesh.select_mode(use_extend=False, use_expand=False, type='FACE')
         bpy.ops.mesh.select_all(action='DESELECT')
@@ -968,231 +1586,101 @@ class myfacemask_place_filter(Operator):
         return {'FINISHED'}
 
 
-def contour_edges_pattern(operator, c, verts_count, iso_val, vertices, normals, filtered_edges, weight, pattern_weight, bevel_weight):
-    # vertices indexes
-    id0 = filtered_edges[:,0]
-    id1 = filtered_edges[:,1]
-    # vertices weight
-    w0 = weight[id0]
-    w1 = weight[id1]
-    # weight condition
-    bool_w0 = w0 < iso_val
-    bool_w1 = w1 < iso_val
-
-    # mask all edges that have one weight value below the iso value
-    mask_new_verts = np.logical_xor(bool_w0, bool_w1)
-    if not mask_new_verts.any():
-        return np.array([[None]]), {}, np.array([[None]]), np.array([[None]])
-
-    id0 = id0[mask_new_verts]
-    id1 = id1[mask_new_verts]
-    # filter arrays
-    v0 = vertices[id0]
-    v1 = vertices[id1]
-    n0 = normals[id0]
-    n1 = normals[id1]
-    w0 = w0[mask_new_verts]
-    w1 = w1[mask_new_verts]
-    pattern0 = pattern_weight[id0]
-    pattern1 = pattern_weight[id1]
-    try:
-        bevel0 = bevel_weight[id0]
-        bevel1 = bevel_weight[id1]
-    except: pass
-    param = (iso_val-w0)/(w1-w0)
-    # pattern displace
-    #mult = 1 if c%2 == 0 else -1
-    if c%(operator.in_steps + operator.out_steps) < operator.in_steps:
-        mult = operator.in_displace
-    else:
-        mult = operator.out_displace
-    pattern_value = pattern0 + (pattern1-pattern0)*param
-    try:
-        bevel_value = bevel0 + (bevel1-bevel0)*param
-        bevel_value = np.expand_dims(bevel_value,axis=1)
-    except: bevel_value = None
-    disp = pattern_value * mult
-    param = np.expand_dims(param,axis=1)
-    disp = np.expand_dims(disp,axis=1)
-    verts = v0 + (v1-v0)*param
-    norm = n0 + (n1-n0)*param
-    if operator.limit_z: disp *= 1-abs(np.expand_dims(norm[:,2], axis=1))
-    verts = verts + norm*disp
-
-    # indexes of edges with new vertices
-    edges_index = filtered_edges[mask_new_verts][:,2]
-
-    # remove all edges completely below the iso value
-    #mask_edges = np.logical_not(np.logical_and(bool_w0, bool_w1))
-    #filtered_edges = filtered_edges[mask_edges]
-    return filtered_edges, edges_index, verts, bevel_value
-
-def contour_edges_pattern_eval(operator, c, verts_count, iso_val, vertices, normals, filtered_edges, weight, pattern_weight):
-    # vertices indexes
-    id0 = eval('filtered_edges[:,0]')
-    id1 = eval('filtered_edges[:,1]')
-    # vertices weight
-    w0 = eval('weight[id0]')
-    w1 = eval('weight[id1]')
-    # weight condition
-    bool_w0 = ne.evaluate('w0 < iso_val')
-    bool_w1 = ne.evaluate('w1 < iso_val')
-
-    # mask all edges that have one weight value below the iso value
-    mask_new_verts = eval('np.logical_xor(bool_w0, bool_w1)')
-    if not mask_new_verts.any(): return np.array([[None]]), {}, np.array([[None]])
-
-    id0 = eval('id0[mask_new_verts]')
-    id1 = eval('id1[mask_new_verts]')
-    # filter arrays
-    v0 = eval('vertices[id0]')
-    v1 = eval('vertices[id1]')
-    n0 = eval('normals[id0]')
-    n1 = eval('normals[id1]')
-    w0 = eval('w0[mask_new_verts]')
-    w1 = eval('w1[mask_new_verts]')
-    pattern0 = eval('pattern_weight[id0]')
-    pattern1 = eval('pattern_weight[id1]')
-    param = ne.evaluate('(iso_val-w0)/(w1-w0)')
-    # pattern displace
-    #mult = 1 if c%2 == 0 else -1
-    if c%(operator.in_steps + operator.out_steps) < operator.in_steps:
-        mult = -operator.in_displace
-    else:
-        mult = operator.out_displace
-    pattern_value = eval('pattern0 + (pattern1-pattern0)*param')
-    disp = ne.evaluate('pattern_value * mult')
-    param = eval('np.expand_dims(param,axis=1)')
-    disp = eval('np.expand_dims(disp,axis=1)')
-    verts = ne.evaluate('v0 + (v1-v0)*param')
-    norm = ne.evaluate('n0 + (n1-n0)*param')
-    if operator.limit_z:
-        mult = eval('1-abs(np.expand_dims(norm[:,2], axis=1))')
-        disp = ne.evaluate('disp * mult')
-    verts = ne.evaluate('verts + norm*disp')
-
-    # indexes of edges with new vertices
-    edges_index = eval('filtered_edges[mask_new_verts][:,2]')
-
-    # remove all edges completely below the iso value
-    mask_edges = eval('np.logical_not(np.logical_and(bool_w0, bool_w1))')
-    filtered_edges = eval('filtered_edges[mask_edges]')
-    return filtered_edges, edges_index, verts
-
-
-def contour_bmesh(me, bm, weight, iso_val):
-    bm.verts.ensure_lookup_table()
-    bm.edges.ensure_lookup_table()
-    bm.faces.ensure_lookup_table()
-
-    # store weight values
-
+def contour_split_mesh(ob, iso_val, keep='ALL', smooth_iterations=0, smooth_factor=0.5, smooth_strength=1):
+    '''
+    Split the faces of the object's mesh along the iso value of the active
+    Vertex Group, smoothed like in Adapt Mask. All the Vertex Groups are
+    interpolated on the new vertices, the face attributes are copied from the
+    original faces. The face corner data (UV maps, corner colors) and the
+    other point attributes are not kept.
+    keep: 'ALL' the faces, or only the faces 'ABOVE' or 'BELOW' the iso value
+    Returns the number of new vertices.
+    '''
+    me = ob.data
+    active = ob.vertex_groups.active_index
+    names = [vertex_group.name for vertex_group in ob.vertex_groups]
+    weights, members = get_weights_numpy(ob, list(range(len(names))), return_members=True)
+    attributes = get_faces_attributes(me)
     vertices = get_vertices_numpy(me)
-    faces_mask = np.array(bm.faces)
-    filtered_edges = get_edges_id_numpy(me)
-    n_verts = len(bm.verts)
-
-    #############################
-
-    # vertices indexes
-    id0 = filtered_edges[:,0]
-    id1 = filtered_edges[:,1]
-    # vertices weight
-    w0 = weight[id0]
-    w1 = weight[id1]
-    # weight condition
-    bool_w0 = w0 < iso_val
-    bool_w1 = w1 < iso_val
-
-    # mask all edges that have one weight value below the iso value
-    mask_new_verts = np.logical_xor(bool_w0, bool_w1)
-    if not mask_new_verts.any(): return np.array([[None]]), {}, np.array([[None]])
-
-    id0 = id0[mask_new_verts]
-    id1 = id1[mask_new_verts]
-    # filter arrays
-    v0 = vertices[id0]
-    v1 = vertices[id1]
-    w0 = w0[mask_new_verts]
-    w1 = w1[mask_new_verts]
-    param = (iso_val-w0)/(w1-w0)
-    param = np.expand_dims(param,axis=1)
-    verts = v0 + (v1-v0)*param
-
-    # indexes of edges with new vertices
-    #edges_index = filtered_edges[mask_new_verts][:,2]
-
-    edges_id = {}
-    for i, e in enumerate(filtered_edges):
-        #edges_id[id] = i + n_verts
-        edges_id['{}_{}'.format(e[0],e[1])] = i + n_verts
-        edges_id['{}_{}'.format(e[1],e[0])] = i + n_verts
-
-    splitted_faces = []
-
-    switch = False
-    # splitting faces
-    for f in faces_mask:
-        # create sub-faces slots. Once a new vertex is reached it will
-        # change slot, storing the next vertices for a new face.
-        build_faces = [[],[]]
-        #switch = False
-        verts0 = list(me.polygons[f.index].vertices)
-        verts1 = list(verts0)
-        verts1.append(verts1.pop(0)) # shift list
-        for id0, id1 in zip(verts0, verts1):
-
-            # add first vertex to active slot
-            build_faces[switch].append(id0)
-
-            # try to split edge
-            try:
-                # check if the edge must be splitted
-                new_vert = edges_id['{}_{}'.format(id0,id1)]
-                # add new vertex
-                build_faces[switch].append(new_vert)
-                # if there is an open face on the other slot
-                if len(build_faces[not switch]) > 0:
-                    # store actual face
-                    splitted_faces.append(build_faces[switch])
-                    # reset actual faces and switch
-                    build_faces[switch] = []
-                    # change face slot
-                switch = not switch
-                # continue previous face
-                build_faces[switch].append(new_vert)
-            except: pass
-        if len(build_faces[not switch]) == 2:
-            build_faces[not switch].append(id0)
-        if len(build_faces[not switch]) > 2:
-            splitted_faces.append(build_faces[not switch])
-        # add last face
-        splitted_faces.append(build_faces[switch])
-
-    # adding new vertices use fast local method access
-    _new_vert = bm.verts.new
-    for v in verts: _new_vert(v)
-    bm.verts.ensure_lookup_table()
-
-    # deleting old edges/faces
-    bm.edges.ensure_lookup_table()
-    remove_edges = [bm.edges[i] for i in filtered_edges[:,2]]
-    #for e in remove_edges: bm.edges.remove(e)
-    #for e in delete_edges: bm.edges.remove(e)
-
-    bm.verts.ensure_lookup_table()
-    # adding new faces use fast local method access
-    _new_face = bm.faces.new
-    missed_faces = []
-    for f in splitted_faces:
-        try:
-            face_verts = [bm.verts[i] for i in f]
-            _new_face(face_verts)
-        except:
-            missed_faces.append(f)
+    loop_start, loop_total, loop_verts = get_faces_csr_numpy(me)
+    contour_mesh = ContourMesh(vertices, get_edges_numpy(me), loop_start, loop_total, loop_verts, get_loop_edges_numpy(me))
+    weight = contour_mesh.smooth(weights[active], smooth_iterations, smooth_factor, smooth_strength)
+    # no vertex on the cut
+    iso_val = nudge_iso_value(weight, iso_val)
+    edges = contour_mesh.edges[crossed_edges(contour_mesh, weight, iso_val)]
+    vertices, loop_start, loop_total, loop_verts, weight, faces_side, faces_origin = split_faces(
+        contour_mesh, weight, iso_val, return_origin=True)
+    # the new vertices are in the same order of the crossed edges
+    w0, w1 = weight[edges[:,0]], weight[edges[:,1]]
+    param = (iso_val - w0)/(w1 - w0)
+    weights = np.concatenate((weights, weights[:,edges[:,0]]*(1-param) + weights[:,edges[:,1]]*param), axis=1)
+    # the new vertices belong to the groups of either edge vertex
+    members = np.concatenate((members, members[:,edges[:,0]] | members[:,edges[:,1]]), axis=1)
+    if keep != 'ALL':
+        faces = np.flatnonzero(faces_side == (keep == 'ABOVE'))
+        loop_total = loop_total[faces]
+        loop_verts = loop_verts[ranges_indexes(loop_start[faces], loop_total)]
+        loop_start = np.cumsum(loop_total) - loop_total
+        faces_origin = faces_origin[faces]
+        # remove the vertices of the deleted faces
+        used, loop_verts = np.unique(loop_verts, return_inverse=True)
+        vertices = vertices[used]
+        weights = weights[:,used]
+        members = members[:,used]
+    mesh_from_faces_csr(me, vertices, loop_start, loop_total, loop_verts.reshape(-1))
+    set_faces_attributes(me, attributes, faces_origin)
+    # the Vertex Groups are part of the mesh since Blender 3.0
+    for name, weight, assigned in zip(names, weights, members):
+        set_weight_numpy(ob, name, weight, assigned)
+    ob.vertex_groups.active_index = active
+    return len(edges)
+
+class myfacemask_cut_border(Operator):
+    bl_idname = "object.myfacemask_cut_border"
+    bl_label = "Cut Along Border"
+    bl_options = {'REGISTER', 'UNDO'}
+    bl_description = ("Cut the faces along the border of the active Vertex Group")
+
+    iso_value : FloatProperty(
+        name="Border Value", default=0.5, min=0, max=1,
+        description="Weight value of the cut")
+    keep : EnumProperty(
+        items=(
+            ('ALL', "All", "Keep all the faces"),
+            ('ABOVE', "Inside", "Keep the faces above the border value"),
+            ('BELOW', "Outside", "Keep the faces below the border value")),
+        default='ALL', name="Keep",
+        description="Faces kept after the cut")
+    use_smooth : BoolProperty(
+        name="Smooth Weights", default=True,
+        description="Smooth the weights like Adapt Mask, the cut follows the previewed border")
 
-    #me = bpy.data.meshes.new('_tissue_tmp_')
-    bm.to_mesh(me)
-    weight = np.concatenate((weight, np.ones(len(verts))*iso_val))
+    @classmethod
+    def poll(cls, context):
+        ob = context.object
+        try: return ob.type == 'MESH' and ob.vertex_groups.active != None
+        except: return False
+
+    def invoke(self, context, event):
+        # cut where Adapt Mask places the border
+        self.iso_value = adapt_mask_settings().iso_value
+        return self.execute(context)
 
-    return me, bm, weight
+    def execute(self, context):
+        start_time = time.time()
+        ob = context.object
+        mode = ob.mode
+        bpy.ops.object.mode_set(mode='OBJECT')
+        settings = adapt_mask_settings()
+        smooth = (settings.smooth_iterations, settings.smooth_factor, settings.smooth_strength) if self.use_smooth else ()
+        # the face corner data can't be interpolated on the cut
+        corners = len(ob.data.uv_layers) > 0 or any([a.domain == 'CORNER' and not a.name.startswith('.')
+            for a in getattr(ob.data, 'attributes', [])])
+        n_verts = contour_split_mesh(ob, self.iso_value, self.keep, *smooth)
+        bpy.ops.object.mode_set(mode=mode)
+        if n_verts == 0:
+            self.report({'WARNING'}, "The border value doesn't cross the mesh")
+        elif corners:
+            self.report({'WARNING'}, "UV maps and face corner attributes are removed by the cut")
+        print("MyFaceMask: cut along the border, {} new vertices in {:.2f} sec".format(n_verts, time.time() - start_time))
+        return {'FINISHED'}
@@ -0,0 +1,126 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# ---------------------------- Numba Functions ------------------------------- #
+#                                                                              #
+# Optional JIT compiled kernels. Importing this module raises ImportError if   #
+# numba is not installed, the callers fall back to their NumPy versions.       #
+# The compiled functions are cached on disk (cache=True).                      #
+#                                                                              #
+# ############################################################################ #
+
+import numpy as np
+from numba import njit, prange
+
+@njit(cache=True)
+def numba_lerp2(v00, v10, v01, v11, vx, vy):
+    co0 = v00 + (v10 - v00) * vx
+    co1 = v01 + (v11 - v01) * vx
+    return co0 + (co1 - co0) * vy
+
+@njit(parallel=True, cache=True)
+def numba_contour_kernel(v0, v1, w0, w1, iso_val):
+    n = v0.shape[0]
+    verts = np.empty((n, 3))
+    for i in prange(n):
+        param = (iso_val - w0[i]) / (w1[i] - w0[i])
+        for j in range(3):
+            verts[i,j] = v0[i,j] + (v1[i,j] - v0[i,j]) * param
+    return verts
+
+@njit(parallel=True, cache=True)
+def numba_contour_kernel_displace(v0, v1, w0, w1, iso_val, n0, n1, pattern0, pattern1, displace, limit_z):
+    n = v0.shape[0]
+    verts = np.empty((n, 3))
+    for i in prange(n):
+        param = (iso_val - w0[i]) / (w1[i] - w0[i])
+        disp = (pattern0[i] + (pattern1[i] - pattern0[i]) * param) * displace
+        if limit_z:
+            disp *= 1 - abs(n0[i,2] + (n1[i,2] - n0[i,2]) * param)
+        for j in range(3):
+            norm = n0[i,j] + (n1[i,j] - n0[i,j]) * param
+            verts[i,j] = v0[i,j] + (v1[i,j] - v0[i,j]) * param + norm * disp
+    return verts
+
+@njit(cache=True)
+def numba_pair_segments(loop_start, loop_total, loop_edges, faces, sorted_edges, order, verts_count):
+    '''
+    Join the consecutive crossings of every face, the faces crossed an odd
+    number of times are skipped. Returns the segments and their faces.
+    '''
+    n_loops = 0
+    for f in faces: n_loops += loop_total[f]
+    segments = np.empty((n_loops//2 + 1, 2), dtype=np.int64)
+    segments_face = np.empty(n_loops//2 + 1, dtype=np.int64)
+    crossings = np.empty(n_loops + 1, dtype=np.int64)
+    count = 0
+    for f in faces:
+        n = 0
+        for l in range(loop_start[f], loop_start[f] + loop_total[f]):
+            e = loop_edges[l]
+            id = np.searchsorted(sorted_edges, e)
+            if id < len(sorted_edges) and sorted_edges[id] == e:
+                crossings[n] = order[id] + verts_count
+                n += 1
+        if n % 2 == 1: continue
+        for i in range(0, n, 2):
+            segments[count,0] = crossings[i]
+            segments[count,1] = crossings[i+1]
+            segments_face[count] = f
+            count += 1
+    return segments[:count], segments_face[:count]
+
+@njit(cache=True)
+def numba_walk_curves(indptr, adj_edges, adj_verts, starts, n_edges):
+    '''
+    Walk the unvisited edges from every starting point.
+    Returns the concatenated curves and the index where each one starts.
+    '''
+    cursor = indptr[:-1].copy()
+    visited = np.zeros(n_edges, dtype=np.bool_)
+    # every curve has at least one edge, so the curves have at most
+    # 2*n_edges points (branching points start more curves than the starts),
+    # plus the start written before finding no edges to walk
+    curves = np.empty(2*n_edges + 1, dtype=np.int64)
+    curves_start = np.empty(n_edges + 1, dtype=np.int64)
+    count = 0
+    n_curves = 0
+    for start in starts:
+        while True:
+            first = count
+            curves[count] = start
+            count += 1
+            v = start
+            while True:
+                # next unvisited edge of the vertex
+                i = cursor[v]
+                end = indptr[v+1]
+                while i < end and visited[adj_edges[i]]: i += 1
+                cursor[v] = i
+                if i == end: break
+                visited[adj_edges[i]] = True
+                v = adj_verts[i]
+                curves[count] = v
+                count += 1
+            if count - first == 1:
+                count = first
+                break
+            curves_start[n_curves] = first
+            n_curves += 1
+    curves_start[n_curves] = count
+    return curves[:count], curves_start[:n_curves+1]
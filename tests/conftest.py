@@ -0,0 +1,13 @@
+# The add-on __init__ registers the Blender classes and needs bpy. pytest
+# imports it to set up the package of the tests, so the add-on folder is
+# registered as an empty package, the bpy-free modules are tested alone.
+
+import os, sys, types
+
+addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+addon_name = os.path.basename(addon_dir)
+if addon_name not in sys.modules:
+    addon = types.ModuleType(addon_name)
+    addon.__file__ = os.path.join(addon_dir, '__init__.py')
+    addon.__path__ = [addon_dir]
+    sys.modules[addon_name] = addon
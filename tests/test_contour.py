@@ -0,0 +1,522 @@
+# Tests of the bpy-free contouring core, run with: python -m pytest tests
+
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import contour
+
+def random_curves(n_curves, length, closed, branches=0, seed=0):
+    '''
+    Segments of random polylines and loops, with shuffled and flipped
+    segments and permuted vertices. Branches are extra segments from a
+    random vertex of the curves to a new vertex.
+    '''
+    rng = np.random.default_rng(seed)
+    edges = []
+    n_verts = 0
+    for c in range(n_curves):
+        n = int(rng.integers(3, length+1))
+        verts = np.arange(n_verts, n_verts + n)
+        n_verts += n
+        edges.append(np.stack((verts[:-1], verts[1:]), axis=1))
+        if closed: edges.append([[verts[-1], verts[0]]])
+    for b in range(branches):
+        edges.append([[int(rng.integers(n_verts)), n_verts]])
+        n_verts += 1
+    edges = np.concatenate(edges)
+    permutation = rng.permutation(n_verts)
+    edges = permutation[edges]
+    edges = edges[rng.permutation(len(edges))]
+    flip = rng.random(len(edges)) < 0.5
+    edges[flip] = edges[flip][:,::-1]
+    return edges, n_verts
+
+def canonical_curve(curve):
+    '''
+    Curve independent of its direction and, for closed curves, of its
+    starting point
+    '''
+    curve = [int(v) for v in curve]
+    if len(curve) > 2 and curve[0] == curve[-1]:
+        ring = curve[:-1]
+        i = ring.index(min(ring))
+        ring = ring[i:] + ring[:i]
+        reverse = ring[:1] + ring[1:][::-1]
+        return ('closed', tuple(min(ring, reverse)))
+    return ('open', tuple(min(curve, curve[::-1])))
+
+def curves_edges(curves):
+    edges = [np.stack((c[:-1], c[1:]), axis=1) for c in curves if len(c) > 1]
+    if len(edges) == 0: return np.zeros((0,2), dtype='int')
+    return np.sort(np.concatenate(edges), axis=1)
+
+def assert_same_edges(curves, edges):
+    '''
+    The curves walk every segment exactly once
+    '''
+    walked = curves_edges(curves)
+    edges = np.sort(np.asarray(edges), axis=1)
+    walked = walked[np.lexsort(walked.T[::-1])]
+    edges = edges[np.lexsort(edges.T[::-1])]
+    assert np.array_equal(walked, edges)
+
+def grid_mesh(n=30):
+    '''
+    ContourMesh of a n x n grid of quads and a radial weight
+    '''
+    index = np.arange(n*n).reshape((n,n))
+    faces = np.stack((index[:-1,:-1], index[:-1,1:], index[1:,1:], index[1:,:-1]), axis=-1).reshape((-1,4))
+    loops = np.stack((faces, np.roll(faces, -1, axis=1)), axis=-1).reshape((-1,2))
+    edges, loop_edges = np.unique(np.sort(loops, axis=1), axis=0, return_inverse=True)
+    y, x = np.divmod(np.arange(n*n), n)
+    vertices = np.stack((x, y, np.zeros(n*n)), axis=1).astype('float')
+    weight = np.exp(-((x - n/2)**2 + (y - n/2)**2)/(n*2))
+    mesh = contour.ContourMesh(vertices, edges, np.arange(len(faces))*4, np.full(len(faces), 4),
+        faces.reshape(-1), loop_edges.reshape(-1))
+    return mesh, weight
+
+def polygons_area(vertices, loop_start, loop_total, loop_verts):
+    return contour.faces_area(vertices, loop_start, loop_total, loop_verts).sum()
+
+@pytest.fixture
+def numpy_only(monkeypatch):
+    monkeypatch.setattr(contour, 'nb', None)
+    kernels = {k: kernel for k, kernel in contour.contour_kernels.items() if k != 'NUMBA'}
+    monkeypatch.setattr(contour, 'contour_kernels', kernels)
+
+@pytest.mark.parametrize('closed', [False, True])
+@pytest.mark.parametrize('seed', range(5))
+def test_find_curves_matches_dict(numpy_only, closed, seed):
+    edges, n_verts = random_curves(50, 40, closed, seed=seed)
+    curves = contour.find_curves(edges, n_verts)
+    expected = contour.find_curves_dict(edges.tolist(), n_verts)
+    assert sorted(map(canonical_curve, curves)) == sorted(map(canonical_curve, expected))
+
+def test_find_curves_mixed(numpy_only):
+    open_edges, n_open = random_curves(30, 20, False, seed=1)
+    closed_edges, n_closed = random_curves(30, 20, True, seed=2)
+    edges = np.concatenate((open_edges, closed_edges + n_open))
+    curves = contour.find_curves(edges, n_open + n_closed)
+    expected = contour.find_curves_dict(edges.tolist(), n_open + n_closed)
+    assert sorted(map(canonical_curve, curves)) == sorted(map(canonical_curve, expected))
+    closed = [c for c in curves if c[0] == c[-1]]
+    assert len(closed) == 30
+
+@pytest.mark.parametrize('seed', range(5))
+def test_find_curves_branches(numpy_only, seed):
+    # the old implementation drops segments at the branching points
+    edges, n_verts = random_curves(20, 30, seed % 2 == 0, branches=15, seed=seed)
+    curves = contour.find_curves(edges, n_verts)
+    assert_same_edges(curves, edges)
+    for c in curves: assert len(c) > 1
+
+def test_find_curves_y_graph(numpy_only):
+    edges = np.array([[0,1],[0,2],[0,3]])
+    curves = contour.find_curves(edges, 4)
+    assert_same_edges(curves, edges)
+
+def test_find_curves_empty(numpy_only):
+    assert contour.find_curves(np.zeros((0,2), dtype='int'), 10) == []
+
+def test_split_faces(numpy_only):
+    mesh, weight = grid_mesh()
+    vertices, loop_start, loop_total, loop_verts, new_weight, faces_side = contour.split_faces(mesh, weight, 0.5)
+    n_new = len(contour.crossed_edges(mesh, weight, 0.5))
+    assert n_new > 0
+    assert len(vertices) == len(mesh.vertices) + n_new
+    assert np.allclose(new_weight[len(mesh.vertices):], 0.5)
+    # the faces cover the same surface
+    area = polygons_area(mesh.vertices, mesh.loop_start, mesh.loop_total, mesh.loop_verts)
+    assert np.isclose(polygons_area(vertices, loop_start, loop_total, loop_verts), area)
+    # every face is on one side of the iso value
+    faces = np.repeat(np.arange(len(loop_start)), loop_total)
+    w_min = np.minimum.reduceat(new_weight[loop_verts], loop_start)
+    w_max = np.maximum.reduceat(new_weight[loop_verts], loop_start)
+    assert np.all(np.where(faces_side, w_min >= 0.5 - 1e-9, w_max <= 0.5 + 1e-9))
+
+@pytest.mark.parametrize('iso_val', [-1, 2])
+def test_split_faces_not_crossed(numpy_only, iso_val):
+    mesh, weight = grid_mesh()
+    vertices, loop_start, loop_total, loop_verts, new_weight, faces_side = contour.split_faces(mesh, weight, iso_val)
+    assert len(vertices) == len(mesh.vertices)
+    assert np.array_equal(loop_verts, mesh.loop_verts)
+    assert np.all(faces_side == (iso_val < 0))
+
+@pytest.fixture
+def numba_walk():
+    pytest.importorskip('numba')
+    if contour.nb is None: pytest.skip("numba_functions can't be imported")
+
+def find_curves_numpy(edges, n_verts):
+    nb, contour.nb = contour.nb, None
+    try: return contour.find_curves(edges, n_verts)
+    finally: contour.nb = nb
+
+@pytest.mark.parametrize('closed', [False, True])
+@pytest.mark.parametrize('seed', range(3))
+def test_numba_find_curves_matches_dict(numba_walk, closed, seed):
+    edges, n_verts = random_curves(50, 40, closed, seed=seed)
+    curves = contour.find_curves(edges, n_verts)
+    expected = contour.find_curves_dict(edges.tolist(), n_verts)
+    assert sorted(map(canonical_curve, curves)) == sorted(map(canonical_curve, expected))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_numba_find_curves_branches(numba_walk, seed):
+    # find_curves_dict drops the segments at the branching points, the walk
+    # is checked against the NumPy one and against the segments
+    edges, n_verts = random_curves(20, 30, seed % 2 == 0, branches=40, seed=seed)
+    curves = contour.find_curves(edges, n_verts)
+    assert_same_edges(curves, edges)
+    expected = find_curves_numpy(edges, n_verts)
+    assert len(curves) == len(expected)
+    for c0, c1 in zip(curves, expected): assert np.array_equal(c0, c1)
+
+@pytest.mark.parametrize('edges', [
+    [[0,1],[0,2],[0,3]],
+    [[0,1],[0,2],[0,3],[0,4],[0,5]],
+    [[0,1],[2,3],[4,5]],
+    [[0,1],[1,2],[2,0],[0,3],[3,4],[4,0]]])
+def test_numba_find_curves_stars(numba_walk, edges):
+    edges = np.array(edges)
+    curves = contour.find_curves(edges, int(edges.max()) + 1)
+    assert_same_edges(curves, edges)
+
+def grid_pattern(mesh, seed=0):
+    '''
+    Random unit normals and pattern weight for the displaced contours
+    '''
+    rng = np.random.default_rng(seed)
+    normals = rng.normal(size=(len(mesh.vertices), 3))
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals, rng.random(len(mesh.vertices))
+
+@pytest.mark.parametrize('backend', ['NUMPY', 'NUMEXPR', 'NUMBA'])
+@pytest.mark.parametrize('displace', [0, 0.2])
+@pytest.mark.parametrize('limit_z', [False, True])
+def test_contour_kernels(monkeypatch, backend, displace, limit_z):
+    if backend == 'NUMEXPR': pytest.importorskip('numexpr')
+    if backend == 'NUMBA': pytest.importorskip('numba')
+    if backend not in contour.contour_kernels: pytest.skip("{} kernel can't be imported".format(backend))
+    mesh, weight = grid_mesh()
+    mesh.normals, pattern = grid_pattern(mesh)
+    iso_values = [0.2, 0.5, 0.8]
+    monkeypatch.setattr(contour, 'contour_backend', 'NUMPY')
+    expected = mesh.contour(weight, iso_values, pattern, displace, limit_z)
+    monkeypatch.setattr(contour, 'contour_backend', backend)
+    contours = mesh.contour(weight, iso_values, pattern, displace, limit_z)
+    for (verts, segments), (expected_verts, expected_segments) in zip(contours, expected):
+        assert len(segments) > 0
+        assert np.allclose(verts, expected_verts, rtol=1e-12, atol=1e-12)
+        assert np.array_equal(segments, expected_segments)
+
+@pytest.mark.parametrize('seed', range(3))
+def test_iso_edges_index(seed):
+    rng = np.random.default_rng(seed)
+    w = rng.random((500, 2)).round(2)
+    iso_values = np.array([0.5, 0.1, 0.25, 0.9, 0.33])
+    indptr, edges = contour.iso_edges_index(w[:,0], w[:,1], iso_values)
+    w_min, w_max = w.min(axis=1), w.max(axis=1)
+    for i, iso_val in enumerate(np.sort(iso_values)):
+        expected = np.flatnonzero((w_min < iso_val) & (iso_val <= w_max))
+        assert np.array_equal(edges[indptr[i]:indptr[i+1]], expected)
+
+def test_contour_levels(numpy_only):
+    # the levels share the index, the same iso value can be repeated
+    mesh, weight = grid_mesh()
+    iso_values = [0.5, 0.3, 0.5, 2]
+    contours = mesh.contour(weight, iso_values)
+    assert len(contours) == len(iso_values)
+    for iso_val, (verts, segments) in zip(iso_values, contours):
+        single_verts, single_segments = mesh.contour(weight, [iso_val])[0]
+        assert np.array_equal(verts, single_verts)
+        assert np.array_equal(segments, single_segments)
+    assert len(contours[0][1]) > 0
+    assert len(contours[3][0]) == 0
+
+def segments_keys(contour_state):
+    '''
+    Segments of an IncrementalContour as sorted pairs of splitted edges
+    '''
+    return sorted(map(tuple, np.sort(contour_state.segments_edges, axis=1).tolist()))
+
+@pytest.mark.parametrize('displace', [0, 0.3])
+def test_incremental_contour(numpy_only, displace):
+    mesh, weight = grid_mesh()
+    mesh.normals, pattern = grid_pattern(mesh)
+    border = contour.IncrementalContour(mesh, weight, 0.5, pattern, displace)
+    rng = np.random.default_rng(0)
+    for stroke in range(5):
+        # paint around a random vertex, moving the border
+        center = mesh.vertices[rng.integers(len(weight))]
+        brush = np.linalg.norm(mesh.vertices - center, axis=1) < 4
+        weight = weight.copy()
+        weight[brush] = rng.random(brush.sum())
+        pattern = pattern.copy()
+        pattern[brush] = rng.random(brush.sum())
+        assert border.update(weight, pattern) == brush.sum()
+        expected = contour.IncrementalContour(mesh, weight, 0.5, pattern, displace)
+        assert np.array_equal(border.edges_index, expected.edges_index)
+        assert np.allclose(border.verts, expected.verts)
+        assert segments_keys(border) == segments_keys(expected)
+        # the segments join the vertices of the same edges
+        assert np.array_equal(np.sort(border.edges_index[border.segments], axis=1),
+            np.sort(border.segments_edges, axis=1))
+    assert border.update(weight) == 0
+
+def douglas_peucker(pts, tolerance):
+    '''
+    Recursive reference of the Douglas-Peucker simplification, returns the
+    indexes of the kept points
+    '''
+    def segment_distance(p, a, b):
+        ab = b - a
+        l2 = ab @ ab
+        t = np.clip((p - a) @ ab / l2, 0, 1) if l2 > 0 else 0
+        return np.linalg.norm(p - a - ab*t)
+    def simplify(i, j):
+        if j - i < 2: return []
+        dist = [segment_distance(pts[k], pts[i], pts[j]) for k in range(i+1, j)]
+        k = i + 1 + int(np.argmax(dist))
+        if dist[k-i-1] <= tolerance: return []
+        return simplify(i, k) + [k] + simplify(k, j)
+    return [0] + simplify(0, len(pts)-1) + [len(pts)-1]
+
+def random_polyline(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 2*np.pi, n, endpoint=False)
+    radius = 10 + rng.random(n)
+    return np.stack((radius*np.cos(t), radius*np.sin(t), rng.random(n)), axis=1)
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('tolerance', [0.1, 0.5, 2])
+def test_simplify_polyline(seed, tolerance):
+    pts = random_polyline(seed=seed)
+    expected = pts[douglas_peucker(pts, tolerance)]
+    assert np.array_equal(contour.simplify_polyline(pts, tolerance), expected)
+    # loops are split at the farthest point from the first one
+    loop = np.concatenate((pts, pts[:1]))
+    far = int(np.argmax(np.linalg.norm(loop - loop[0], axis=1)))
+    expected = np.concatenate((loop[:far+1][douglas_peucker(loop[:far+1], tolerance)][:-1],
+        loop[far:][douglas_peucker(loop[far:], tolerance)][:-1]))
+    assert np.array_equal(contour.simplify_polyline(pts, tolerance, cyclic=True), expected)
+
+def test_simplify_polyline_short():
+    pts = random_polyline(2)
+    assert contour.simplify_polyline(pts, 1) is pts
+    assert contour.simplify_polyline(random_polyline(), 0).shape == (200, 3)
+
+def point_segment_distance(points, pts):
+    '''
+    Distance of every point from the polyline
+    '''
+    a, b = pts[:-1], pts[1:]
+    ab = b - a
+    ap = points[:,None] - a
+    t = np.clip(np.einsum('ijk,jk->ij', ap, ab) / np.einsum('ij,ij->i', ab, ab), 0, 1)
+    return np.linalg.norm(ap - ab*t[...,None], axis=2).min(axis=1)
+
+@pytest.mark.parametrize('cyclic', [False, True])
+def test_resample_polyline(cyclic):
+    pts = random_polyline(50)
+    closed = np.concatenate((pts, pts[:1])) if cyclic else pts
+    length = np.linalg.norm(np.diff(closed, axis=0), axis=1).sum()
+    new_pts = contour.resample_polyline(pts, 0.5, cyclic)
+    n_pts = int(round(length/0.5))
+    assert len(new_pts) == n_pts
+    # the new points lie on the polyline, at uniform arc length
+    assert np.allclose(point_segment_distance(new_pts, closed), 0, atol=1e-9)
+    assert np.allclose(new_pts[0], pts[0])
+    if not cyclic: assert np.allclose(new_pts[-1], pts[-1])
+    step = length/n_pts if cyclic else length/(n_pts - 1)
+    chords = np.linalg.norm(np.diff(new_pts, axis=0), axis=1)
+    assert np.all(chords <= step + 1e-9)
+    assert chords.mean() > step*0.9
+
+def stats_curves():
+    '''
+    A 4x2 rectangle loop, an open line of length 10 along X and a single
+    point
+    '''
+    verts = np.array([
+        [0,0,0], [4,0,0], [4,2,0], [0,2,0],
+        [0,5,0], [10,5,0],
+        [3,3,3]], dtype='float')
+    curves = [np.array([0,1,2,3,0]), np.array([4,5]), np.array([6])]
+    return verts, curves
+
+def test_curves_stats():
+    verts, curves = stats_curves()
+    stats = contour.curves_stats(verts, curves)
+    assert list(stats['n_points']) == [5, 2, 1]
+    assert list(stats['cyclic']) == [True, False, False]
+    assert np.allclose(stats['length'], [12, 10, 0])
+    assert np.allclose(stats['area'], [8, 0, 0])
+    assert np.allclose(stats['centroid'], [[2,1,0], [5,5,0], [3,3,3]])
+    assert np.allclose(stats['bbox_min'], [[0,0,0], [0,5,0], [3,3,3]])
+    assert np.allclose(stats['bbox_max'], [[4,2,0], [10,5,0], [3,3,3]])
+    assert len(contour.curves_stats(verts, [])) == 0
+
+def test_rank_curves():
+    verts, curves = stats_curves()
+    stats = contour.curves_stats(verts, curves)
+    assert list(contour.rank_curves(stats, 'SIZE_X')) == [1, 0, 2]
+    assert list(contour.rank_curves(stats, 'LENGTH')) == [0, 1, 2]
+    assert list(contour.rank_curves(stats, 'AREA')) == [0, 1, 2]
+    assert list(contour.rank_curves(stats, 'BBOX')) == [1, 0, 2]
+    assert list(contour.rank_curves(stats, 'SIZE_X', closed_first=True)) == [0, 1, 2]
+    with pytest.raises(ValueError):
+        contour.rank_curves(stats, 'VOLUME')
+
+def assert_frame(normal, axis_u, axis_v):
+    frame = np.array((axis_u, axis_v, normal))
+    assert np.allclose(frame @ frame.T, np.eye(3))
+
+def test_fit_plane():
+    rng = np.random.default_rng(0)
+    t = np.linspace(0, 2*np.pi, 100, endpoint=False)
+    # tilted ellipse with noise and a few outliers
+    pts = np.stack((30*np.cos(t), 20*np.sin(t), rng.normal(0, 0.05, len(t))), axis=1)
+    pts[::25,2] += 15
+    rotation = np.linalg.qr(rng.normal(size=(3,3)))[0]
+    pts = pts @ rotation.T + [1,2,3]
+    centroid, normal, axis_u, axis_v = contour.fit_plane(pts)
+    assert_frame(normal, axis_u, axis_v)
+    assert abs(normal @ rotation[:,2]) > 0.9999
+    # the normal follows the direction of the polyline
+    assert np.allclose(contour.fit_plane(pts[::-1])[1], -normal)
+    # the outliers, 15 above the plane, are rejected
+    assert abs((centroid - [1,2,3]) @ rotation[:,2]) < 0.05
+
+@pytest.mark.parametrize('n_pts', [2, 20])
+def test_fit_plane_collinear(n_pts):
+    t = np.linspace(0, 1, n_pts)[:,None]
+    pts = t*[1,2,3]
+    centroid, normal, axis_u, axis_v = contour.fit_plane(pts)
+    assert np.all(np.isfinite(normal))
+    assert_frame(normal, axis_u, axis_v)
+    assert np.allclose(centroid, [0.5,1,1.5])
+    assert abs(normal @ [1,2,3]) < 1e-9
+
+def smooth_reference(mesh, weight, iterations, factor, strength):
+    '''
+    Laplacian smoothing visiting the vertices one by one
+    '''
+    neighbors = [[] for v in mesh.vertices]
+    for a, b in mesh.edges.tolist():
+        neighbors[a].append(b)
+        neighbors[b].append(a)
+    smooth = list(weight)
+    for i in range(iterations):
+        smooth = [w + factor*(np.mean([smooth[n] for n in nbs]) - w) if nbs else w
+            for w, nbs in zip(smooth, neighbors)]
+    return np.asarray(weight) + (np.array(smooth) - weight)*strength
+
+@pytest.mark.parametrize('use_scipy', [False, True])
+def test_smooth(monkeypatch, use_scipy):
+    if use_scipy: pytest.importorskip('scipy')
+    else: monkeypatch.setattr(contour, 'sparse', None)
+    mesh, weight = grid_mesh(12)
+    # an isolated vertex keeps its weight
+    mesh = contour.ContourMesh(np.concatenate((mesh.vertices, [[50,50,0]])), mesh.edges,
+        mesh.loop_start, mesh.loop_total, mesh.loop_verts, mesh.loop_edges)
+    weight = np.append(weight, 0.7)
+    smooth = mesh.smooth(weight, 4, 0.5, 0.8)
+    assert (mesh.average is not False) == use_scipy
+    assert np.allclose(smooth, smooth_reference(mesh, weight, 4, 0.5, 0.8))
+    assert smooth[-1] == 0.7
+    assert np.allclose(mesh.smooth(np.full(len(weight), 0.3)), 0.3)
+    assert np.array_equal(mesh.smooth(weight, 0), weight)
+
+def test_split_faces_origin(numpy_only):
+    mesh, weight = grid_mesh()
+    split = contour.split_faces(mesh, weight, 0.5, return_origin=True)
+    vertices, loop_start, loop_total, loop_verts, new_weight, faces_side, origin = split
+    assert len(origin) == len(loop_start)
+    # the pieces of every face cover its area
+    area = contour.faces_area(vertices, loop_start, loop_total, loop_verts)
+    original = contour.faces_area(mesh.vertices, mesh.loop_start, mesh.loop_total, mesh.loop_verts)
+    assert np.allclose(np.bincount(origin, area, len(mesh.loop_start)), original)
+    origin = contour.split_faces(mesh, weight, 2, return_origin=True)[-1]
+    assert np.array_equal(origin, np.arange(len(mesh.loop_start)))
+
+def test_nudge_iso_value(numpy_only):
+    mesh, weight = grid_mesh()
+    assert contour.nudge_iso_value(weight, 0.5) == 0.5
+    weight = weight.copy()
+    weight[::7] = 0.5
+    iso_val = contour.nudge_iso_value(weight, 0.5)
+    assert iso_val != 0.5 and abs(iso_val - 0.5) < 1e-5
+    assert np.abs(weight - iso_val).min() >= 2e-6
+    # no degenerate split edges
+    vertices, loop_start, loop_total, loop_verts = contour.split_faces(mesh, weight, iso_val)[:4]
+    loops = np.stack((loop_verts, np.roll(loop_verts, -1)), axis=1)
+    loops[loop_start + loop_total - 1, 1] = loop_verts[loop_start]
+    lengths = np.linalg.norm(vertices[loops[:,0]] - vertices[loops[:,1]], axis=1)
+    assert lengths.min() > 1e-6
+
+def face_scan(n=220):
+    '''
+    Synthetic face heightfield on a 1 mm grid looking towards -Y, the nose tip
+    at the origin and the chin 65 mm below. Returns the vertices, the edges
+    and the vertex normals.
+    '''
+    mesh = grid_mesh(n)[0]
+    x = mesh.vertices[:,0] - n/2
+    z = mesh.vertices[:,1] - 150
+    def bump(cx, cz, s, h):
+        return h*np.exp(-((x - cx)**2 + (z - cz)**2)/(2*s*s))
+    depth = 40*np.exp(-(x/70)**2) + bump(0, 0, 8, 25) + bump(0, -35, 10, 8) + bump(0, -65, 12, 12)
+    depth = depth - 65
+    # the neck recedes
+    depth[z < -80] -= 0.8*(-80 - z[z < -80])
+    vertices = np.stack((x, -depth, z), axis=1)
+    dx, dz = np.gradient(-depth.reshape((n,n)), axis=(1,0))
+    normals = np.stack((dx.reshape(-1), -np.ones(n*n), dz.reshape(-1)), axis=1)
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    return vertices, mesh.edges, normals
+
+def rotate_z(vectors, angle):
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    return vectors @ np.array([[c,-s,0],[s,c,0],[0,0,1]]).T
+
+@pytest.mark.parametrize('use_normals', [False, True])
+def test_is_face_aligned(use_normals):
+    vertices, edges, normals = face_scan()
+    if not use_normals: normals = None
+    assert contour.is_face_aligned(vertices, normals)
+    assert contour.is_face_aligned(rotate_z(vertices, 20), None if normals is None else rotate_z(normals, 20))
+    for angle in (60, 90, 180, 270):
+        rotated_normals = None if normals is None else rotate_z(normals, angle)
+        assert not contour.is_face_aligned(rotate_z(vertices, angle), rotated_normals)
+    # the sides of a closed shell cancel the normals, the nose still tells the front
+    shell = np.concatenate((vertices, vertices + [0,2,0]))
+    shell_normals = np.concatenate((np.ones((len(vertices),3))*[0,-1,0], np.ones((len(vertices),3))*[0,1,0]))
+    assert contour.is_face_aligned(shell, shell_normals)
+    assert not contour.is_face_aligned(rotate_z(shell, 180), rotate_z(shell_normals, 180))
+
+def test_mask_area_weight():
+    vertices, edges, normals = face_scan()
+    weight, nose, chin = contour.mask_area_weight(vertices, edges, normals)
+    assert np.allclose(vertices[nose], 0, atol=0.1)
+    assert abs(vertices[chin,0]) <= 1 and abs(vertices[chin,2] + 65) <= 2
+    assert set(np.unique(weight)) == {0, 1}
+    area = vertices[weight > 0]
+    d = vertices[nose,2] - vertices[chin,2]
+    # the ellipse from 0.6 above the nose to 0.15 below the chin
+    assert area[:,2].max() <= 0.6*d + 1 and area[:,2].max() > 0.6*d - 2
+    assert area[:,2].min() >= vertices[chin,2] - 0.15*d - 1
+    assert np.abs(area[:,0]).max() <= 0.95*d + 1
+    # a single component around the nose
+    inside = edges[(weight[edges[:,0]] > 0) & (weight[edges[:,1]] > 0)]
+    labels = contour.connected_components(inside, len(vertices))
+    assert len(np.unique(labels[weight > 0])) == 1
+    # without the chin the average nose-chin distance is used
+    upper = vertices[:,2] > -40
+    index = np.full(len(vertices), -1)
+    index[upper] = np.arange(upper.sum())
+    upper_edges = index[edges[upper[edges[:,0]] & upper[edges[:,1]]]]
+    weight, nose, chin = contour.mask_area_weight(vertices[upper], upper_edges, normals[upper], chin_distance=50)
+    assert chin == -1
+    assert vertices[upper][weight > 0][:,2].max() <= 0.6*50 + 1
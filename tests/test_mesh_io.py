@@ -0,0 +1,201 @@
+# Tests of the bpy-free scan readers and writers, run with: python -m pytest tests
+
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mesh_io
+
+def write_obj(path, objects):
+    '''
+    OBJ with a block of vertices and faces for every object. The faces of
+    the last object use negative indexes.
+    '''
+    lines = []
+    offset = 0
+    for i, (vertices, faces) in enumerate(objects):
+        lines.append('o Object{}\n'.format(i))
+        lines += ['v {} {} {}\n'.format(*co) for co in vertices]
+        for face in faces:
+            if i == len(objects) - 1: face = [f - len(vertices) for f in face]
+            else: face = [f + offset + 1 for f in face]
+            lines.append('f ' + ' '.join('{}/1/1'.format(f) for f in face) + '\n')
+        offset += len(vertices)
+    with open(path, 'w') as f: f.writelines(lines)
+
+def grid_objects(n_objects=3, n=4):
+    '''
+    Grids of quads and triangles, shifted along X
+    '''
+    index = np.arange(n*n).reshape((n,n))
+    quads = np.stack((index[:-1,:-1], index[:-1,1:], index[1:,1:], index[1:,:-1]), axis=-1).reshape((-1,4))
+    y, x = np.divmod(np.arange(n*n), n)
+    objects = []
+    for i in range(n_objects):
+        vertices = np.stack((x + i*n, y, np.full(n*n, i)), axis=1).astype('float')
+        faces = [list(q) for q in quads[:len(quads)//2]]
+        faces += [[q[0], q[1], q[2]] for q in quads[len(quads)//2:]]
+        objects.append((vertices, faces))
+    return objects
+
+def test_read_obj_interleaved_chunks(tmp_path):
+    path = str(tmp_path / 'scan.obj')
+    objects = grid_objects()
+    write_obj(path, objects)
+    whole = np.concatenate(list(mesh_io.read_obj_chunks(path)))
+    # the chunks split the vertices and faces blocks in different places
+    for chunk_size in range(1, 8):
+        chunked = np.concatenate(list(mesh_io.read_obj_chunks(path, chunk_size=chunk_size)))
+        assert np.array_equal(whole, chunked)
+    # fan triangulation of the quads plus the triangles
+    n_triangles = sum(sum(len(f) - 2 for f in faces) for _, faces in objects)
+    assert len(whole) == n_triangles
+    for i, (vertices, faces) in enumerate(objects):
+        assert np.array_equal(whole[(n_triangles//len(objects))*i][0], vertices[faces[0][0]])
+
+def test_read_decimated_chunk_size(tmp_path):
+    path = str(tmp_path / 'scan.obj')
+    write_obj(path, grid_objects())
+    vertices, triangles = mesh_io.read_decimated(path, cell_size=0.1)
+    chunked_vertices, chunked_triangles = mesh_io.read_decimated(path, cell_size=0.1, chunk_size=3)
+    assert np.allclose(vertices, chunked_vertices)
+    assert np.array_equal(triangles, chunked_triangles)
+
+def test_pack_cells_range():
+    cells = np.array([[0,0,0], [-(1 << 20), (1 << 20) - 1, 5]])
+    keys = mesh_io.pack_cells(cells)
+    assert len(np.unique(keys)) == 2
+    with pytest.raises(ValueError):
+        mesh_io.pack_cells(np.array([[1 << 20, 0, 0]]))
+    with pytest.raises(ValueError):
+        mesh_io.pack_cells(np.array([[0, -(1 << 20) - 1, 0]]))
+
+def test_vertex_clustering_duplicates():
+    triangle = np.array([[0.1,0.1,0], [1.1,0.1,0], [0.1,1.1,0]])
+    clustering = mesh_io.VertexClustering(cell_size=1)
+    # the same triangle twice, the second time flipped and in another chunk
+    clustering.add(triangle[None])
+    clustering.add(triangle[None, ::-1] + 0.2)
+    vertices, triangles = clustering.result()
+    assert len(vertices) == 3
+    assert len(triangles) == 1
+    # the vertices are the mean of the points of every cell
+    assert np.allclose(np.sort(vertices[:,0]), [0.2, 0.2, 1.2])
+
+def test_vertex_clustering_collapse():
+    triangles = np.array([
+        [[0.5,0.5,0], [1.5,0.5,0], [0.5,1.5,0]],
+        # inside a single cell
+        [[5.1,5.1,0], [5.2,5.1,0], [5.1,5.2,0]],
+        # two corners in the same cell
+        [[0.5,0.5,0], [0.6,0.6,0], [3.5,3.5,0]]
+        ])
+    clustering = mesh_io.VertexClustering(cell_size=1)
+    clustering.add(triangles)
+    vertices, faces = clustering.result()
+    assert len(faces) == 1
+    # the points of the collapsed triangles are removed
+    assert len(vertices) == 3
+    assert vertices[:,0].max() < 2
+
+def write_stl_ascii(path, triangles):
+    with open(path, 'w') as f:
+        f.write('solid scan\n')
+        for triangle in triangles:
+            f.write('  facet normal 0 0 1\n    outer loop\n')
+            for co in triangle: f.write('      vertex {} {} {}\n'.format(*co))
+            f.write('    endloop\n  endfacet\n')
+        f.write('endsolid scan\n')
+
+def random_triangles(n=50, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((n,3,3))
+
+def test_is_binary_stl(tmp_path):
+    binary = str(tmp_path / 'binary.stl')
+    ascii = str(tmp_path / 'ascii.stl')
+    triangles = random_triangles()
+    mesh_io.write_stl_binary(binary, triangles, header=b'solid binary')
+    write_stl_ascii(ascii, triangles)
+    assert mesh_io.is_binary_stl(binary)
+    assert not mesh_io.is_binary_stl(ascii)
+    # shorter than the header
+    empty = str(tmp_path / 'empty.stl')
+    with open(empty, 'w') as f: f.write('solid\nendsolid\n')
+    assert not mesh_io.is_binary_stl(empty)
+
+def test_read_stl_ascii_chunks(tmp_path):
+    path = str(tmp_path / 'ascii.stl')
+    triangles = random_triangles()
+    write_stl_ascii(path, triangles)
+    whole = np.concatenate(list(mesh_io.read_stl_chunks(path)))
+    assert np.allclose(whole, triangles)
+    # the chunks end in the middle of the triangles
+    for chunk_size in (1, 2, 5):
+        chunks = list(mesh_io.read_stl_chunks(path, chunk_size=chunk_size))
+        assert len(chunks) > 1
+        assert np.array_equal(np.concatenate(chunks), whole)
+
+def test_read_stl_binary_chunks(tmp_path):
+    path = str(tmp_path / 'binary.stl')
+    triangles = random_triangles()
+    mesh_io.write_stl_binary(path, triangles)
+    chunks = list(mesh_io.read_stl_chunks(path, chunk_size=16))
+    assert [len(c) for c in chunks] == [16, 16, 16, 2]
+    assert np.allclose(np.concatenate(chunks), triangles, atol=1e-6)
+
+def welded_points(size=10, seed=0):
+    '''
+    Corners of random triangles, every corner repeated three times with a
+    noise smaller than the welding tolerance
+    '''
+    rng = np.random.default_rng(seed)
+    points = rng.random((40,3))*size
+    index = np.repeat(np.arange(len(points)), 3)
+    noisy = points[index] + (rng.random((len(index),3)) - 0.5)*1e-5
+    return noisy, index
+
+@pytest.mark.parametrize('size', [10, 1e7], ids=['packed', 'rows'])
+def test_weld_vertices(size):
+    # the large size needs more than 63 bits and sorts the cells as rows
+    points, index = welded_points(size)
+    vertices, inverse = mesh_io.weld_vertices(points, tolerance=0.001)
+    assert len(vertices) == 40
+    assert np.allclose(vertices[inverse], points, atol=0.001)
+    # the points of the same vertex share the index
+    assert np.array_equal(np.unique(np.stack((index, inverse), axis=1), axis=0)[:,0], np.arange(40))
+
+def test_read_stl_welded(tmp_path):
+    # a closed tetrahedron and a degenerate triangle
+    vertices = np.array([[0,0,0], [1,0,0], [0,1,0], [0,0,1]], dtype='float')
+    faces = np.array([[0,2,1], [0,1,3], [1,2,3], [2,0,3], [0,1,1]])
+    for name in ('binary.stl', 'ascii.stl'):
+        path = str(tmp_path / name)
+        if name == 'binary.stl': mesh_io.write_stl_binary(path, vertices[faces])
+        else: write_stl_ascii(path, vertices[faces])
+        welded, triangles = mesh_io.read_stl_welded(path)
+        assert len(welded) == 4
+        assert len(triangles) == 4
+        assert np.allclose(welded[triangles], vertices[faces[:4]])
+
+def test_write_stl_binary_round_trip(tmp_path):
+    path = str(tmp_path / 'mask.stl')
+    triangles = random_triangles()
+    # degenerate triangle, without a normal
+    triangles[0] = [[0,0,0], [1,1,1], [2,2,2]]
+    assert mesh_io.write_stl_binary(path, triangles, header=b'Mask') == len(triangles)
+    assert os.path.getsize(path) == 84 + 50*len(triangles)
+    with open(path, 'rb') as f: assert f.read(80) == b'Mask'.ljust(80, b' ')
+    data = mesh_io.read_stl_binary(path)
+    assert np.allclose(data['vertices'], triangles, atol=1e-6)
+    normals = np.cross(triangles[:,1] - triangles[:,0], triangles[:,2] - triangles[:,0])
+    normals[1:] /= np.linalg.norm(normals[1:], axis=1, keepdims=True)
+    assert np.allclose(data['normal'], normals, atol=1e-6)
+    assert not data['attribute'].any()
+
+def test_write_stl_binary_empty(tmp_path):
+    path = str(tmp_path / 'empty.stl')
+    assert mesh_io.write_stl_binary(path, np.zeros((0,3,3))) == 0
+    assert mesh_io.is_binary_stl(path)
+    assert len(mesh_io.read_stl_binary(path)) == 0
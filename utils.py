@@ -16,70 +16,13 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
-import bpy, bmesh
-import threading
+import bpy, bmesh, zlib
+from bpy.app.handlers import persistent
 import numpy as np
-import multiprocessing
-from multiprocessing import Process, Pool
 from mathutils import Vector
-try: from .numba_functions import numba_lerp2, numba_lerp2_4
-except: pass
-
-weight = []
-n_threads = multiprocessing.cpu_count()
-
-class ThreadVertexGroup(threading.Thread):
-    def __init__ ( self, id, vertex_group, n_verts):
-        self.id = id
-        self.vertex_group = vertex_group
-        self.n_verts = n_verts
-        threading.Thread.__init__ ( self )
-
-    def run (self):
-        global weight
-        global n_threads
-        verts = np.arange(int(self.n_verts/8))*8 + self.id
-        for v in verts:
-            try:
-                weight[v] = self.vertex_group.weight(v)
-            except:
-                pass
-
-def thread_read_weight(_weight, vertex_group):
-    global weight
-    global n_threads
-    #print(n_threads)
-    weight = _weight
-    n_verts = len(weight)
-    threads = [ThreadVertexGroup(i, vertex_group, n_verts) for i in range(n_threads)]
-    for t in threads: t.start()
-    for t in threads: t.join()
-    return weight
-
-def process_read_weight(id, vertex_group, n_verts):
-    global weight
-    global n_threads
-    verts = np.arange(int(self.n_verts/8))*8 + self.id
-    for v in verts:
-        try:
-            weight[v] = self.vertex_group.weight(v)
-        except:
-            pass
-
-
-def read_weight(_weight, vertex_group):
-    global weight
-    global n_threads
-    #print(n_threads)
-    weight = _weight
-    n_verts = len(weight)
-    n_cores = multiprocessing.cpu_count()
-    pool = Pool(processes=n_cores)
-    multiple_results = [pool.apply_async(process_read_weight, (i, vertex_group, n_verts)) for i in range(n_cores)]
-    #processes = [Process(target=process_read_weight, args=(i, vertex_group, n_verts)) for i in range(n_threads)]
-    #for t in processes: t.start()
-    #for t in processes: t.join()
-    return weight
+from .contour import clean_polyline, faces_area
+try: from .numba_functions import numba_lerp2
+except: numba_lerp2 = None
 
 #Recursivly transverse layer_collection for a particular name
 def recurLayerCollection(layerColl, collName):
@@ -121,18 +64,12 @@ def lerp3(v1, v2, v3, v4, v):
     nor.normalize()
     return loc + nor * v.z
 
-import sys
 def np_lerp2(v00, v10, v01, v11, vx, vy):
-    if 'numba' in sys.modules and False:
-        if len(v00.shape) == 3:
-            co2 = numba_lerp2(v00, v10, v01, v11, vx, vy)
-        elif len(v00.shape) == 4:
-            co2 = numba_lerp2_4(v00, v10, v01, v11, vx, vy)
-    #except:
-    else:
-        co0 = v00 + (v10 - v00) * vx
-        co1 = v01 + (v11 - v01) * vx
-        co2 = co0 + (co1 - co0) * vy
+    if numba_lerp2 is not None:
+        return numba_lerp2(v00, v10, v01, v11, vx, vy)
+    co0 = v00 + (v10 - v00) * vx
+    co1 = v01 + (v11 - v01) * vx
+    co2 = co0 + (co1 - co0) * vy
     return co2
 
 
@@ -198,6 +135,36 @@ def simple_to_mesh(ob):
     me.calc_normals()
     return me
 
+def bake_modifiers(ob, modifiers=None, depsgraph=None):
+    '''
+    Apply the modifiers of the object with a single evaluation of the stack.
+    modifiers: names of the modifiers to apply (all of them if None), they
+        are evaluated in stack order skipping the others, that are kept
+    The new mesh replaces the object's data, selection and active object
+    are not changed. Returns the new mesh.
+    '''
+    if modifiers is None: modifiers = [m.name for m in ob.modifiers]
+    # disable the modifiers that are kept
+    visibility = {m.name: m.show_viewport for m in ob.modifiers}
+    for m in ob.modifiers: m.show_viewport = m.name in modifiers
+    try:
+        if depsgraph is None: depsgraph = bpy.context.evaluated_depsgraph_get()
+        depsgraph.update()
+        ob_eval = ob.evaluated_get(depsgraph)
+        me = bpy.data.meshes.new_from_object(ob_eval, preserve_all_data_layers=True, depsgraph=depsgraph)
+    finally:
+        for m in ob.modifiers: m.show_viewport = visibility[m.name]
+    for name in modifiers:
+        if name in ob.modifiers: ob.modifiers.remove(ob.modifiers[name])
+    old_me = ob.data
+    ob.data = me
+    name = old_me.name
+    if old_me.users == 0:
+        mesh_arrays_invalidate(old_me)
+        bpy.data.meshes.remove(old_me)
+    me.name = name
+    return me
+
 def join_objects(objects, link_to_scene=True, make_active=False):
     C = bpy.context
     bm = bmesh.new()
@@ -247,20 +214,15 @@ def array_mesh(ob, n):
 ### MESH FUNCTIONS
 
 def calc_verts_area(me):
-    n_verts = len(me.vertices)
-    n_faces = len(me.polygons)
-    vareas = np.zeros(n_verts)
-    vcount = np.zeros(n_verts)
-    parea = [0]*n_faces
-    pverts = [0]*n_faces*4
-    me.polygons.foreach_get('area', parea)
-    me.polygons.foreach_get('vertices', pverts)
-    parea = np.array(parea)
-    pverts = np.array(pverts).reshape((n_faces, 4))
-    for a, verts in zip(parea,pverts):
-        vareas[verts] += a
-        vcount[verts] += 1
-    return vareas / vcount
+    '''
+    Mean area of the faces around every vertex
+    '''
+    arrays = mesh_arrays(me)
+    area = faces_area(arrays.vertices, arrays.loop_start, arrays.loop_total, arrays.loop_verts)
+    n_verts = len(arrays.vertices)
+    vareas = np.bincount(arrays.loop_verts, np.repeat(area, arrays.loop_total), minlength=n_verts)
+    vcount = np.bincount(arrays.loop_verts, minlength=n_verts)
+    return np.divide(vareas, vcount, out=np.zeros(n_verts), where=vcount > 0)
 
 def calc_verts_area_bmesh(me):
     bm = bmesh.new()
@@ -489,167 +451,193 @@ def get_patches_(me_low, me_high, sides, subs):
     return patches.astype(dtype='int')
 
 
+# Snapshot of the mesh data as NumPy arrays, shared by all the helpers.
+# foreach_get writes directly into typed buffers, every array is read only
+# when first requested and cached for the mesh datablock until its topology
+# or coordinates change.
+mesh_arrays_cache = {}      # mesh pointer -> MeshArrays
+mesh_arrays_counter = {}    # mesh pointer -> geometry changes counter
+
+mesh_arrays_layout = {
+    # name: (collection, attribute, dtype, components)
+    'vertices': ('vertices', 'co', 'float32', 3),
+    'normals': ('vertices', 'normal', 'float32', 3),
+    'edges': ('edges', 'vertices', 'int32', 2),
+    'loop_start': ('polygons', 'loop_start', 'int32', 1),
+    'loop_total': ('polygons', 'loop_total', 'int32', 1),
+    'loop_verts': ('loops', 'vertex_index', 'int32', 1),
+    'loop_edges': ('loops', 'edge_index', 'int32', 1),
+    'triangles': ('loop_triangles', 'vertices', 'int32', 3)
+    }
+
+def mesh_arrays_key(mesh):
+    return (len(mesh.vertices), len(mesh.edges), len(mesh.loops), len(mesh.polygons),
+        mesh_arrays_counter.get(mesh.as_pointer(), 0))
+
+def mesh_geometry_key(mesh):
+    '''
+    Key of the topology and of the coordinates of the mesh, it doesn't
+    change with the weights
+    '''
+    arrays = mesh_arrays(mesh)
+    return mesh_arrays_key(mesh)[:4] + tuple(zlib.crc32(a) for a in
+        (arrays.vertices, arrays.edges, arrays.loop_start, arrays.loop_verts))
+
+class MeshArrays:
+    '''
+    Typed arrays of a mesh (see mesh_arrays_layout), read on demand.
+    The arrays are shared and read-only, copy them before editing.
+    Use mesh_arrays(mesh) to get the cached snapshot.
+    '''
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.key = mesh_arrays_key(mesh)
+        # freed meshes can leave their pointer to new datablocks
+        self.uid = getattr(mesh, 'session_uid', None)
+        self.arrays = {}
+
+    def is_valid(self, mesh):
+        '''
+        The snapshot still belongs to the mesh and matches its geometry
+        '''
+        try: self.mesh.name
+        except ReferenceError: return False
+        return self.uid == getattr(mesh, 'session_uid', None) and self.key == mesh_arrays_key(mesh)
+
+    def __getattr__(self, name):
+        if name not in mesh_arrays_layout: raise AttributeError(name)
+        array = self.arrays.get(name)
+        if array is None:
+            collection, attribute, dtype, size = mesh_arrays_layout[name]
+            if collection == 'loop_triangles' and len(self.mesh.loop_triangles) == 0:
+                self.mesh.calc_loop_triangles()
+            items = getattr(self.mesh, collection)
+            array = np.empty(len(items)*size, dtype=dtype)
+            items.foreach_get(attribute, array)
+            if size > 1: array = array.reshape((-1, size))
+            array.flags.writeable = False
+            self.arrays[name] = array
+        return array
+
+def mesh_arrays(mesh):
+    '''
+    Cached MeshArrays of the mesh. Evaluated meshes are not cached.
+    '''
+    if getattr(mesh, 'is_evaluated', False): return MeshArrays(mesh)
+    pointer = mesh.as_pointer()
+    arrays = mesh_arrays_cache.get(pointer)
+    if arrays is None or not arrays.is_valid(mesh):
+        mesh_arrays_prune()
+        arrays = MeshArrays(mesh)
+        mesh_arrays_cache[pointer] = arrays
+    arrays.mesh = mesh
+    return arrays
+
+def mesh_arrays_prune():
+    '''
+    Drop the snapshots of the removed meshes
+    '''
+    for pointer, arrays in list(mesh_arrays_cache.items()):
+        try: arrays.mesh.name
+        except ReferenceError:
+            del mesh_arrays_cache[pointer]
+            mesh_arrays_counter.pop(pointer, None)
+
+def mesh_arrays_invalidate(mesh):
+    '''
+    Tag the geometry of the mesh as changed
+    '''
+    pointer = mesh.as_pointer()
+    mesh_arrays_counter[pointer] = mesh_arrays_counter.get(pointer, 0) + 1
+    mesh_arrays_cache.pop(pointer, None)
+
+@persistent
+def mesh_arrays_depsgraph(scene, depsgraph=None):
+    # the temporary modifiers of the weights readers don't change the mesh
+    if depsgraph is None or is_internal_update(): return
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry: continue
+        id = update.id.original
+        if isinstance(id, bpy.types.Object): id = id.data
+        if isinstance(id, bpy.types.Mesh): mesh_arrays_invalidate(id)
+
+@persistent
+def mesh_arrays_clear(*args):
+    mesh_arrays_cache.clear()
+    mesh_arrays_counter.clear()
+
+def mesh_arrays_register():
+    bpy.app.handlers.depsgraph_update_post.append(mesh_arrays_depsgraph)
+    # undo and redo swap the mesh data
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        handlers.append(mesh_arrays_clear)
+
+def mesh_arrays_unregister():
+    if mesh_arrays_depsgraph in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(mesh_arrays_depsgraph)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        if mesh_arrays_clear in handlers: handlers.remove(mesh_arrays_clear)
+    mesh_arrays_clear()
+
 def get_vertices_numpy(mesh):
-    n_verts = len(mesh.vertices)
-    verts = [0]*n_verts*3
-    mesh.vertices.foreach_get('co', verts)
-    verts = np.array(verts).reshape((n_verts,3))
-    return verts
+    return mesh_arrays(mesh).vertices
 
 def get_vertices_and_normals_numpy(mesh):
-    n_verts = len(mesh.vertices)
-    verts = [0]*n_verts*3
-    normals = [0]*n_verts*3
-    mesh.vertices.foreach_get('co', verts)
-    mesh.vertices.foreach_get('normal', normals)
-    verts = np.array(verts).reshape((n_verts,3))
-    normals = np.array(normals).reshape((n_verts,3))
-    return verts, normals
+    arrays = mesh_arrays(mesh)
+    return arrays.vertices, arrays.normals
 
 def get_edges_numpy(mesh):
-    n_edges = len(mesh.edges)
-    edges = [0]*n_edges*2
-    mesh.edges.foreach_get('vertices', edges)
-    edges = np.array(edges).reshape((n_edges,2)).astype('int')
-    return edges
+    return mesh_arrays(mesh).edges
 
 def get_edges_id_numpy(mesh):
-    n_edges = len(mesh.edges)
-    edges = [0]*n_edges*2
-    mesh.edges.foreach_get('vertices', edges)
-    edges = np.array(edges).reshape((n_edges,2))
-    indexes = np.arange(n_edges).reshape((n_edges,1))
-    edges = np.concatenate((edges,indexes), axis=1)
-    return edges
+    edges = mesh_arrays(mesh).edges
+    indexes = np.arange(len(edges)).reshape((-1,1))
+    return np.concatenate((edges, indexes), axis=1)
+
+def get_faces_csr_numpy(mesh):
+    '''
+    Flat (CSR) polygons representation. The vertices of the face i are
+    loop_verts[loop_start[i]:loop_start[i]+loop_total[i]]
+    '''
+    arrays = mesh_arrays(mesh)
+    return arrays.loop_start, arrays.loop_total, arrays.loop_verts
+
+def get_loop_edges_numpy(mesh):
+    return mesh_arrays(mesh).loop_edges
+
+def get_triangles_numpy(mesh):
+    return mesh_arrays(mesh).triangles
 
 def get_vertices(mesh):
-    n_verts = len(mesh.vertices)
-    verts = [0]*n_verts*3
-    mesh.vertices.foreach_get('co', verts)
-    verts = np.array(verts).reshape((n_verts,3))
-    verts = [Vector(v) for v in verts]
+    verts = [Vector(v) for v in mesh_arrays(mesh).vertices]
     return verts
 
 def get_faces(mesh):
-    faces = [[v for v in f.vertices] for f in mesh.polygons]
+    loop_start, loop_total, loop_verts = get_faces_csr_numpy(mesh)
+    verts = loop_verts.tolist()
+    return [verts[start:start+total] for start, total in zip(loop_start.tolist(), loop_total.tolist())]
+
+def faces_array(mesh, loop_values):
+    '''
+    Values of the loops grouped by face, as a (n_faces, n_sides, ...) array
+    when all the faces have the same sides, otherwise as an object array
+    '''
+    loop_start, loop_total, loop_verts = get_faces_csr_numpy(mesh)
+    if len(loop_total) > 0 and (loop_total == loop_total[0]).all():
+        return loop_values.reshape((len(loop_total), loop_total[0]) + loop_values.shape[1:])
+    faces = np.empty(len(loop_total), dtype='object')
+    faces[:] = np.split(loop_values, loop_start[1:])
     return faces
 
 def get_faces_numpy(mesh):
-    faces = [[v for v in f.vertices] for f in mesh.polygons]
-    return np.array(faces)
+    return faces_array(mesh, np.array(mesh_arrays(mesh).loop_verts))
 
 def get_faces_edges_numpy(mesh):
-    faces = [v.edge_keys for f in mesh.polygons]
-    return np.array(faces)
-
-#try:
-#from numba import jit, njit
-#from numba.typed import List
-'''
-@jit
-def find_curves(edges, n_verts):
-    #verts_dict = {key:[] for key in range(n_verts)}
-    verts_dict = {}
-    for key in range(n_verts): verts_dict[key] = []
-    for e in edges:
-        verts_dict[e[0]].append(e[1])
-        verts_dict[e[1]].append(e[0])
-    curves = []#List()
-    loop1 = True
-    while loop1:
-        if len(verts_dict) == 0:
-            loop1 = False
-            continue
-        # next starting point
-        v = list(verts_dict.keys())[0]
-        # neighbors
-        v01 = verts_dict[v]
-        if len(v01) == 0:
-            verts_dict.pop(v)
-            continue
-        curve = []#List()
-        curve.append(v)         # add starting point
-        curve.append(v01[0])    # add neighbors
-        verts_dict.pop(v)
-        loop2 = True
-        while loop2:
-            last_point = curve[-1]
-            #if last_point not in verts_dict: break
-            v01 = verts_dict[last_point]
-            # curve end
-            if len(v01) == 1:
-                verts_dict.pop(last_point)
-                loop2 = False
-                continue
-            if v01[0] == curve[-2]:
-                curve.append(v01[1])
-                verts_dict.pop(last_point)
-            elif v01[1] == curve[-2]:
-                curve.append(v01[0])
-                verts_dict.pop(last_point)
-            else:
-                loop2 = False
-                continue
-            if curve[0] == curve[-1]:
-                loop2 = False
-                continue
-        curves.append(curve)
-    return curves
-'''
-def find_curves(edges, n_verts):
-    verts_dict = {key:[] for key in range(n_verts)}
-    for e in edges:
-        verts_dict[e[0]].append(e[1])
-        verts_dict[e[1]].append(e[0])
-    curves = []
-    while True:
-        if len(verts_dict) == 0: break
-        # next starting point
-        v = list(verts_dict.keys())[0]
-        # neighbors
-        v01 = verts_dict[v]
-        if len(v01) == 0:
-            verts_dict.pop(v)
-            continue
-        curve = []
-        if len(v01) > 1: curve.append(v01[1])    # add neighbors
-        curve.append(v)         # add starting point
-        curve.append(v01[0])    # add neighbors
-        verts_dict.pop(v)
-        # start building curve
-        while True:
-            #last_point = curve[-1]
-            #if last_point not in verts_dict: break
-
-            # try to change direction if needed
-            if curve[-1] in verts_dict: pass
-            elif curve[0] in verts_dict: curve.reverse()
-            else: break
-
-            # neighbors points
-            last_point = curve[-1]
-            v01 = verts_dict[last_point]
-
-            # curve end
-            if len(v01) == 1:
-                verts_dict.pop(last_point)
-                if curve[0] in verts_dict: continue
-                else: break
-
-            # chose next point
-            new_point = None
-            if v01[0] == curve[-2]: new_point = v01[1]
-            elif v01[1] == curve[-2]: new_point = v01[0]
-            #else: break
-
-            #if new_point != curve[1]:
-            curve.append(new_point)
-            verts_dict.pop(last_point)
-            if curve[0] == curve[-1]:
-                verts_dict.pop(new_point)
-                break
-        curves.append(curve)
-    return curves
+    '''
+    Edge keys (sorted vertices of the edges) of every face
+    '''
+    arrays = mesh_arrays(mesh)
+    return faces_array(mesh, np.sort(arrays.edges[arrays.loop_edges], axis=1))
 
 def curve_from_points(points, name='Curve'):
     curve = bpy.data.curves.new(name,'CURVE')
@@ -665,18 +653,7 @@ def curve_from_pydata(points, indexes, name='Curve', skip_open=False, merge_dist
     curve.dimensions = '3D'
     for c in indexes:
         # cleanup
-        pts = np.array([points[i] for i in c])
-        if merge_distance > 0:
-            pts1 = np.roll(pts,1,axis=0)
-            dist = np.linalg.norm(pts1-pts, axis=1)
-            count = 0
-            n = len(dist)
-            mask = np.ones(n).astype('bool')
-            for i in range(n):
-                count += dist[i]
-                if count > merge_distance: count = 0
-                else: mask[i] = False
-            pts = pts[mask]
+        pts = clean_polyline(np.array([points[i] for i in c]), merge_distance)
 
         bool_cyclic = c[0] == c[-1]
         if skip_open and not bool_cyclic: continue
@@ -687,12 +664,136 @@ def curve_from_pydata(points, indexes, name='Curve', skip_open=False, merge_dist
         co = np.concatenate((pts,w),axis=1).reshape((n_pts*4))
         s.points.foreach_set('co',co)
         s.use_cyclic_u = bool_cyclic
-    ob_curve = bpy.data.objects.new(name,curve)
-    bpy.context.collection.objects.link(ob_curve)
+    if ob_curve is None:
+        ob_curve = bpy.data.objects.new(name,curve)
+        bpy.context.collection.objects.link(ob_curve)
+    if set_active:
+        bpy.context.view_layer.objects.active = ob_curve
+    return ob_curve
+
+def curve_from_polylines(polylines, name='Curve', set_active=True, ob_curve=None):
+    '''
+    Curve object from a list of (points, cyclic) tuples
+    ob_curve: existing curve object to reuse, its splines are replaced
+    '''
+    if ob_curve is not None and ob_curve.type == 'CURVE':
+        curve = ob_curve.data
+        curve.splines.clear()
+    else:
+        curve = bpy.data.curves.new(name,'CURVE')
+        ob_curve = None
+    curve.dimensions = '3D'
+    for pts, bool_cyclic in polylines:
+        s = curve.splines.new('POLY')
+        n_pts = len(pts)
+        s.points.add(n_pts-1)
+        w = np.ones(n_pts).reshape((n_pts,1))
+        co = np.concatenate((pts,w),axis=1).reshape((n_pts*4))
+        s.points.foreach_set('co',co)
+        s.use_cyclic_u = bool_cyclic
+    if ob_curve is None:
+        ob_curve = bpy.data.objects.new(name,curve)
+        bpy.context.collection.objects.link(ob_curve)
     if set_active:
         bpy.context.view_layer.objects.active = ob_curve
     return ob_curve
 
+def mesh_from_polylines(polylines, name='Mesh', set_active=True):
+    '''
+    Mesh object with the vertices and the edges of a list of (points, cyclic)
+    polylines, the same that would be converted from a poly curve
+    '''
+    verts = [np.zeros((0,3))]
+    edges = [np.zeros((0,2), dtype='int')]
+    count = 0
+    for pts, bool_cyclic in polylines:
+        ids = np.arange(len(pts)) + count
+        edges.append(np.stack((ids[:-1], ids[1:]), axis=1))
+        if bool_cyclic and len(pts) > 2:
+            edges.append(np.array([[ids[-1], ids[0]]]))
+        verts.append(pts)
+        count += len(pts)
+    verts = np.concatenate(verts)
+    edges = np.concatenate(edges)
+    me = bpy.data.meshes.new(name)
+    me.vertices.add(len(verts))
+    me.vertices.foreach_set('co', verts.reshape(-1))
+    me.edges.add(len(edges))
+    me.edges.foreach_set('vertices', edges.astype('int32').reshape(-1))
+    me.update()
+    ob = bpy.data.objects.new(name, me)
+    bpy.context.collection.objects.link(ob)
+    if set_active:
+        bpy.context.view_layer.objects.active = ob
+    return ob
+
+def mesh_from_faces_csr(me, verts, loop_start, loop_total, loop_verts):
+    '''
+    Replace the geometry of the mesh with the given vertices and faces
+    '''
+    me.clear_geometry()
+    me.vertices.add(len(verts))
+    me.vertices.foreach_set('co', np.asarray(verts, dtype='float32').reshape(-1))
+    me.loops.add(len(loop_verts))
+    me.loops.foreach_set('vertex_index', np.asarray(loop_verts, dtype='int32'))
+    me.polygons.add(len(loop_start))
+    me.polygons.foreach_set('loop_start', np.asarray(loop_start, dtype='int32'))
+    try: me.polygons.foreach_set('loop_total', np.asarray(loop_total, dtype='int32'))
+    except: pass # computed from loop_start since Blender 3.6
+    me.update(calc_edges=True)
+    mesh_arrays_invalidate(me)
+    return me
+
+# foreach_get key, dtype and size of the attributes data
+attributes_layout = {
+    'FLOAT': ('value', 'float32', 1),
+    'INT': ('value', 'int32', 1),
+    'INT8': ('value', 'int32', 1),
+    'BOOLEAN': ('value', 'bool', 1),
+    'FLOAT2': ('vector', 'float32', 2),
+    'FLOAT_VECTOR': ('vector', 'float32', 3),
+    'FLOAT_COLOR': ('color', 'float32', 4),
+    'BYTE_COLOR': ('color', 'float32', 4),
+    'INT32_2D': ('value', 'int32', 2),
+    'QUATERNION': ('value', 'float32', 4)
+    }
+
+def get_faces_attributes(me):
+    '''
+    Values of the face attributes of the mesh, as a list of (name, data_type,
+    values). Material index and smooth shading are read as polygon properties
+    (data_type None) in the versions where they are not attributes.
+    '''
+    n_faces = len(me.polygons)
+    attributes = []
+    for attribute in getattr(me, 'attributes', []):
+        if attribute.domain != 'FACE' or attribute.name.startswith('.'): continue
+        if attribute.data_type not in attributes_layout: continue
+        key, dtype, size = attributes_layout[attribute.data_type]
+        values = np.empty(n_faces*size, dtype=dtype)
+        attribute.data.foreach_get(key, values)
+        attributes.append((attribute.name, attribute.data_type, values.reshape((n_faces, size))))
+    names = [name for name, data_type, values in attributes]
+    for prop, name, dtype in (('material_index', 'material_index', 'int32'), ('use_smooth', 'sharp_face', 'bool')):
+        if name in names: continue
+        values = np.empty(n_faces, dtype=dtype)
+        me.polygons.foreach_get(prop, values)
+        attributes.append((prop, None, values))
+    return attributes
+
+def set_faces_attributes(me, attributes, faces):
+    '''
+    Write the attributes read by get_faces_attributes on the new faces.
+    faces: index of the original face of every face of the mesh
+    '''
+    for name, data_type, values in attributes:
+        values = np.ascontiguousarray(values[faces]).reshape(-1)
+        if data_type is None:
+            me.polygons.foreach_set(name, values)
+            continue
+        attribute = me.attributes.get(name) or me.attributes.new(name, data_type, 'FACE')
+        attribute.data.foreach_set(attributes_layout[data_type][0], values)
+
 def curve_from_vertices(indexes, verts, name='Curve'):
     curve = bpy.data.curves.new(name,'CURVE')
     for c in indexes:
@@ -704,20 +805,179 @@ def curve_from_vertices(indexes, verts, name='Curve'):
 
 ### WEIGHT FUNCTIONS ###
 
+# Depsgraph updates triggered by the helpers, like the temporary modifiers of
+# get_weights_evaluated. The handlers skip them.
+internal_updates = {'count': 0}
+
+def is_internal_update():
+    return internal_updates['count'] > 0
+
+def get_weights_evaluated(ob, groups, depsgraph=None, strength=1024, default_weight=0):
+    '''
+    Read the Vertex Groups from the evaluated object, without visiting the
+    vertices in Python. Every group drives a temporary Displace modifier along
+    one local axis, so three groups are read from the coordinates of a single
+    evaluation. The other modifiers are disabled meanwhile, the stack is
+    restored even if the evaluation fails. The depsgraph updates are flagged
+    as internal, so the handlers can skip them (see is_internal_update).
+    default_weight: 1 assigns the unassigned vertices with weight 1 before
+        reading, through Vertex Weight Edit modifiers
+    Returns None if the object can't be evaluated.
+    '''
+    me = ob.data
+    n_verts = len(me.vertices)
+    weights = np.zeros((len(groups), n_verts))
+    if depsgraph is None: depsgraph = bpy.context.evaluated_depsgraph_get()
+    # apply the pending changes before ignoring the updates
+    depsgraph.update()
+    visibility = {m.name: m.show_viewport for m in ob.modifiers}
+    displace = []
+    edit = []
+    internal_updates['count'] += 1
+    try:
+        for m in ob.modifiers: m.show_viewport = False
+        def evaluated_co():
+            depsgraph.update()
+            ob_eval = ob.evaluated_get(depsgraph)
+            # objects out of the view layer aren't evaluated
+            if not ob_eval.is_evaluated or len(ob_eval.data.vertices) != n_verts: return None
+            me_eval = ob_eval.data
+            co = np.zeros(n_verts*3, dtype='float32')
+            me_eval.vertices.foreach_get('co', co)
+            return co.reshape((-1,3)).astype('float')
+        # shape keys move the evaluated vertices as well
+        if me.shape_keys: rest_co = evaluated_co()
+        else: rest_co = get_vertices_numpy(me)
+        for i in range(3 if default_weight else 0):
+            m = ob.modifiers.new(name='_members_' + 'XYZ'[i], type='VERTEX_WEIGHT_EDIT')
+            edit.append(m)
+            m.use_add = True
+            m.add_threshold = 0.5
+            m.default_weight = default_weight
+        for i in range(3):
+            m = ob.modifiers.new(name='_weights_' + 'XYZ'[i], type='DISPLACE')
+            displace.append(m)
+            m.direction = 'XYZ'[i]
+            m.space = 'LOCAL'
+            m.mid_level = 0
+            m.strength = strength
+        for i in range(0, len(groups), 3):
+            chunk = groups[i:i+3]
+            for j, m in enumerate(edit + displace):
+                m.show_viewport = j % 3 < len(chunk)
+                if j % 3 < len(chunk): m.vertex_group = ob.vertex_groups[int(chunk[j % 3])].name
+            co = evaluated_co()
+            if co is None or rest_co is None: return None
+            weights[i:i+len(chunk)] = ((co - rest_co)/strength).T[:len(chunk)]
+    except (RuntimeError, AttributeError):
+        return None
+    finally:
+        try:
+            for m in edit + displace: ob.modifiers.remove(m)
+            for m in ob.modifiers:
+                if m.name in visibility: m.show_viewport = visibility[m.name]
+            # evaluate the restored stack while the updates are still ignored
+            depsgraph.update()
+        finally:
+            internal_updates['count'] -= 1
+    return weights
+
+def get_weights_numpy(ob, groups, bm=None, return_members=False):
+    '''
+    Read several Vertex Groups at once, as an array with shape
+    (len(groups), n_verts). Unassigned vertices get weight 0. The weights are
+    read from the evaluated object when possible, otherwise the deform data
+    are visited a single time.
+    groups: list of Vertex Groups or Vertex Groups indexes
+    bm: optional bmesh of the object's mesh, its deform layer is used instead
+        of the mesh vertices
+    return_members: return also the vertices assigned to every group, as a
+        boolean array with the same shape
+    '''
+    groups = np.array([g if isinstance(g, int) else g.index for g in groups], dtype='int')
+    n_verts = len(bm.verts) if bm else len(ob.data.vertices)
+    weights = np.zeros((len(groups), n_verts))
+    members = np.zeros((len(groups), n_verts), dtype='bool')
+    if len(groups) == 0 or len(ob.vertex_groups) == 0:
+        return (weights, members) if return_members else weights
+    # the same group can be requested more than once
+    unique_groups, groups_rows = np.unique(groups, return_inverse=True)
+    groups_rows = groups_rows.reshape(-1)
+    # map every group index of the object to its row (-1 for skipped groups)
+    rows = np.full(len(ob.vertex_groups), -1, dtype='int')
+    rows[unique_groups] = np.arange(len(unique_groups))
+    if bm is None and ob.mode != 'EDIT':
+        unique_weights = get_weights_evaluated(ob, unique_groups)
+        if unique_weights is not None and not return_members:
+            return unique_weights[groups_rows]
+        # the unassigned vertices read 1 instead of 0
+        filled = get_weights_evaluated(ob, unique_groups, default_weight=1) if unique_weights is not None else None
+        if filled is not None:
+            unique_members = filled - unique_weights < 0.5
+            return unique_weights[groups_rows], unique_members[groups_rows]
+    # edit mode and objects out of the view layer, visit the deform data
+    if bm:
+        layer = bm.verts.layers.deform.active
+        if layer is None: return (weights, members) if return_members else weights
+        items = [(i, g, w) for i, v in enumerate(bm.verts) for g, w in v[layer].items()]
+    else:
+        items = [(i, g.group, g.weight) for i, v in enumerate(ob.data.vertices) for g in v.groups]
+    if len(items) == 0: return (weights, members) if return_members else weights
+    items = np.array(items)
+    verts = items[:,0].astype('int')
+    rows = rows[items[:,1].astype('int')]
+    mask = rows > -1
+    unique_weights = np.zeros((len(unique_groups), n_verts))
+    unique_weights[rows[mask], verts[mask]] = items[mask,2]
+    if not return_members: return unique_weights[groups_rows]
+    unique_members = np.zeros((len(unique_groups), n_verts), dtype='bool')
+    unique_members[rows[mask], verts[mask]] = True
+    return unique_weights[groups_rows], unique_members[groups_rows]
+
+def set_weight_numpy(ob, name, weight, members=None):
+    '''
+    Write the weights in the Vertex Group with the given name, created if
+    missing. Earlier assignments are cleared, then the vertices are added
+    once for every distinct value, as stored by the group (float32), so the
+    weights are written exactly.
+    members: vertices assigned to the group, explicit zeros included. By
+        default the vertices with a positive weight.
+    '''
+    vertex_group = ob.vertex_groups.get(name) or ob.vertex_groups.new(name=name)
+    vertex_group.remove(list(range(len(ob.data.vertices))))
+    weight = np.asarray(weight, dtype='float32')
+    members = np.flatnonzero(weight > 0 if members is None else members)
+    values, inverse = np.unique(weight[members], return_inverse=True)
+    order = np.argsort(inverse.reshape(-1), kind='stable')
+    bounds = np.searchsorted(inverse.reshape(-1)[order], np.arange(len(values)+1))
+    for i, value in enumerate(values.tolist()):
+        vertex_group.add(members[order[bounds[i]:bounds[i+1]]].tolist(), value, 'REPLACE')
+    ob.vertex_groups.active_index = vertex_group.index
+    return vertex_group
+
+def transfer_weights(src_points, src_weight, dst_points):
+    '''
+    Weight of the nearest source point for every destination point
+    '''
+    try:
+        from scipy.spatial import cKDTree
+        index = cKDTree(src_points).query(dst_points)[1]
+    except ImportError:
+        from mathutils.kdtree import KDTree
+        tree = KDTree(len(src_points))
+        for i, co in enumerate(src_points): tree.insert(co, i)
+        tree.balance()
+        index = np.array([tree.find(co)[1] for co in dst_points], dtype='int')
+    return np.asarray(src_weight)[index]
+
 def get_weight(vertex_group, n_verts):
-    weight = [0]*n_verts
-    for i in range(n_verts):
-        try: weight[i] = vertex_group.weight(i)
-        except: pass
-    return weight
+    return get_weight_numpy(vertex_group, n_verts).tolist()
 
 def get_weight_numpy(vertex_group, n_verts):
-    weight = [0]*n_verts
-    for i in range(n_verts):
-        try: weight[i] = vertex_group.weight(i)
-        except: pass
-    return np.array(weight)
-
+    weight = get_weights_numpy(vertex_group.id_data, [vertex_group])[0]
+    if len(weight) < n_verts:
+        weight = np.concatenate((weight, np.zeros(n_verts-len(weight))))
+    return weight[:n_verts]
 
 def bmesh_get_weight_numpy(group_index, layer, verts):
     weight = np.zeros(len(verts))